@@ -5,7 +5,6 @@ DATASETS_PATH = 'Datasets'
 MODELS_PATH   = 'Models'
 
 RANDOM_SEED = 1234
-MAX_DIR_SIZE = 10 # MBytes, for probability maps dirs
 
 FILENAME = 'Metrics.json'
 
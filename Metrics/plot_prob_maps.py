@@ -1,23 +1,22 @@
 import argparse
 import json
-import re
-import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.patches import Rectangle
-from os import path, listdir
+from os import path
+from scripts.probability_maps import load as load_probability_maps
+from scripts import scanpaths_store
 
 datasets_path = '../Datasets'
 results_path  = '../Results'
 
 def plot_probability_maps(human_scanpath, probability_maps_path, model_name, title):
-    probability_maps = sorted_alphanumeric(listdir(probability_maps_path))
+    _, probability_maps = load_probability_maps(probability_maps_path)
     image_size  = [human_scanpath['image_height'], human_scanpath['image_width']]
     target_bbox = human_scanpath['target_bbox']
 
     fig, ax = plt.subplots(nrows=1, ncols=len(probability_maps), figsize=[25,5])
     for index, prob_map in enumerate(probability_maps):
-        prob_map_df = pd.read_csv(path.join(probability_maps_path, prob_map))
-        grid_size   = prob_map_df.shape
+        grid_size   = prob_map.shape
         scanpath_x, scanpath_y = rescale_scanpath(human_scanpath, grid_size)
 
         rescaled_bbox = [rescale_coordinate(target_bbox[i], image_size[i % 2 == 1], grid_size[i % 2 == 1]) for i in range(len(target_bbox))]
@@ -33,7 +32,7 @@ def plot_probability_maps(human_scanpath, probability_maps_path, model_name, tit
         initial_color  = 'red'
         scanpath_color = 'darkorange'
 
-        ax[index].imshow(prob_map_df)
+        ax[index].imshow(prob_map)
         for i in range(index + 2):
             if i > 0:
                 ax[index].arrow(scanpath_x[i - 1], scanpath_y[i - 1], scanpath_x[i] - scanpath_x[i - 1], scanpath_y[i] - scanpath_y[i - 1], width=0.1, color=scanpath_color, alpha=0.5)
@@ -71,11 +70,6 @@ def rescale_scanpath(scanpath, image_size):
 
     return scanpath_x_rescaled, scanpath_y_rescaled
 
-def sorted_alphanumeric(data):
-    convert = lambda text: int(text) if text.isdigit() else text.lower()
-    alphanum_key = lambda key: [ convert(c) for c in re.split('([0-9]+)', key) ] 
-    return sorted(data, key=alphanum_key)
-
 def get_subject_str(subject_id):
     subject_str = str(subject_id)
     if subject_id < 10:
@@ -84,14 +78,13 @@ def get_subject_str(subject_id):
     return subject_str
 
 def load_human_scanpath(subject_id, dataset_name, image_name):
-    subject_str = get_subject_str(subject_id)
-    subject_scanpaths_file = path.join(path.join(path.join(datasets_path, dataset_name), 'human_scanpaths'), 'subj' + subject_str + '_scanpaths.json')
-    subject_scanpaths = load_dict_from_json(subject_scanpaths_file)
+    human_scanpaths = scanpaths_store.load(path.join(path.join(datasets_path, dataset_name), 'human_scanpaths'))
+    image_scanpaths = human_scanpaths.image_scanpaths(image_name)
 
-    if not image_name in subject_scanpaths:
+    if not subject_id in image_scanpaths:
         raise ValueError(image_name + ' not found in subject\'s scanpaths')
     
-    return subject_scanpaths[image_name]
+    return image_scanpaths[subject_id]
 
 def load_prob_maps_path(subject_id, dataset_name, model_name, image_name):
     subject_str     = get_subject_str(subject_id)
@@ -1,8 +1,8 @@
 import matplotlib.pyplot as plt
 import numpy as np
-from . import utils
+from . import utils, scanpaths_store
 from scipy import integrate
-from os import listdir, path
+from os import path
 
 class CumulativePerformance:
     def __init__(self, dataset_name, number_of_images, max_scanpath_length, compute):
@@ -27,11 +27,10 @@ class CumulativePerformance:
             return
 
         humans_cumulative_performance = []
-        humans_scanpaths_files = listdir(humans_scanpaths_dir)
+        humans_scanpaths = scanpaths_store.load(humans_scanpaths_dir)
         print('[Cumulative performance] Computing human mean for ' + self.dataset_name + ' dataset')
-        for human_scanpaths_file in humans_scanpaths_files:
-            human_scanpaths = utils.load_dict_from_json(path.join(humans_scanpaths_dir, human_scanpaths_file))
-            human_scanpaths = utils.get_random_subset(human_scanpaths, size=self.number_of_images)
+        for subject in humans_scanpaths.subjects:
+            human_scanpaths = utils.get_random_subset(humans_scanpaths.subject_scanpaths(subject), size=self.number_of_images)
             if self.dataset_name == 'Interiors':
                 humans_cumulative_performance.append(self.compute_human_cumulative_performance_interiors(human_scanpaths))
             else:
@@ -40,7 +39,7 @@ class CumulativePerformance:
         # Interiors dataset caps the number of maximum saccades for humans at 2, 4, 8 and 12
         # Therefore, cumulative performance is calculated at fixation number 3, 5, 9 and 13
         if self.dataset_name == 'Interiors':
-            number_of_subjects = len(humans_scanpaths_files)
+            number_of_subjects = len(humans_scanpaths.subjects)
             humans_cumulative_performance_mean = [np.empty(n) for n in np.repeat(number_of_subjects, 4)]
             subject_index = 0
             for subject_cumulative_performance in humans_cumulative_performance:
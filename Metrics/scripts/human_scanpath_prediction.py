@@ -1,10 +1,11 @@
 from . import utils
+from . import probability_maps
+from . import scanpaths_store
+from . import kernel_density
 from .. import constants
-from os import path, listdir, pardir
-import pandas as pd
+from os import path, pardir
 import numpy as np
-import shutil
-import numba
+import functools
 import importlib
 
 """ Computes Human Scanpath Prediction on the visual search models for a given dataset. 
@@ -12,6 +13,11 @@ import importlib
     The methods for computing AUC and NSS were taken from https://github.com/matthias-k/pysaliency/blob/master/pysaliency/metrics.py
 """
 
+# Number of shapes whose baseline maps (center bias and uniform) are kept in memory
+BASELINES_CACHE_SIZE = 4
+# Values at the fixation which exceed the map's mean by less than this have a NSS of zero
+NSS_EPS = 2.2204e-20
+
 class HumanScanpathPrediction:
     def __init__(self, dataset_name, human_scanpaths_dir, dataset_results_dir, models_dir, number_of_images, compute):
         self.models_results      = {}
@@ -27,31 +33,35 @@ class HumanScanpathPrediction:
         if self.null_object: return
 
         model_output_path     = path.join(self.dataset_results_dir, model_name)    
-        human_scanpaths_files = utils.sorted_alphanumeric(listdir(self.human_scanpaths_dir))
+        human_scanpaths       = scanpaths_store.load(self.human_scanpaths_dir)
         model_average_file    = path.join(model_output_path, 'human_scanpath_prediction_mean_per_image.json')
 
         average_results_per_image = utils.load_dict_from_json(model_average_file)
         if average_results_per_image:
             print('[Human Scanpath Prediction] Found previously computed results for ' + model_name)
         else:
-            for subject in human_scanpaths_files:
-                subject_number = subject[4:6]
-
-                if not self.subject_already_processed(subject, subject_number, model_output_path):
-                    model = importlib.import_module(self.models_dir + '.' + model_name + '.main')
-                    print('[Human Scanpath Prediction] Running ' + model_name + ' on ' + self.dataset_name + ' dataset using subject ' + subject_number + ' scanpaths')
-                    model.main(self.dataset_name, int(subject_number))
+            subjects_to_process = []
+            for subject in human_scanpaths.subjects:
+                if not self.subject_already_processed(human_scanpaths, subject, model_output_path):
+                    subjects_to_process.append(subject)
+
+            if subjects_to_process:
+                # All subjects are run in a single call, so that the model is loaded (and what doesn't depend on the subject is computed) only once
+                model = importlib.import_module(self.models_dir + '.' + model_name + '.main')
+                print('[Human Scanpath Prediction] Running ' + model_name + ' on ' + self.dataset_name + ' dataset using the scanpaths of subjects ' + ', '.join(map(str, subjects_to_process)))
+                model.main(self.dataset_name, subjects_to_process)
             
             average_results_per_image = self.get_model_average_per_image(model_output_path)
             utils.save_to_json(model_average_file, average_results_per_image)
 
         self.compute_model_mean(average_results_per_image, model_name)
 
-    def subject_already_processed(self, subject_file, subject_number, model_output_path):
+    def subject_already_processed(self, human_scanpaths, subject, model_output_path):
+        subject_number             = str(subject).zfill(2)
         subjects_predictions_path  = path.join(model_output_path, 'subjects_predictions')
-        subject_scanpath_file      = path.join(self.human_scanpaths_dir, subject_file)
         subject_predictions_file   = path.join(subjects_predictions_path, 'subject_' + subject_number + '_results.json')
-        if utils.is_contained_in(subject_scanpath_file, subject_predictions_file):
+        subject_predictions        = utils.load_dict_from_json(subject_predictions_file)
+        if subject_predictions and all(image_name in subject_predictions for image_name in human_scanpaths.subject_images(subject)):
             print('[Human Scanpath Prediction] Found previously computed results for subject ' + subject_number)
             return True
         
@@ -121,16 +131,20 @@ class HumanScanpathPrediction:
                             'gold_standard': {'probability_map': None, 'results': {}}}
 
         subjects_scanpaths_path  = path.join(dataset_path, dataset_info['scanpaths_dir'])
-        subjects_scanpaths_files = utils.sorted_alphanumeric(listdir(subjects_scanpaths_path))
-        for subject_scanpaths_file in subjects_scanpaths_files:
-            subject = subject_scanpaths_file[:-15]
+        subjects_scanpaths       = scanpaths_store.load(subjects_scanpaths_path)
+        # Fixations of all subjects on each image, from which each subject's own are subtracted to build its gold standard
+        images_histograms        = {image_name: kernel_density.histogram(*subjects_scanpaths.image_fixations(image_name)) for image_name in subjects_scanpaths.images}
+        gold_standard_bandwidth  = self.load_gold_standard_bandwidth(images_histograms, image_size)
+        for subject_number in subjects_scanpaths.subjects:
+            subject = subjects_scanpaths.subject_file(subject_number)[:-15]
             print('[Human Scanpath Prediction] Running baseline models on ' + self.dataset_name + ' dataset using ' + subject + ' scanpaths')
-            subject_scanpaths = utils.load_dict_from_json(path.join(subjects_scanpaths_path, subject_scanpaths_file))
+            subject_scanpaths = subjects_scanpaths.subject_scanpaths(subject_number)
             for image_name in subject_scanpaths:
-                gold_standard_model = gold_standard(image_name, image_size, subjects_scanpaths_path, excluded_subject=subject)
+                trial_info = subject_scanpaths[image_name]
+
+                gold_standard_model = gold_standard(images_histograms[image_name], trial_info, image_size, gold_standard_bandwidth)
                 baseline_models['gold_standard']['probability_map'] = gold_standard_model
 
-                trial_info = subject_scanpaths[image_name]
                 scanpath_x = [int(x) for x in trial_info['X']]
                 scanpath_y = [int(y) for y in trial_info['Y']]
 
@@ -138,7 +152,7 @@ class HumanScanpathPrediction:
                     probability_map = baseline_models[model]['probability_map']
                     if probability_map is not None:
                         trial_aucs, trial_nss, trial_igs, trial_lls = compute_trial_metrics(len(scanpath_x), scanpath_x, scanpath_y, \
-                            prob_maps_path=None, baseline_map=probability_map)
+                            trial_prob_maps=None, baseline_map=probability_map)
                         
                         model_results = baseline_models[model]['results']
                         if subject in model_results:
@@ -154,6 +168,17 @@ class HumanScanpathPrediction:
 
         return baseline_averages
 
+    def load_gold_standard_bandwidth(self, images_histograms, image_size):
+        """ The gold standard's bandwidth is chosen once per dataset, by maximizing the leave-one-out log-likelihood of the fixations on every image """
+        bandwidth_file = path.join(self.dataset_results_dir, 'gold_standard_bandwidth.json')
+        bandwidth      = utils.load_dict_from_json(bandwidth_file)
+        if not bandwidth:
+            print('[Human Scanpath Prediction] Searching for the gold standard\'s bandwidth on ' + self.dataset_name + ' dataset')
+            bandwidth = {'bandwidth': kernel_density.search_bandwidth(list(images_histograms.values()), image_size)}
+            utils.save_to_json(bandwidth_file, bandwidth)
+
+        return bandwidth['bandwidth']
+
     def save_results(self, save_path, filename):
         if self.null_object: return
 
@@ -172,15 +197,15 @@ class HumanScanpathPrediction:
 def save_scanpath_prediction_metrics(subject_scanpath, image_name, output_path):
     """ After creating the probability maps for each fixation in a given human subject's scanpath, visual search models call this method """
     probability_maps_path = path.join(output_path, 'probability_maps', image_name[:-4])
-    if not path.exists(probability_maps_path):
+    if not probability_maps.exists(probability_maps_path):
         print('[Human Scanpath Prediction] No probability maps found for ' + image_name)
         return
-    probability_maps = listdir(probability_maps_path)
+    fixations, trial_probability_maps = probability_maps.load(probability_maps_path)
 
     subject_fixations_x = np.array(subject_scanpath['X'], dtype=int)
     subject_fixations_y = np.array(subject_scanpath['Y'], dtype=int)
 
-    trial_aucs, trial_nss, trial_igs, trial_lls = compute_trial_metrics(len(probability_maps) + 1, subject_fixations_x, subject_fixations_y, probability_maps_path)
+    trial_aucs, trial_nss, trial_igs, trial_lls = compute_trial_metrics(len(fixations) + 1, subject_fixations_x, subject_fixations_y, trial_probability_maps)
 
     subject   = path.basename(output_path)
     file_path = path.join(output_path, pardir, subject + '_results.json')
@@ -192,38 +217,80 @@ def save_scanpath_prediction_metrics(subject_scanpath, image_name, output_path):
     model_subject_metrics[image_name] = {'AUC': np.mean(trial_aucs), 'NSS': np.mean(trial_nss), 'IG': np.mean(trial_igs), 'LL': np.mean(trial_lls)}  
     utils.save_to_json(file_path, model_subject_metrics)
 
-    # Clean up probability maps if their size is too big
-    if utils.dir_is_too_heavy(probability_maps_path):
-        shutil.rmtree(probability_maps_path)
+def compute_trial_metrics(number_of_fixations, subject_fixations_x, subject_fixations_y, trial_prob_maps, baseline_map=None):
+    """ trial_prob_maps (3D array) contains the probability map of each fixation, as loaded by probability_maps.load """
+    " If a baseline map is given, every fixation is scored against it instead. The first fixation isn't scored "
+    fixations_y = np.asarray(subject_fixations_y[1:number_of_fixations], dtype=int)
+    fixations_x = np.asarray(subject_fixations_x[1:number_of_fixations], dtype=int)
+    if baseline_map is None:
+        trial_prob_maps = trial_prob_maps[:number_of_fixations - 1]
+    else:
+        trial_prob_maps = np.asarray(baseline_map)[np.newaxis]
+
+    return fixations_metrics(trial_prob_maps, fixations_y, fixations_x)
+
+def fixations_metrics(probability_maps, fixations_y, fixations_x):
+    " AUC, NSS, IG (against the center bias) and LL (against the uniform model) of a stack of probability maps, each at its own fixation "
+    " A stack with a single map is used for all fixations. Each map is read once: its mean, standard deviation and sum are computed, "
+    " and it's sorted to compute the AUC of all its fixations by binary search (ties count as half). Results are the same as when "
+    " scoring each fixation on its own, as in pysaliency "
+    """ Input:
+            probability_maps (3D array) : probability map of each fixation, or a single one for all of them
+            fixations_y (1D array)      : row of each fixation
+            fixations_x (1D array)      : column of each fixation
+        Output:
+            aucs, nss, igs, lls (1D arrays) : metrics of each fixation
+    """
+    fixations_y, fixations_x = np.asarray(fixations_y, dtype=int), np.asarray(fixations_x, dtype=int)
+    number_of_fixations = len(fixations_y)
+    aucs, nss, igs, lls = (np.empty(number_of_fixations) for _ in range(4))
+    if number_of_fixations == 0:
+        return aucs, nss, igs, lls
+    if len(probability_maps) == 1:
+        maps_fixations = [np.arange(number_of_fixations)]
+    else:
+        maps_fixations = np.arange(number_of_fixations)[:, np.newaxis]
+
+    eps = 2.2204e-16
+    center_bias_map, uniform_map = baselines(probability_maps[0].shape)
+    for map_index, fixations in enumerate(maps_fixations):
+        probability_map = np.asarray(probability_maps[map_index], dtype=np.float64)
+        fixations_y_map, fixations_x_map = fixations_y[fixations], fixations_x[fixations]
+        values = probability_map[fixations_y_map, fixations_x_map]
+
+        sorted_map = np.sort(probability_map, axis=None)
+        lower      = np.searchsorted(sorted_map, values, side='left')
+        upper      = np.searchsorted(sorted_map, values, side='right')
+        aucs[fixations] = np.where(np.isnan(values), 0.0, lower + 0.5 * (upper - lower)) / sorted_map.size
 
-def compute_trial_metrics(number_of_fixations, subject_fixations_x, subject_fixations_y, prob_maps_path, baseline_map=None):
-    trial_aucs, trial_nss, trial_igs, trial_lls = [], [], [], []
-    for index in range(1, number_of_fixations):
-        if baseline_map is None:
-            fixation_prob_map = pd.read_csv(path.join(prob_maps_path, 'fixation_' + str(index) + '.csv')).to_numpy()
-        else:
-            fixation_prob_map = baseline_map
-        baseline_ig      = center_bias(fixation_prob_map.shape)
-        baseline_ll      = uniform(fixation_prob_map.shape)
-        auc, nss, ig, ll = compute_fixation_metrics(baseline_ig, baseline_ll, fixation_prob_map, subject_fixations_y[index], subject_fixations_x[index])
-        trial_aucs.append(auc)
-        trial_nss.append(nss)
-        trial_igs.append(ig)
-        trial_lls.append(ll)
-    
-    return trial_aucs, trial_nss, trial_igs, trial_lls
+        std = np.std(probability_map)
+        values_nss = values - np.mean(probability_map)
+        values_nss = np.where(NSS_EPS < values_nss, values_nss, 0.0)
+        nss[fixations] = values_nss / std if std else values_nss
 
-def compute_fixation_metrics(baseline_ig, baseline_ll, probability_map, human_fixation_y, human_fixation_x):
-    auc = AUC(probability_map, human_fixation_y, human_fixation_x)
-    nss = NSS(probability_map, human_fixation_y, human_fixation_x)
-    ig  = infogain(probability_map, baseline_ig, human_fixation_y, human_fixation_x)
-    ll  = infogain(probability_map, baseline_ll, human_fixation_y, human_fixation_x)
+        log_probabilities = np.log2(eps + values / np.sum(probability_map))
+        igs[fixations] = log_probabilities - np.log2(eps + center_bias_map[fixations_y_map, fixations_x_map])
+        lls[fixations] = log_probabilities - np.log2(eps + uniform_map[fixations_y_map, fixations_x_map])
 
-    return auc, nss, ig, ll
+    return aucs, nss, igs, lls
 
 def uniform(shape):
     return np.ones(shape) / (shape[0] * shape[1])
 
+def baselines(shape):
+    " Center bias and uniform maps of the given shape, normalized to add up to one. The last BASELINES_CACHE_SIZE shapes are kept in memory "
+    return normalized_baselines(tuple(int(size) for size in shape))
+
+@functools.lru_cache(maxsize=BASELINES_CACHE_SIZE)
+def normalized_baselines(shape):
+    baseline_maps = []
+    for baseline_map in [center_bias(shape), uniform(shape)]:
+        baseline_map = baseline_map / np.sum(baseline_map)
+        baseline_map.setflags(write=False)
+        baseline_maps.append(baseline_map)
+
+    return tuple(baseline_maps)
+
 def center_bias(shape):
     shape_dir = str(shape[0]) + 'x' + str(shape[1])
     filepath  = path.join(constants.CENTER_BIAS_PATH, shape_dir,  'center_bias.pkl')
@@ -237,61 +304,12 @@ def center_bias(shape):
 
     return centerbias
 
-def gold_standard(image_name, image_size, subjects_scanpaths_path, excluded_subject):    
-    scanpaths_X, scanpaths_Y = utils.aggregate_scanpaths(subjects_scanpaths_path, image_name, excluded_subject)
-    if len(scanpaths_X) == 0:
+def gold_standard(image_histogram, trial_info, image_size, bandwidth):
+    """ Density of the fixations of every other subject on the image, obtained by subtracting the subject's fixations from those of all subjects """
+    others_histogram = image_histogram - kernel_density.histogram(trial_info['X'], trial_info['Y'])
+    if others_histogram.size() == 0:
         goldstandard_model = None
     else:
-        goldstandard_model = utils.gaussian_kde(scanpaths_X, scanpaths_Y, image_size)
+        goldstandard_model = kernel_density.density(others_histogram, image_size, bandwidth)
 
     return goldstandard_model
-
-def NSS(probability_map, ground_truth_fixation_y, ground_truth_fixation_x, eps=2.2204e-20):
-    """ The returned array has length equal to the number of fixations """
-    mean  = np.mean(probability_map)
-    std   = np.std(probability_map)
-    value = np.copy(probability_map[ground_truth_fixation_y, ground_truth_fixation_x])
-    value -= mean
-    value = value if eps < value else 0.0
-
-    if std:
-        value /= std
-
-    return value
-
-def infogain(s_map, baseline_map, ground_truth_fixation_y, ground_truth_fixation_x):
-    eps = 2.2204e-16
-
-    s_map        = s_map / np.sum(s_map)
-    baseline_map = baseline_map / np.sum(baseline_map)
-    
-    return np.log2(eps + s_map[ground_truth_fixation_y, ground_truth_fixation_x]) - np.log2(eps + baseline_map[ground_truth_fixation_y, ground_truth_fixation_x])
-
-def AUC(probability_map, ground_truth_fixation_y, ground_truth_fixation_x):
-    """ Calculate AUC score for a given fixation """
-    positive  = probability_map[ground_truth_fixation_y, ground_truth_fixation_x]
-    negatives = probability_map.flatten()
-
-    return auc_for_one_positive(positive, negatives)
-
-def auc_for_one_positive(positive, negatives):
-    """ Computes the AUC score of one single positive sample agains many negatives.
-    The result is equal to general_roc([positive], negatives)[0], but computes much
-    faster because one can save sorting the negatives.
-    """
-    return _auc_for_one_positive(positive, np.asarray(negatives))
-
-@numba.jit(nopython=True)
-def _auc_for_one_positive(positive, negatives):
-    """ Computes the AUC score of one single positive sample agains many negatives.
-    The result is equal to general_roc([positive], negatives)[0], but computes much
-    faster because one can save sorting the negatives.
-    """
-    count = 0
-    for negative in negatives:
-        if negative < positive:
-            count += 1
-        elif negative == positive:
-            count += 0.5
-
-    return count / len(negatives)
\ No newline at end of file
@@ -0,0 +1,129 @@
+import numpy as np
+
+""" Gaussian kernel density estimation of fixations, evaluated at the center of every pixel of an image (as sklearn's KernelDensity would).
+    Fixations are binned by their coordinates into a histogram, which is then smoothed one axis at a time (the Gaussian kernel is separable), as two matrix products.
+    Since histograms hold counts, the one of all subjects but one is obtained by subtracting that subject's histogram from the one of all subjects.
+    Bandwidths are chosen by maximizing the leave-one-out log-likelihood of the fixations, which is computed for all of them (and for many bandwidths) at once.
+"""
+
+# Maximum number of values in the kernels computed at once when searching for the bandwidth
+MAX_KERNELS_SIZE = 10 ** 7
+
+class Histogram:
+    " Number of fixations at each pair of coordinates. Rows (y) and columns (x) are sorted "
+    def __init__(self, rows, columns, counts):
+        self.rows    = rows
+        self.columns = columns
+        self.counts  = counts
+
+    def __sub__(self, other):
+        " Histogram of the fixations which aren't in other. Its fixations must be in this histogram as well "
+        counts = self.counts.copy()
+        counts[np.ix_(np.searchsorted(self.rows, other.rows), np.searchsorted(self.columns, other.columns))] -= other.counts
+
+        return Histogram(self.rows, self.columns, counts)
+
+    def size(self):
+        " Number of fixations in the histogram "
+        return int(np.sum(self.counts))
+
+def histogram(scanpaths_X, scanpaths_Y):
+    " Bins the given fixations by their coordinates "
+    rows, rows_indexes       = np.unique(np.asarray(scanpaths_Y, dtype=float), return_inverse=True)
+    columns, columns_indexes = np.unique(np.asarray(scanpaths_X, dtype=float), return_inverse=True)
+    counts = np.zeros((len(rows), len(columns)), dtype=np.int64)
+    np.add.at(counts, (rows_indexes, columns_indexes), 1)
+
+    return Histogram(rows, columns, counts)
+
+def density(fixations_histogram, shape, bandwidth):
+    " Density of the fixations in the histogram at the center of every pixel of an image of the given shape "
+    """ Input:
+            fixations_histogram (Histogram) : fixations to estimate the density of (there must be at least one)
+            shape (int, int)                : height and width of the image
+            bandwidth (float)               : standard deviation of the Gaussian kernel, in pixels
+        Output:
+            density (2D array) : density of each pixel, of the given shape
+    """
+    rows_kernel    = kernel(np.arange(shape[0]) + 0.5, fixations_histogram.rows, bandwidth)
+    columns_kernel = kernel(np.arange(shape[1]) + 0.5, fixations_histogram.columns, bandwidth)
+
+    return (rows_kernel @ fixations_histogram.counts) @ columns_kernel.T / (fixations_histogram.size() * 2 * np.pi * bandwidth ** 2)
+
+def kernel(positions, coordinates, bandwidth):
+    " Unnormalized Gaussian kernel between each position (rows) and each coordinate (columns), for one bandwidth or an array of them "
+    bandwidth = np.asarray(bandwidth, dtype=float)[..., np.newaxis, np.newaxis]
+
+    return np.exp(-(positions[:, np.newaxis] - coordinates) ** 2 / (2 * bandwidth ** 2))
+
+def bandwidths_space(shape):
+    " Bandwidths to search from (values estimated from previous executions) "
+    if np.log(shape[0] * shape[1]) < 10:
+        return 10 ** np.linspace(-1, 1, 100)
+
+    return np.linspace(15, 70, 200)
+
+def search_bandwidth(histograms, shape):
+    " Bandwidth (from bandwidths_space) which maximizes the leave-one-out log-likelihood of the fixations in all of the histograms "
+    """ Input:
+            histograms (list of Histogram) : fixations on each image, each with its own density
+            shape (int, int)               : height and width of the images
+        Output:
+            bandwidth (float)
+    """
+    bandwidths     = bandwidths_space(shape)
+    log_likelihood = np.zeros(len(bandwidths))
+    for fixations_histogram in histograms:
+        log_likelihood += leave_one_out_log_likelihood(fixations_histogram, bandwidths)
+
+    return float(bandwidths[np.argmax(log_likelihood)])
+
+def leave_one_out_log_likelihood(fixations_histogram, bandwidths):
+    " Sum of the log-likelihood of each fixation under the density of every other fixation, for each bandwidth "
+    " Histograms with less than two fixations have no likelihood, and add zero "
+    number_of_fixations = fixations_histogram.size()
+    log_likelihood = np.zeros(len(bandwidths))
+    if number_of_fixations < 2:
+        return log_likelihood
+
+    # Kernels are either computed between every pair of occupied coordinates, or along each axis (which is cheaper, and takes less memory, when there are many fixations)
+    counts = fixations_histogram.counts
+    rows_indexes, columns_indexes = np.nonzero(counts)
+    cells_counts = counts[rows_indexes, columns_indexes]
+    pairwise     = len(cells_counts) ** 2 <= min(counts.shape[0] * counts.shape[1] * (counts.shape[0] + counts.shape[1]), MAX_KERNELS_SIZE)
+    chunk        = max(MAX_KERNELS_SIZE // (len(cells_counts) if pairwise else max(counts.shape)) ** 2, 1)
+    if pairwise:
+        cells_rows, cells_columns = fixations_histogram.rows[rows_indexes], fixations_histogram.columns[columns_indexes]
+        squared_distances = (cells_rows[:, np.newaxis] - cells_rows) ** 2 + (cells_columns[:, np.newaxis] - cells_columns) ** 2
+    for start in range(0, len(bandwidths), chunk):
+        chunk_bandwidths = bandwidths[start:start + chunk]
+        if pairwise:
+            kernel_sums = pairwise_kernel_sums(squared_distances, cells_counts, chunk_bandwidths)
+        else:
+            kernel_sums = separable_kernel_sums(fixations_histogram, chunk_bandwidths)[:, rows_indexes, columns_indexes]
+        with np.errstate(divide='ignore'):
+            fixations_log_likelihood = np.log(kernel_sums) - np.log((number_of_fixations - 1) * 2 * np.pi * chunk_bandwidths ** 2)[:, np.newaxis]
+        log_likelihood[start:start + chunk] = np.sum(fixations_log_likelihood * cells_counts, axis=1)
+
+    return log_likelihood
+
+# Both functions below return the kernel sums at each fixation without the fixation itself. Subtracting it (the kernel is one at distance zero) would cancel
+# out the sum of distant fixations, so kernels are computed without their diagonals, and the other fixations at the same coordinates are added apart
+
+def pairwise_kernel_sums(squared_distances, cells_counts, bandwidths):
+    " Kernel sums at each occupied pair of coordinates (cell), given the squared distances between cells, for each bandwidth "
+    cells_kernel = np.exp(-squared_distances / (2 * bandwidths[:, np.newaxis, np.newaxis] ** 2))
+    cells_kernel[:, np.arange(len(cells_counts)), np.arange(len(cells_counts))] = 0
+
+    return cells_kernel @ cells_counts + (cells_counts - 1)
+
+def separable_kernel_sums(fixations_histogram, bandwidths):
+    " Kernel sums at every pair of coordinates in the histogram, for each bandwidth. Fixations on the same row or column are added apart as well "
+    counts = fixations_histogram.counts
+    rows_kernel    = kernel(fixations_histogram.rows, fixations_histogram.rows, bandwidths)
+    columns_kernel = kernel(fixations_histogram.columns, fixations_histogram.columns, bandwidths).transpose(0, 2, 1)
+    rows_kernel[:, np.arange(counts.shape[0]), np.arange(counts.shape[0])] = 0
+    columns_kernel[:, np.arange(counts.shape[1]), np.arange(counts.shape[1])] = 0
+    same_row = counts @ columns_kernel
+
+    return rows_kernel @ same_row + same_row + rows_kernel @ counts + (counts - 1)
@@ -1,17 +1,20 @@
-import multimatch_gaze as mm
+import json
 import numpy as np
 import matplotlib.pyplot as plt
-from . import utils
+from . import utils, scanpaths_store, multimatch_engine
 from scipy.stats import pearsonr
-from os import listdir, path
+from itertools import combinations
+from concurrent.futures import ProcessPoolExecutor
+from os import path, replace, getpid, cpu_count
 
 class Multimatch:
-    def __init__(self, dataset_name, human_scanpaths_dir, dataset_results_dir, number_of_images, compute):
+    def __init__(self, dataset_name, human_scanpaths_dir, dataset_results_dir, number_of_images, compute, number_of_processes=None):
         self.multimatch_values = {}
         self.dataset_name = dataset_name
         self.human_scanpaths_dir = human_scanpaths_dir
         self.dataset_results_dir = dataset_results_dir
         self.number_of_images = number_of_images
+        self.number_of_processes = number_of_processes or cpu_count()
         
         self.null_object = not compute
 
@@ -170,27 +173,27 @@ class Multimatch:
             return
 
         multimatch_model_vs_humans_mean_per_image = {}
-        total_values_per_image   = {}
-        subjects_scanpaths_files = listdir(self.human_scanpaths_dir)
+        human_scanpaths = scanpaths_store.load(self.human_scanpaths_dir)
         print('[Multi-Match] Computing human-model values for ' + model_name + ' in ' + self.dataset_name + ' dataset')
-        for subject_filename in subjects_scanpaths_files:
-            subject_scanpaths = utils.load_dict_from_json(path.join(self.human_scanpaths_dir, subject_filename))
-            for image_name in model_scanpaths:
-                if not(image_name in subject_scanpaths):
+        for image_name in model_scanpaths:
+            model_trial_info = model_scanpaths[image_name]
+            # Each subject's scanpath is followed by the model's, both rescaled to the dimensions of that pair
+            scanpaths = []
+            for subject_trial_info in human_scanpaths.image_scanpaths(image_name).values():
+                if not (subject_trial_info['target_found'] and model_trial_info['target_found']):
                     continue
 
-                model_trial_info   = model_scanpaths[image_name]
-                subject_trial_info = subject_scanpaths[image_name]
-
                 receptive_size = utils.get_dims(model_trial_info, subject_trial_info, key='receptive')
                 screen_size    = utils.get_dims(model_trial_info, subject_trial_info, key='image')
 
-                self.add_multimatch_to_dict(image_name, subject_trial_info, model_trial_info, multimatch_model_vs_humans_mean_per_image,
-                    total_values_per_image, screen_size, receptive_size)
+                subject_fixations = trial_fixations(subject_trial_info, screen_size, receptive_size)
+                model_fixations   = trial_fixations(model_trial_info, screen_size, receptive_size)
+                if subject_fixations is not None and model_fixations is not None:
+                    scanpaths.extend([subject_fixations, model_fixations])
 
-        # Compute mean per image
-        for image_name in multimatch_model_vs_humans_mean_per_image:
-            multimatch_model_vs_humans_mean_per_image[image_name] = (np.divide(multimatch_model_vs_humans_mean_per_image[image_name], total_values_per_image[image_name])).tolist()
+            if scanpaths:
+                multimatch_values = multimatch_engine.compare(multimatch_engine.vectorize(scanpaths), np.arange(len(scanpaths)).reshape(-1, 2), (screen_size[1], screen_size[0]))
+                multimatch_model_vs_humans_mean_per_image[image_name] = sequential_mean(multimatch_values)
 
         self.multimatch_values[model_name]['model_vs_humans'] = multimatch_model_vs_humans_mean_per_image
         self.multimatch_values[model_name]['plot_color'] = model_color
@@ -200,82 +203,122 @@ class Multimatch:
         " To be consistent with the model's scanpaths, human scanpaths are rescaled to match the model's size "
         " The mean is computed for each trial (i.e. for each image) "
         " Output is a dictionary where the image names are the keys and the multimatch means are the values "
+        " Values between every pair of subjects are kept in a symmetric matrix per image, saved in the dataset's results folder by the size scanpaths are rescaled to. "
+        " Models which share that size (such as nnIBS and ELM) then reuse them, and only the images which weren't computed yet are run (over a pool of processes) "
 
         if self.null_object:
             return
 
-        multimatch_human_mean_per_image = {}
-        # Check if it was already computed
-        multimatch_human_mean_json_file = path.join(path.join(self.dataset_results_dir, model_name), 'multimatch_human_mean_per_image.json')
-        if path.exists(multimatch_human_mean_json_file):
-            print('[Multi-Match] Loaded previously computed within human values for ' + model_name + ' in ' + self.dataset_name + ' dataset')
-            multimatch_human_mean_per_image = utils.load_dict_from_json(multimatch_human_mean_json_file)
-        else:
-            print('[Multi-Match] Computing within human values for ' + model_name + ' in ' + self.dataset_name + ' dataset')
-            total_values_per_image = {}
-            # Compute multimatch for each image for every pair of subjects
-            subjects_scanpaths_files = listdir(self.human_scanpaths_dir)
-            for subject_filename in list(subjects_scanpaths_files):
-                subjects_scanpaths_files.remove(subject_filename) 
-                subject_scanpaths = utils.load_dict_from_json(path.join(self.human_scanpaths_dir, subject_filename))
-                for subject_to_compare_filename in subjects_scanpaths_files:
-                    subject_to_compare_scanpaths = utils.load_dict_from_json(path.join(self.human_scanpaths_dir, subject_to_compare_filename))
-                    for image_name in subject_scanpaths:
-                        if not (image_name in subject_to_compare_scanpaths and image_name in model_scanpaths):
-                            continue
-
-                        subject_trial_info = subject_scanpaths[image_name]
-                        subject_to_compare_trial_info = subject_to_compare_scanpaths[image_name]
-
-                        receptive_size = utils.get_dims(model_scanpaths[image_name], subject_trial_info, key='receptive')
-                        screen_size    = utils.get_dims(model_scanpaths[image_name], subject_trial_info, key='image')
-
-                        self.add_multimatch_to_dict(image_name, subject_trial_info, subject_to_compare_trial_info, multimatch_human_mean_per_image,
-                            total_values_per_image, screen_size, receptive_size)
-
-            # Compute mean per image
-            for image_name in multimatch_human_mean_per_image:
-                multimatch_human_mean_per_image[image_name] = (np.divide(multimatch_human_mean_per_image[image_name], total_values_per_image[image_name])).tolist()
-            
-            utils.save_to_json(multimatch_human_mean_json_file, multimatch_human_mean_per_image)
+        human_scanpaths = scanpaths_store.load(self.human_scanpaths_dir)
+        images_per_dims = self.group_images_by_dims(human_scanpaths, model_scanpaths)
 
-        self.multimatch_values[model_name] = {'human_mean' : multimatch_human_mean_per_image}
-
-    def add_multimatch_to_dict(self, image_name, trial_info, trial_to_compare_info, multimatch_dict, counter_dict, screen_size, receptive_size):
-        multimatch_trial_values = self.compute_multimatch(trial_info, trial_to_compare_info, screen_size, receptive_size)
-
-        if multimatch_trial_values:
-            if image_name in multimatch_dict:
-                multimatch_values_acum = multimatch_dict[image_name]
-                multimatch_dict[image_name] = np.add(multimatch_values_acum, multimatch_trial_values)
-                counter_dict[image_name] += 1 
+        multimatch_human_mean_per_image = {}
+        for (screen_size, receptive_size), images_names in images_per_dims.items():
+            within_humans = self.load_within_humans(human_scanpaths, screen_size, receptive_size)
+            images_to_compute = [image_name for image_name in images_names if image_name not in within_humans]
+            if images_to_compute:
+                print('[Multi-Match] Computing within human values for ' + model_name + ' in ' + self.dataset_name + ' dataset (' + str(len(images_to_compute)) + ' images)')
+                tasks = [(human_scanpaths.subjects, human_scanpaths.image_scanpaths(image_name), screen_size, receptive_size) for image_name in images_to_compute]
+                with ProcessPoolExecutor(max_workers=self.number_of_processes) as executor:
+                    matrices = executor.map(within_humans_matrix, tasks, chunksize=max(len(tasks) // (self.number_of_processes * 4), 1))
+                    within_humans.update(zip(images_to_compute, matrices))
+                self.save_within_humans(within_humans, human_scanpaths, screen_size, receptive_size)
             else:
-                multimatch_dict[image_name] = multimatch_trial_values
-                counter_dict[image_name] = 1
+                print('[Multi-Match] Loaded previously computed within human values for ' + model_name + ' in ' + self.dataset_name + ' dataset')
 
-    def compute_multimatch(self, trial_info, trial_to_compare_info, screen_size, receptive_size):
-        target_found = trial_info['target_found'] and trial_to_compare_info['target_found']
-        if not target_found:
-           return []
+            for image_name in images_names:
+                image_mean = within_humans_mean(within_humans[image_name])
+                if image_mean is not None:
+                    multimatch_human_mean_per_image[image_name] = image_mean
 
-        trial_scanpath_X, trial_scanpath_Y = trial_info['X'], trial_info['Y']
-        trial_to_compare_scanpath_X, trial_to_compare_scanpath_Y = trial_to_compare_info['X'], trial_to_compare_info['Y']
-
-        # Rescale accordingly
-        trial_scanpath_X, trial_scanpath_Y = utils.rescale_and_crop(trial_info, screen_size, receptive_size)
-        trial_to_compare_scanpath_X, trial_to_compare_scanpath_Y = utils.rescale_and_crop(trial_to_compare_info, screen_size, receptive_size)
-
-        trial_scanpath_length            = len(trial_scanpath_X)
-        trial_to_compare_scanpath_length = len(trial_to_compare_scanpath_X)
-
-        trial_scanpath_time            = utils.get_scanpath_time(trial_info, trial_scanpath_length)
-        trial_to_compare_scanpath_time = utils.get_scanpath_time(trial_to_compare_info, trial_to_compare_scanpath_length)
-
-        # Multimatch can't be computed for scanpaths with length shorter than 3
-        if trial_scanpath_length < 3 or trial_to_compare_scanpath_length < 3:
-            return []
+        self.multimatch_values[model_name] = {'human_mean' : multimatch_human_mean_per_image}
 
-        trial_scanpath = np.array(list(zip(trial_scanpath_X, trial_scanpath_Y, trial_scanpath_time)), dtype=[('start_x', '<f8'), ('start_y', '<f8'), ('duration', '<f8')])
-        trial_to_compare_scanpath = np.array(list(zip(trial_to_compare_scanpath_X, trial_to_compare_scanpath_Y, trial_to_compare_scanpath_time)), dtype=[('start_x', '<f8'), ('start_y', '<f8'), ('duration', '<f8')])
+    def group_images_by_dims(self, human_scanpaths, model_scanpaths):
+        " Groups the images in model_scanpaths by the size (screen and receptive) human scanpaths are rescaled to. Images seen by less than two subjects are left out "
+        " Human subjects share the same receptive size in each dataset, so it's taken from the first subject on each image "
+        images_per_dims = {}
+        for image_name in model_scanpaths:
+            image_scanpaths = human_scanpaths.image_scanpaths(image_name)
+            if len(image_scanpaths) < 2:
+                continue
 
-        return mm.docomparison(trial_scanpath, trial_to_compare_scanpath, (screen_size[1], screen_size[0]))
\ No newline at end of file
+            subject_trial_info = next(iter(image_scanpaths.values()))
+            receptive_size = utils.get_dims(model_scanpaths[image_name], subject_trial_info, key='receptive')
+            screen_size    = utils.get_dims(model_scanpaths[image_name], subject_trial_info, key='image')
+            images_per_dims.setdefault((tuple(screen_size), tuple(receptive_size)), []).append(image_name)
+
+        return images_per_dims
+
+    def within_humans_file(self, screen_size, receptive_size):
+        return path.join(self.dataset_results_dir, 'multimatch_within_humans_' + '{}x{}_receptive_{}x{}'.format(*screen_size, *receptive_size) + '.npz')
+
+    def load_within_humans(self, human_scanpaths, screen_size, receptive_size):
+        " Within human matrices previously computed for this size, indexed by image name. They're discarded if the human scanpaths have changed since "
+        within_humans_file = self.within_humans_file(screen_size, receptive_size)
+        if not path.exists(within_humans_file):
+            return {}
+        with np.load(within_humans_file) as within_humans:
+            if str(within_humans['sources']) != json.dumps(human_scanpaths.index['sources']):
+                return {}
+
+            return dict(zip(within_humans['images'].tolist(), within_humans['values']))
+
+    def save_within_humans(self, within_humans, human_scanpaths, screen_size, receptive_size):
+        within_humans_file = self.within_humans_file(screen_size, receptive_size)
+        temporary_file     = within_humans_file + '.' + str(getpid()) + '.tmp'
+        with open(temporary_file, 'wb') as npz_file:
+            np.savez_compressed(npz_file, sources=json.dumps(human_scanpaths.index['sources']), subjects=np.array(human_scanpaths.subjects),
+                images=np.array(list(within_humans)), values=np.array(list(within_humans.values())))
+        replace(temporary_file, within_humans_file)
+
+def within_humans_matrix(task):
+    " Multi-Match between every pair of subjects on an image, as a symmetric matrix indexed by subject (in the order of subjects). "
+    " Its last axis holds the values of each dimension; pairs for which Multi-Match can't be computed are NaN "
+    """ Input:
+            task (tuple) : subjects (list of int), scanpaths of the subjects on the image (dict indexed by subject number), screen size and receptive size
+        Output:
+            matrix (3D array) : array of shape (number of subjects, number of subjects, 5)
+    """
+    subjects, image_scanpaths, screen_size, receptive_size = task
+    matrix = np.full((len(subjects), len(subjects), multimatch_engine.NUMBER_OF_DIMENSIONS), np.nan)
+    # Each scanpath is rescaled and turned into vectors once, and then compared against every other one
+    subjects_ids, scanpaths = [], []
+    for subject_id, subject in enumerate(subjects):
+        if subject in image_scanpaths and image_scanpaths[subject]['target_found']:
+            fixations = trial_fixations(image_scanpaths[subject], screen_size, receptive_size)
+            if fixations is not None:
+                subjects_ids.append(subject_id)
+                scanpaths.append(fixations)
+
+    if len(scanpaths) > 1:
+        pairs = np.array(list(combinations(range(len(scanpaths)), 2)))
+        rows, columns = np.array(subjects_ids)[pairs].T
+        matrix[rows, columns] = matrix[columns, rows] = multimatch_engine.compare(multimatch_engine.vectorize(scanpaths), pairs, (screen_size[1], screen_size[0]))
+
+    return matrix
+
+def within_humans_mean(matrix):
+    " Mean of the values of every pair of subjects in a within humans matrix (None if there are none) "
+    " Pairs are summed one after the other, in the same order as they're computed "
+    pairs_values = matrix[np.triu_indices(matrix.shape[0], k=1)]
+    pairs_values = pairs_values[~np.all(np.isnan(pairs_values), axis=-1)]
+    if not len(pairs_values):
+        return None
+
+    return sequential_mean(pairs_values)
+
+def sequential_mean(multimatch_values):
+    " Mean of each dimension of a list of Multi-Match values, summed one after the other "
+    return (np.cumsum(multimatch_values, axis=0)[-1] / len(multimatch_values)).tolist()
+
+def trial_fixations(trial_info, screen_size, receptive_size):
+    " Fixations of a trial, rescaled to screen_size (and collapsed and cropped according to receptive_size), alongside their duration "
+    " Returns None if there are less than three, since Multi-Match can't be computed "
+    scanpath_x, scanpath_y = utils.rescale_and_crop(trial_info, screen_size, receptive_size)
+    scanpath_time = utils.get_scanpath_time(trial_info, len(scanpath_x))
+    # Fixations without a duration are left out
+    scanpath_length = min(len(scanpath_x), len(scanpath_time))
+    if scanpath_length < 3:
+        return None
+
+    return scanpath_x[:scanpath_length], scanpath_y[:scanpath_length], scanpath_time[:scanpath_length]
@@ -0,0 +1,190 @@
+import math
+import numba
+import numpy as np
+
+""" Multi-Match (Jarodzka et al., 2010) as implemented by multimatch_gaze (without grouping), for many pairs of scanpaths at once.
+    Each scanpath is turned into its vector-based representation (saccades and fixations' durations) only once, by vectorize, and then compared
+    against any number of scanpaths by compare. Saccades are aligned by the shortest path through the matrix of vector differences between the saccades
+    of both scanpaths, which is run by a compiled Dijkstra's algorithm that visits nodes in the same order as scipy's (the one used by multimatch_gaze),
+    so that the same alignment is chosen when there's more than one shortest path.
+"""
+
+NUMBER_OF_DIMENSIONS = 5
+
+def vectorize(scanpaths):
+    " Vector-based representation of a list of scanpaths, concatenated. The saccade starting at each fixation is stored alongside it "
+    " (the last fixation of each scanpath has no saccade, and its values are left at zero) "
+    """ Input:
+            scanpaths (list of (x, y, duration)) : coordinates of the fixations of each scanpath, and their duration (in seconds)
+        Output:
+            vectors (dict) : offsets of each scanpath, and its fixations' coordinates ('x', 'y') and duration ('duration'), as well as the length in each axis ('lenx', 'leny'),
+                             length ('rho') and angle ('theta') of the saccades
+    """
+    lengths = [len(scanpath[0]) for scanpath in scanpaths]
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+    x, y, duration = (np.concatenate([np.asarray(scanpath[index], dtype=float) for scanpath in scanpaths] + [np.empty(0)]) for index in range(3))
+
+    lenx, leny = np.zeros(len(x)), np.zeros(len(y))
+    lenx[:-1], leny[:-1] = np.diff(x), np.diff(y)
+    last_fixations = offsets[1:][np.asarray(lengths) > 0] - 1
+    lenx[last_fixations], leny[last_fixations] = 0, 0
+
+    return {'offsets': offsets, 'x': x, 'y': y, 'duration': duration, 'lenx': lenx, 'leny': leny,
+            'rho': np.sqrt(lenx ** 2 + leny ** 2), 'theta': np.arctan2(leny, lenx)}
+
+def compare(vectors, pairs, screen_size):
+    " Multi-Match between each pair of scanpaths in vectors "
+    """ Input:
+            vectors (dict)      : vector-based representation of the scanpaths, as returned by vectorize
+            pairs (2D array)    : indexes (in vectors) of the scanpaths to compare, of shape (number of pairs, 2)
+            screen_size (tuple) : width and height of the screen, in pixels
+        Output:
+            values (2D array) : similarity in each dimension (vector, direction, length, position and duration) for each pair, of shape (number of pairs, 5).
+                                Scanpaths with less than three fixations can't be compared, and their values are NaN
+    """
+    pairs  = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    values = np.empty((len(pairs), NUMBER_OF_DIMENSIONS))
+    screen_diagonal = math.sqrt(screen_size[0] ** 2 + screen_size[1] ** 2)
+    compare_pairs(vectors['offsets'], vectors['x'], vectors['y'], vectors['duration'], vectors['lenx'], vectors['leny'], vectors['rho'], vectors['theta'],
+        pairs, screen_diagonal, values)
+
+    return values
+
+@numba.jit(nopython=True, error_model='numpy', cache=True)
+def compare_pairs(offsets, x, y, duration, lenx, leny, rho, theta, pairs, screen_diagonal, values):
+    for pair_index in range(pairs.shape[0]):
+        start_1, start_2 = offsets[pairs[pair_index, 0]], offsets[pairs[pair_index, 1]]
+        saccades_1 = offsets[pairs[pair_index, 0] + 1] - start_1 - 1
+        saccades_2 = offsets[pairs[pair_index, 1] + 1] - start_2 - 1
+        if saccades_1 < 2 or saccades_2 < 2:
+            values[pair_index] = np.nan
+            continue
+
+        # Vector differences between every pair of saccades
+        differences = np.empty((saccades_1, saccades_2))
+        for i in range(saccades_1):
+            for j in range(saccades_2):
+                differences[i, j] = np.sqrt((lenx[start_1 + i] - lenx[start_2 + j]) ** 2 + (leny[start_1 + i] - leny[start_2 + j]) ** 2)
+
+        path = align(differences)
+        vector_differences    = np.empty(len(path))
+        direction_differences = np.empty(len(path))
+        length_differences    = np.empty(len(path))
+        position_differences  = np.empty(len(path))
+        duration_differences  = np.empty(len(path))
+        for index in range(len(path)):
+            i, j = path[index] // saccades_2, path[index] % saccades_2
+            saccade_1, saccade_2 = start_1 + i, start_2 + j
+            vector_differences[index] = differences[i, j]
+
+            theta_1, theta_2 = theta[saccade_1], theta[saccade_2]
+            if theta_1 < 0: theta_1 = math.pi + (math.pi + theta_1)
+            if theta_2 < 0: theta_2 = math.pi + (math.pi + theta_2)
+            direction_differences[index] = abs(theta_1 - theta_2)
+            if direction_differences[index] > math.pi:
+                direction_differences[index] = 2 * math.pi - direction_differences[index]
+
+            length_differences[index]   = abs(rho[saccade_1] - rho[saccade_2])
+            position_differences[index] = math.sqrt((x[saccade_1] - x[saccade_2]) ** 2 + (y[saccade_1] - y[saccade_2]) ** 2)
+
+            duration_1, duration_2 = duration[saccade_1], duration[saccade_2]
+            longest_duration = duration_2 if duration_2 > duration_1 else duration_1
+            duration_differences[index] = abs(duration_1 - duration_2) / abs(longest_duration)
+
+        values[pair_index, 0] = 1 - np.median(vector_differences) / (2 * screen_diagonal)
+        values[pair_index, 1] = 1 - np.median(direction_differences) / math.pi
+        values[pair_index, 2] = 1 - np.median(length_differences) / screen_diagonal
+        values[pair_index, 3] = 1 - np.median(position_differences) / screen_diagonal
+        values[pair_index, 4] = 1 - np.median(duration_differences)
+
+@numba.jit(nopython=True, cache=True)
+def align(differences):
+    " Shortest path from the first to the last pair of saccades, moving right, down or diagonally through the matrix of vector differences "
+    " (the cost of moving to a pair is its difference). Nodes (pairs of saccades, in row-major order) are visited by increasing distance and, "
+    " on a tie, by decreasing index; a node's predecessor is only replaced by a strictly shorter path "
+    """ Input:
+            differences (2D array) : vector differences between each saccade of a scanpath (rows) and each saccade of the other one (columns)
+        Output:
+            path (1D array) : nodes (as indexes in the flattened matrix) in the shortest path, from first to last
+    """
+    rows, columns    = differences.shape
+    number_of_nodes  = rows * columns
+    distances    = np.full(number_of_nodes, np.inf)
+    predecessors = np.full(number_of_nodes, -1)
+    # Binary heap of (distance, node), where nodes may be pushed more than once (outdated entries are skipped when popped)
+    heap_distances = np.empty(3 * number_of_nodes + 1)
+    heap_nodes     = np.empty(3 * number_of_nodes + 1, dtype=np.int64)
+    heap_size      = push(heap_distances, heap_nodes, 0, 0.0, 0)
+    distances[0]   = 0.0
+    neighbours     = np.empty(3, dtype=np.int64)
+    while heap_size:
+        distance, node = heap_distances[0], heap_nodes[0]
+        heap_size = pop(heap_distances, heap_nodes, heap_size)
+        if distances[node] < distance:
+            continue
+
+        row, column = node // columns, node % columns
+        number_of_neighbours = 0
+        if column < columns - 1:
+            neighbours[number_of_neighbours] = node + 1
+            number_of_neighbours += 1
+        if row < rows - 1:
+            neighbours[number_of_neighbours] = node + columns
+            number_of_neighbours += 1
+        if row < rows - 1 and column < columns - 1:
+            neighbours[number_of_neighbours] = node + columns + 1
+            number_of_neighbours += 1
+        for index in range(number_of_neighbours):
+            neighbour = neighbours[index]
+            neighbour_distance = distance + differences[neighbour // columns, neighbour % columns]
+            if distances[neighbour] > neighbour_distance:
+                distances[neighbour]    = neighbour_distance
+                predecessors[neighbour] = node
+                heap_size = push(heap_distances, heap_nodes, heap_size, neighbour_distance, neighbour)
+
+    path_length = 1
+    node = number_of_nodes - 1
+    while node != 0:
+        node = predecessors[node]
+        path_length += 1
+    path = np.empty(path_length, dtype=np.int64)
+    node = number_of_nodes - 1
+    for index in range(path_length - 1, -1, -1):
+        path[index] = node
+        node = predecessors[node]
+
+    return path
+
+@numba.jit(nopython=True, cache=True)
+def precedes(distance, node, other_distance, other_node):
+    return distance < other_distance or (distance == other_distance and node > other_node)
+
+@numba.jit(nopython=True, cache=True)
+def push(heap_distances, heap_nodes, heap_size, distance, node):
+    position = heap_size
+    while position > 0:
+        parent = (position - 1) // 2
+        if not precedes(distance, node, heap_distances[parent], heap_nodes[parent]):
+            break
+        heap_distances[position], heap_nodes[position] = heap_distances[parent], heap_nodes[parent]
+        position = parent
+    heap_distances[position], heap_nodes[position] = distance, node
+
+    return heap_size + 1
+
+@numba.jit(nopython=True, cache=True)
+def pop(heap_distances, heap_nodes, heap_size):
+    heap_size -= 1
+    distance, node = heap_distances[heap_size], heap_nodes[heap_size]
+    position = 0
+    while 2 * position + 1 < heap_size:
+        child = 2 * position + 1
+        if child + 1 < heap_size and precedes(heap_distances[child + 1], heap_nodes[child + 1], heap_distances[child], heap_nodes[child]):
+            child += 1
+        if not precedes(heap_distances[child], heap_nodes[child], distance, node):
+            break
+        heap_distances[position], heap_nodes[position] = heap_distances[child], heap_nodes[child]
+        position = child
+    heap_distances[position], heap_nodes[position] = distance, node
+
+    return heap_size
@@ -0,0 +1,132 @@
+import argparse
+import json
+import re
+import numpy as np
+import pandas as pd
+from os import path, makedirs, listdir, remove, replace, walk, getpid
+
+""" Store of the probability maps computed by the visual search models when predicting a human subject's scanpath.
+    The maps of each trial are kept in its own folder, as one binary file (in which the map of each fixation is appended, as float64 by default)
+    and a small index with their shape, their type and the fixation each one corresponds to. The whole trial can then be read at once, memory-mapped.
+    float32 and float16 take less space, but they're lossy: near-equal values of a map become ties, and tiny ones become zero, which changes the hsp metrics
+    (AUC in particular). They're only used when asked for explicitly.
+    Folders with the previous format (one fixation_N.csv file per fixation) are still read, and can be converted with:
+        python -m Metrics.scripts.probability_maps -dir <results dir>
+"""
+
+MAPS_FILE  = 'probability_maps.dat'
+INDEX_FILE = 'index.json'
+DEFAULT_DTYPE = 'float64'
+LOSSY_DTYPES  = ['float32', 'float16']
+
+def save(probability_map, fixation_number, trial_path, dtype=DEFAULT_DTYPE):
+    " Appends the probability map of a fixation to the trial's store, replacing it (and the ones after it) if it had already been saved "
+    """ Input:
+            probability_map (2D array) : probability map computed at the given fixation
+            fixation_number (int)      : number of the fixation, starting from one
+            trial_path (string)        : folder of the trial (such as output_path/probability_maps/image_name)
+            dtype (string)             : float64, or float32 and float16 (which halve the size of the store each, at the cost of precision)
+    """
+    probability_map = np.asarray(probability_map, dtype=dtype)
+    makedirs(trial_path, exist_ok=True)
+    index = load_index(trial_path)
+    if index is None or index['shape'] != list(probability_map.shape) or index['dtype'] != probability_map.dtype.name:
+        index = {'shape': list(probability_map.shape), 'dtype': probability_map.dtype.name, 'fixations': []}
+        # The index no longer lists any map before the maps file is emptied, so that an interruption in between leaves an empty trial
+        save_index(trial_path, index)
+        open(path.join(trial_path, MAPS_FILE), 'wb').close()
+    if fixation_number in index['fixations']:
+        # The trial is being run again. As above, the maps after it are dropped from the index before they're overwritten
+        index['fixations'] = index['fixations'][:index['fixations'].index(fixation_number)]
+        save_index(trial_path, index)
+
+    with open(path.join(trial_path, MAPS_FILE), 'r+b') as maps_file:
+        maps_file.seek(len(index['fixations']) * probability_map.nbytes)
+        maps_file.write(probability_map.tobytes())
+        maps_file.truncate()
+    # The index is updated last, so that an interrupted write is never read
+    index['fixations'].append(fixation_number)
+    save_index(trial_path, index)
+
+def load(trial_path):
+    " Returns the probability maps of a trial, sorted by fixation number "
+    """ Output:
+            fixations (list of int)      : fixation number of each map
+            probability_maps (3D array)  : probability map of each fixation (memory-mapped, unless they were read from .csv files)
+    """
+    index = load_index(trial_path)
+    if index is None:
+        return load_csv_files(trial_path)
+    if not index['fixations']:
+        return [], np.empty(shape=[0] + index['shape'], dtype=index['dtype'])
+
+    probability_maps = np.memmap(path.join(trial_path, MAPS_FILE), dtype=index['dtype'], mode='r', shape=tuple([len(index['fixations'])] + index['shape']))
+    order = np.argsort(index['fixations'], kind='stable')
+    if np.any(order != np.arange(len(order))):
+        probability_maps = probability_maps[order]
+
+    return [index['fixations'][i] for i in order], probability_maps
+
+def exists(trial_path):
+    " Returns True if any probability map has been saved for the trial, in either format "
+    if not path.exists(trial_path):
+        return False
+    index = load_index(trial_path)
+    if index is None:
+        return bool(csv_files(trial_path))
+
+    return bool(index['fixations'])
+
+def convert(trial_path, dtype=DEFAULT_DTYPE):
+    " Converts the fixation_N.csv files of a trial to the binary store. The files are only removed afterwards if a lossy dtype (float32 or float16) "
+    " was explicitly asked for; otherwise they're kept, so that the conversion can always be undone "
+    fixations, probability_maps = load_csv_files(trial_path)
+    for fixation_number, probability_map in zip(fixations, probability_maps):
+        save(probability_map, fixation_number, trial_path, dtype)
+    if dtype in LOSSY_DTYPES:
+        for filename in csv_files(trial_path):
+            remove(path.join(trial_path, filename))
+
+def convert_all(results_dir, dtype=DEFAULT_DTYPE):
+    " Converts every folder with fixation_N.csv files found inside results_dir "
+    converted_trials = 0
+    for dirpath, _, filenames in walk(results_dir):
+        if any(is_csv_file(filename) for filename in filenames):
+            convert(dirpath, dtype)
+            converted_trials += 1
+
+    return converted_trials
+
+def load_csv_files(trial_path):
+    fixations = sorted(int(re.findall(r'\d+', filename)[0]) for filename in csv_files(trial_path))
+    probability_maps = np.array([pd.read_csv(path.join(trial_path, 'fixation_' + str(fixation_number) + '.csv')).to_numpy() for fixation_number in fixations])
+
+    return fixations, probability_maps
+
+def csv_files(trial_path):
+    return [filename for filename in listdir(trial_path) if is_csv_file(filename)]
+
+def is_csv_file(filename):
+    return re.fullmatch(r'fixation_\d+\.csv', filename) is not None
+
+def load_index(trial_path):
+    index_file = path.join(trial_path, INDEX_FILE)
+    if not path.exists(index_file):
+        return None
+    with open(index_file, 'r') as json_file:
+        return json.load(json_file)
+
+def save_index(trial_path, index):
+    temporary_file = path.join(trial_path, INDEX_FILE + '.' + str(getpid()) + '.tmp')
+    with open(temporary_file, 'w') as json_file:
+        json.dump(index, json_file)
+    replace(temporary_file, path.join(trial_path, INDEX_FILE))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts the probability maps saved as fixation_N.csv files to the binary store')
+    parser.add_argument('-dir', type=str, default='Results', help='Folder where to look for probability maps (recursively)')
+    parser.add_argument('-dtype', type=str, default=DEFAULT_DTYPE, choices=[DEFAULT_DTYPE] + LOSSY_DTYPES, \
+        help='Type with which the maps are stored. float32 and float16 are lossy (they may change the hsp metrics), and the .csv files are removed after converting to them')
+
+    args = parser.parse_args()
+    print('Converted ' + str(convert_all(args.dir, args.dtype)) + ' trials')
@@ -0,0 +1,280 @@
+import json
+import re
+import numpy as np
+from os import path, listdir, makedirs, replace, getpid, stat
+
+""" Store of the human scanpaths of a dataset, compiled once from the JSON file of each subject (subjNN_scanpaths.json) into memory-mapped NumPy arrays.
+    Every field of the scanpaths is kept in a column: scalars (such as target_found) hold one value per scanpath, while lists (such as X, Y, T and target_bbox)
+    are concatenated and indexed by offsets. Fixations also have their subject, image and fixation number in columns of their own. Scanpaths are grouped by subject,
+    and are indexed by image as well, so that all the scanpaths of a subject or of an image are read without parsing any JSON file.
+    The store is kept in a folder next to the scanpaths' one (human_scanpaths_store), and is compiled again whenever any of the JSON files changes.
+"""
+
+STORE_SUFFIX  = '_store'
+INDEX_FILE    = 'index.json'
+SUBJECT_FILE  = re.compile(r'^subj(\d+)_scanpaths\.json$')
+FIXATIONS_KEY = 'X'
+MISSING       = object()
+
+stores = {}
+
+def load(human_scanpaths_dir):
+    " Returns the store of the scanpaths in human_scanpaths_dir, compiling it if it doesn't exist or if it's outdated "
+    " Stores are kept in memory, so calling this function again is cheap (it only checks whether any file changed) "
+    human_scanpaths_dir = path.normpath(str(human_scanpaths_dir))
+    sources = source_files(human_scanpaths_dir)
+    store   = stores.get(human_scanpaths_dir)
+    if store is None or store.index['sources'] != sources:
+        store_dir = human_scanpaths_dir + STORE_SUFFIX
+        index     = load_index(store_dir)
+        if index is None or index['sources'] != sources:
+            print('Compiling the human scanpaths in ' + human_scanpaths_dir)
+            index = compile_store(human_scanpaths_dir, store_dir, sources)
+        store = ScanpathsStore(store_dir, index)
+        stores[human_scanpaths_dir] = store
+
+    return store
+
+def source_files(human_scanpaths_dir):
+    " Size and modification time (in nanoseconds) of each subject's JSON file, sorted by subject number "
+    subjects_files = sorted((file for file in listdir(human_scanpaths_dir) if SUBJECT_FILE.match(file)), key=lambda file: int(SUBJECT_FILE.match(file).group(1)))
+    sources = []
+    for subject_file in subjects_files:
+        file_stat = stat(path.join(human_scanpaths_dir, subject_file))
+        sources.append([subject_file, file_stat.st_size, file_stat.st_mtime_ns])
+
+    return sources
+
+def load_index(store_dir):
+    index_file = path.join(store_dir, INDEX_FILE)
+    if not path.exists(index_file):
+        return None
+    with open(index_file, 'r') as index:
+        return json.load(index)
+
+def compile_store(human_scanpaths_dir, store_dir, sources):
+    " Reads every subject's JSON file and writes its scanpaths, field by field, to store_dir "
+    subjects, images, images_ids, layouts, layouts_ids = [], [], {}, [], {}
+    scanpaths_subject, scanpaths_image, scanpaths_layout, values = [], [], [], {}
+    for subject_file, _, _ in sources:
+        with open(path.join(human_scanpaths_dir, subject_file), 'r') as json_file:
+            subject_scanpaths = json.load(json_file)
+        subjects.append(int(SUBJECT_FILE.match(subject_file).group(1)))
+        for image_name, scanpath in subject_scanpaths.items():
+            if image_name not in images_ids:
+                images_ids[image_name] = len(images)
+                images.append(image_name)
+            layout = tuple(scanpath)
+            if layout not in layouts_ids:
+                layouts_ids[layout] = len(layouts)
+                layouts.append(list(layout))
+            scanpaths_subject.append(len(subjects) - 1)
+            scanpaths_image.append(images_ids[image_name])
+            scanpaths_layout.append(layouts_ids[layout])
+            for key in scanpath:
+                values.setdefault(key, {})[len(scanpaths_subject) - 1] = scanpath[key]
+
+    number_of_scanpaths = len(scanpaths_subject)
+    scanpaths_subject   = np.array(scanpaths_subject, dtype=np.int32)
+    scanpaths_image     = np.array(scanpaths_image, dtype=np.int32)
+    makedirs(store_dir, exist_ok=True)
+    arrays = {'scanpath_subject': scanpaths_subject, 'scanpath_image': scanpaths_image, 'scanpath_layout': np.array(scanpaths_layout, dtype=np.int32)}
+    # Scanpaths are already grouped by subject; the ones of each image are found through a permutation
+    arrays['subject_offsets'] = np.searchsorted(scanpaths_subject, np.arange(len(subjects) + 1)).astype(np.int64)
+    arrays['image_order']     = np.argsort(scanpaths_image, kind='stable').astype(np.int64)
+    arrays['image_offsets']   = np.searchsorted(scanpaths_image[arrays['image_order']], np.arange(len(images) + 1)).astype(np.int64)
+
+    fields = {}
+    for key, field_values in values.items():
+        field_values = [field_values.get(scanpath_index, MISSING) for scanpath_index in range(number_of_scanpaths)]
+        fields[key], field_arrays = compile_field(key, field_values)
+        arrays.update(field_arrays)
+
+    # Subject, image and number of each fixation
+    fixations_lengths = np.diff(arrays[FIXATIONS_KEY + '_offsets']) if FIXATIONS_KEY + '_offsets' in arrays else np.zeros(number_of_scanpaths, dtype=np.int64)
+    arrays['fixation_subject'] = np.repeat(scanpaths_subject, fixations_lengths)
+    arrays['fixation_image']   = np.repeat(scanpaths_image, fixations_lengths)
+    arrays['fixation_number']  = (np.arange(np.sum(fixations_lengths)) - np.repeat(np.cumsum(fixations_lengths) - fixations_lengths, fixations_lengths)).astype(np.int32)
+
+    for name, array in arrays.items():
+        temporary_file = path.join(store_dir, name + '.' + str(getpid()) + '.npy')
+        np.save(temporary_file, array)
+        replace(temporary_file, path.join(store_dir, name + '.npy'))
+
+    # The index is written last, so that an interrupted compilation is never read
+    index = {'sources': sources, 'subjects': subjects, 'images': images, 'layouts': layouts, 'fields': fields}
+    temporary_file = path.join(store_dir, INDEX_FILE + '.' + str(getpid()))
+    with open(temporary_file, 'w') as index_file:
+        json.dump(index, index_file)
+    replace(temporary_file, path.join(store_dir, INDEX_FILE))
+
+    return index
+
+def compile_field(key, field_values):
+    " Turns the values of a field (one per scanpath, MISSING where the scanpath lacks it) into columns "
+    """ Output:
+            field (dict)  : how the field is stored. Its kind is bool, int, float, str (whose values are codes of categories) or json (for anything else,
+                            stored as categories as well), and, if sequence is true, each scanpath holds a list of them
+            arrays (dict) : columns of the field, indexed by file name
+    """
+    present = [value for value in field_values if value is not MISSING]
+    if present and all(isinstance(value, list) for value in present):
+        items  = [item for value in present for item in value]
+        kind   = value_kind(items)
+        mixed  = kind == 'float' and any(isinstance(item, int) for item in items)
+        field  = {'kind': kind, 'sequence': True, 'mixed': mixed}
+        lengths = [len(value) if value is not MISSING else 0 for value in field_values]
+        arrays  = {key + '_offsets': np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)}
+        if kind in ['str', 'json']:
+            field['categories'], items = categorize(items, kind)
+        arrays[key] = np.array(items, dtype=column_type(kind))
+        if mixed:
+            # Integers are read back as such, as they were in the JSON file
+            arrays[key + '_is_int'] = np.array([isinstance(item, int) for item in items], dtype=bool)
+    else:
+        kind  = value_kind(present) if all(not isinstance(value, list) for value in present) else 'json'
+        if kind == 'float' and any(isinstance(value, int) for value in present):
+            kind = 'json'
+        field = {'kind': kind, 'sequence': False, 'mixed': False}
+        if kind in ['str', 'json']:
+            field['categories'], present = categorize(present, kind)
+        present = iter(present)
+        default = 0 if kind in ['str', 'json'] else column_type(kind)(0)
+        arrays  = {key: np.array([next(present) if value is not MISSING else default for value in field_values], dtype=column_type(kind))}
+
+    return field, arrays
+
+def value_kind(values):
+    if all(isinstance(value, bool) for value in values):
+        return 'bool'
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+        return 'int'
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+        return 'float'
+    if all(isinstance(value, str) for value in values):
+        return 'str'
+
+    return 'json'
+
+def column_type(kind):
+    return {'bool': np.bool_, 'int': np.int64, 'float': np.float64, 'str': np.int32, 'json': np.int32}[kind]
+
+def categorize(values, kind):
+    " Replaces each value by the code of its category "
+    if kind == 'json':
+        values = [json.dumps(value) for value in values]
+    categories = list(dict.fromkeys(values))
+    codes      = {category: code for code, category in enumerate(categories)}
+
+    return categories, [codes[value] for value in values]
+
+class ScanpathsStore:
+    def __init__(self, store_dir, index):
+        self.store_dir = store_dir
+        self.index     = index
+        self.subjects  = index['subjects']
+        self.images    = index['images']
+        self.subjects_ids = {subject: subject_id for subject_id, subject in enumerate(self.subjects)}
+        self.images_ids   = {image_name: image_id for image_id, image_name in enumerate(self.images)}
+        self.arrays       = {}
+
+    def array(self, name):
+        " Column (or index) of the store, memory-mapped "
+        if name not in self.arrays:
+            array_file = path.join(self.store_dir, name + '.npy')
+            try:
+                self.arrays[name] = np.load(array_file, mmap_mode='r')
+            except ValueError:
+                # Empty arrays can't be memory-mapped
+                self.arrays[name] = np.load(array_file)
+
+        return self.arrays[name]
+
+    def subject_file(self, subject):
+        return self.index['sources'][self.subjects_ids[subject]][0]
+
+    def subject_scanpaths(self, subject):
+        " Scanpaths of the given subject (as a subject number), as in its JSON file: a dictionary indexed by image name "
+        subject_id = self.subjects_ids[subject]
+        offsets    = self.array('subject_offsets')
+        scanpaths_indexes = np.arange(offsets[subject_id], offsets[subject_id + 1])
+
+        return dict(zip(self.images_of(scanpaths_indexes), self.scanpaths(scanpaths_indexes)))
+
+    def image_scanpaths(self, image_name):
+        " Scanpaths of every subject on the given image, as a dictionary indexed by subject number "
+        scanpaths_indexes = self.image_scanpaths_indexes(image_name)
+        subjects = [self.subjects[subject_id] for subject_id in self.array('scanpath_subject')[scanpaths_indexes]]
+
+        return dict(zip(subjects, self.scanpaths(scanpaths_indexes)))
+
+    def subject_images(self, subject):
+        " Names of the images the given subject has a scanpath on "
+        subject_id = self.subjects_ids[subject]
+        offsets    = self.array('subject_offsets')
+
+        return self.images_of(np.arange(offsets[subject_id], offsets[subject_id + 1]))
+
+    def image_fixations(self, image_name, excluded_subjects=()):
+        " Coordinates of every fixation made on the given image, by every subject but the excluded ones, in order of subject "
+        """ Output:
+                fixations_x, fixations_y (1D arrays) : coordinates of the fixations, as they are in the JSON files. They are integers if all of them were
+        """
+        excluded_ids = [self.subjects_ids[subject] for subject in excluded_subjects if subject in self.subjects_ids]
+        scanpaths_indexes = self.image_scanpaths_indexes(image_name)
+        scanpaths_indexes = scanpaths_indexes[np.isin(self.array('scanpath_subject')[scanpaths_indexes], excluded_ids, invert=True)]
+
+        return self.concatenated_values('X', scanpaths_indexes), self.concatenated_values('Y', scanpaths_indexes)
+
+    def image_scanpaths_indexes(self, image_name):
+        if image_name not in self.images_ids:
+            return np.empty(0, dtype=np.int64)
+        image_id = self.images_ids[image_name]
+        offsets  = self.array('image_offsets')
+
+        return np.array(self.array('image_order')[offsets[image_id]:offsets[image_id + 1]])
+
+    def images_of(self, scanpaths_indexes):
+        return [self.images[image_id] for image_id in self.array('scanpath_image')[scanpaths_indexes]]
+
+    def values_positions(self, key, scanpaths_indexes):
+        " Positions, in the column of a list field, of the values of the given scanpaths (one after the other), alongside the length of each list "
+        offsets = self.array(key + '_offsets')
+        starts  = offsets[scanpaths_indexes]
+        lengths = offsets[scanpaths_indexes + 1] - starts
+
+        return np.arange(np.sum(lengths)) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths), lengths
+
+    def concatenated_values(self, key, scanpaths_indexes):
+        " Values of a list field of the given scanpaths, one after the other "
+        positions, _ = self.values_positions(key, scanpaths_indexes)
+        values = self.array(key)[positions]
+        if self.index['fields'][key]['mixed'] and np.all(self.array(key + '_is_int')[positions]):
+            values = values.astype(np.int64)
+
+        return values
+
+    def scanpaths(self, scanpaths_indexes):
+        " Rebuilds the given scanpaths (as dictionaries, with their keys in the same order as in the JSON files) "
+        columns = {}
+        for key, field in self.index['fields'].items():
+            if field['sequence']:
+                positions, lengths = self.values_positions(key, scanpaths_indexes)
+                items = self.decode(field, self.array(key)[positions].tolist())
+                if field['mixed']:
+                    items = [int(item) if item_is_int else item for item, item_is_int in zip(items, self.array(key + '_is_int')[positions].tolist())]
+                ends = np.cumsum(lengths).tolist()
+                columns[key] = [items[end - length:end] for end, length in zip(ends, lengths.tolist())]
+            else:
+                columns[key] = self.decode(field, self.array(key)[scanpaths_indexes].tolist())
+
+        layouts = self.index['layouts']
+        return [{key: columns[key][position] for key in layouts[layout]} for position, layout in enumerate(self.array('scanpath_layout')[scanpaths_indexes].tolist())]
+
+    def decode(self, field, values):
+        if field['kind'] == 'str':
+            return [field['categories'][code] for code in values]
+        if field['kind'] == 'json':
+            return [json.loads(field['categories'][code]) for code in values]
+
+        return values
@@ -0,0 +1,115 @@
+import json
+import sys
+import time
+from os import path, makedirs, remove, fsync
+
+""" Journal of the trials finished by a visual search model, so that an interrupted run (by Ctrl + C, a crash, or the process being killed) can be resumed.
+    It's an append-only JSONL file in the output folder: its first line is a header (such as the configuration used), and each of the following ones is
+    the record of a finished trial (such as its scanpath). Records are buffered and written every FLUSH_TRIALS trials or FLUSH_SECONDS seconds,
+    whichever comes first. A run that is resumed skips the trials in the journal, and adds their records to the results once all trials are finished.
+"""
+
+JOURNAL_FILE   = 'trials_journal.jsonl'
+RESUME_OPTIONS = ['auto', 'never', 'ask']
+FLUSH_TRIALS   = 10
+FLUSH_SECONDS  = 60
+
+def resume(output_path, policy):
+    " Applies the resume policy to the journal in output_path, if there's one "
+    """ Input:
+            output_path (string) : folder where the model's results are stored
+            policy (string)      : 'auto' resumes execution whenever there's a journal, 'never' deletes it and starts over, and 'ask' asks what to do
+        Output:
+            header (dict)  : header of the journal (empty if execution starts over)
+            records (dict) : records of the trials in the journal, indexed by image name (empty if execution starts over)
+    """
+    if policy not in RESUME_OPTIONS:
+        raise ValueError('Invalid resume policy, valid options are: ' + ', '.join(RESUME_OPTIONS))
+    header, records = load(output_path)
+    if not records:
+        # There's nothing to resume (the header alone may belong to a different configuration)
+        erase(output_path)
+        return {}, {}
+
+    if policy == 'ask':
+        answer = input('Checkpoint found! Resume execution? (Y/N): ').upper()
+        if answer not in ['Y', 'N']:
+            print('Invalid answer. Exiting...')
+            sys.exit(-1)
+        policy = 'auto' if answer == 'Y' else 'never'
+    if policy == 'never':
+        erase(output_path)
+        print('Checkpoint deleted\n')
+        return {}, {}
+
+    print('Checkpoint loaded (' + str(len(records)) + ' trials already run). Resuming execution...\n')
+
+    return header, records
+
+def load(output_path):
+    " Reads the journal in output_path. A line cut off by an interrupted write is ignored "
+    header, records = {}, {}
+    journal_file = path.join(output_path, JOURNAL_FILE)
+    if not path.exists(journal_file):
+        return header, records
+    with open(journal_file, 'r') as journal:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if 'header' in entry:
+                header = entry['header']
+            else:
+                records[entry['image']] = entry['record']
+
+    return header, records
+
+def remaining_trials(trials_properties, records):
+    " Returns the trials in trials_properties which aren't in the journal's records "
+    return [trial for trial in trials_properties if trial['image'] not in records]
+
+def erase(output_path):
+    journal_file = path.join(output_path, JOURNAL_FILE)
+    if path.exists(journal_file):
+        remove(journal_file)
+
+class Journal:
+    " Appends the records of finished trials to the journal in output_path, creating it (with the given header) if it doesn't exist "
+    def __init__(self, output_path, header=None, flush_trials=FLUSH_TRIALS, flush_seconds=FLUSH_SECONDS):
+        makedirs(output_path, exist_ok=True)
+        journal_file = path.join(output_path, JOURNAL_FILE)
+        is_new       = not path.exists(journal_file)
+        self.journal = open(journal_file, 'a+')
+        self.pending = []
+        self.flush_trials  = flush_trials
+        self.flush_seconds = flush_seconds
+        self.last_flush    = time.time()
+        if is_new:
+            self.pending.append(json.dumps({'header': header or {}}))
+            self.flush()
+        elif self.journal.tell():
+            # An interrupted write may have left the last line incomplete
+            self.journal.seek(self.journal.tell() - 1)
+            if self.journal.read(1) != '\n':
+                self.journal.write('\n')
+
+    def append(self, image_name, record):
+        " Adds the record of a finished trial (which must be JSON serializable) to the journal "
+        self.pending.append(json.dumps({'image': image_name, 'record': record}))
+        if len(self.pending) >= self.flush_trials or time.time() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.journal.write('\n'.join(self.pending) + '\n')
+            self.journal.flush()
+            fsync(self.journal.fileno())
+            self.pending = []
+        self.last_flush = time.time()
+
+    def close(self):
+        " Writes the pending records to disk "
+        if not self.journal.closed:
+            self.flush()
+            self.journal.close()
@@ -5,10 +5,9 @@ import pickle
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from os import listdir, path, scandir, makedirs
-from sklearn.neighbors import KernelDensity
-from sklearn.model_selection import GridSearchCV
+from os import listdir, path, makedirs
 from .. import constants
+from . import scanpaths_store, kernel_density
 
 def plot_table(df, title, save_path, filename):
     fig, ax = plt.subplots()
@@ -96,11 +95,6 @@ def create_dirs(filepath):
     if len(dir_) > 0 and not path.exists(dir_):
         makedirs(dir_)  
 
-def dir_is_too_heavy(path):
-    nmbytes = sum(d.stat().st_size for d in scandir(path) if d.is_file()) / 2**20
-    
-    return nmbytes > constants.MAX_DIR_SIZE
-
 def is_contained_in(json_file_1, json_file_2):
     if not (path.exists(json_file_1) and path.exists(json_file_2)):
         return False
@@ -241,38 +235,10 @@ def collapse_fixations(scanpath_x, scanpath_y, receptive_size):
     return collapsed_scanpath_x, collapsed_scanpath_y
 
 def aggregate_scanpaths(subjects_scanpaths_path, image_name, excluded_subject='None'):
-    subjects_scanpaths_files = sorted_alphanumeric(listdir(subjects_scanpaths_path))
-
-    scanpaths_X = []
-    scanpaths_Y = []
-    for subject_file in subjects_scanpaths_files:
-        if excluded_subject in subject_file:
-            continue
-        subject_scanpaths = load_dict_from_json(path.join(subjects_scanpaths_path, subject_file))
-        if image_name in subject_scanpaths:
-            trial = subject_scanpaths[image_name]
-            scanpaths_X += trial['X']
-            scanpaths_Y += trial['Y']
-
-    scanpaths_X = np.array(scanpaths_X)
-    scanpaths_Y = np.array(scanpaths_Y)
-
-    return scanpaths_X, scanpaths_Y
+    store = scanpaths_store.load(subjects_scanpaths_path)
+    excluded_subjects = [subject for subject in store.subjects if excluded_subject in store.subject_file(subject)]
 
-def search_bandwidth(values, shape, splits=5):
-    """ Perform a grid search to look for the optimal bandwidth (i.e. the one that maximizes log-likelihood) """
-    # Define search space (values estimated from previous executions)
-    if np.log(shape[0] * shape[1]) < 10:
-        bandwidths = 10 ** np.linspace(-1, 1, 100)
-    else:
-        bandwidths = np.linspace(15, 70, 200)
-    
-    n_splits = min(values.shape[0], splits)
-    grid = GridSearchCV(KernelDensity(kernel='gaussian'),
-                        {'bandwidth': bandwidths}, n_jobs=-1, cv=n_splits)
-    grid.fit(values)
-
-    return grid.best_params_['bandwidth']
+    return store.image_fixations(image_name, excluded_subjects)
 
 def load_center_bias_fixations(model_size):
     center_bias_fixs = load_dict_from_json(constants.CENTER_BIAS_FIXATIONS)
@@ -283,14 +249,10 @@ def load_center_bias_fixations(model_size):
     return scanpaths_X, scanpaths_Y
 
 def gaussian_kde(scanpaths_X, scanpaths_Y, shape, bandwidth=None):
-    values = np.vstack([scanpaths_Y, scanpaths_X]).T
+    """ Density of the given fixations at every pixel. If no bandwidth is given, the one that maximizes their leave-one-out log-likelihood is used """
+    fixations_histogram = kernel_density.histogram(scanpaths_X, scanpaths_Y)
 
     if bandwidth is None:
-        bandwidth = search_bandwidth(values, shape)
-
-    X, Y = np.mgrid[0:shape[0], 0:shape[1]] + 0.5
-    positions = np.vstack([X.ravel(), Y.ravel()]).T
-    gkde   = KernelDensity(kernel='gaussian', bandwidth=bandwidth).fit(values)
-    scores = np.exp(gkde.score_samples(positions))
+        bandwidth = kernel_density.search_bandwidth([fixations_histogram], shape)
 
-    return scores.reshape(shape)
\ No newline at end of file
+    return kernel_density.density(fixations_histogram, shape, bandwidth)
\ No newline at end of file
@@ -4,7 +4,7 @@ from os import path
 
 " Runs visualsearch/main.py according to the supplied parameters "
 
-def setup_and_run(dataset_name, config_name, image_name, image_range, human_subject, number_of_processes, save_probability_maps):
+def setup_and_run(dataset_name, config_name, image_name, image_range, human_subject, number_of_processes, save_probability_maps, resume='auto'):
     dataset_path = path.join(constants.DATASETS_PATH, dataset_name)
     output_path  = path.join(constants.RESULTS_PATH, path.join(dataset_name + '_dataset', 'ELM'))
 
@@ -12,13 +12,34 @@ def setup_and_run(dataset_name, config_name, image_name, image_range, human_subj
 
     dataset_info      = loader.load_dataset_info(dataset_path)
     output_path       = loader.create_output_folders(output_path, config_name, image_name, image_range, human_subject)
-    checkpoint        = loader.load_checkpoint(output_path)
+    checkpoint        = loader.load_checkpoint(output_path, resume)
     human_scanpaths   = loader.load_human_scanpaths(dataset_info['scanpaths_dir'], human_subject)
     config            = loader.load_config(constants.CONFIG_DIR, config_name, constants.IMAGE_SIZE, dataset_info['max_scanpath_length'], number_of_processes, save_probability_maps, human_scanpaths, checkpoint)
     trials_properties = loader.load_trials_properties(trials_properties_file, image_name, image_range, human_scanpaths, checkpoint)
 
     visualsearch.run(config, dataset_info, trials_properties, human_scanpaths, output_path, constants.SIGMA)
 
+def setup_and_run_subjects(dataset_name, config_name, human_subjects, number_of_processes):
+    " Runs the model following the scanpaths of each of the given human subjects, loading the model and the dataset only once "
+    dataset_path = path.join(constants.DATASETS_PATH, dataset_name)
+    output_path  = path.join(constants.RESULTS_PATH, path.join(dataset_name + '_dataset', 'ELM'))
+
+    trials_properties_file = path.join(dataset_path, 'trials_properties.json')
+
+    dataset_info       = loader.load_dataset_info(dataset_path)
+    subjects_scanpaths = {human_subject: loader.load_human_scanpaths(dataset_info['scanpaths_dir'], human_subject) for human_subject in human_subjects}
+    output_paths       = {human_subject: loader.create_output_folders(output_path, config_name, None, None, human_subject) for human_subject in human_subjects}
+    config             = loader.load_config(constants.CONFIG_DIR, config_name, constants.IMAGE_SIZE, dataset_info['max_scanpath_length'], number_of_processes, True, subjects_scanpaths, checkpoint={})
+    subjects_images    = set(image_name for human_scanpaths in subjects_scanpaths.values() for image_name in human_scanpaths)
+    trials_properties  = loader.load_trials_properties(trials_properties_file, None, None, subjects_images, checkpoint={})
+
+    visualsearch.run_human_subjects(config, dataset_info, trials_properties, subjects_scanpaths, output_paths, constants.SIGMA)
+
 """ Main method, added to be polymorphic with respect to the other models """
-def main(dataset_name, human_subject=None):
-    setup_and_run(dataset_name, config_name=constants.CONFIG_NAME, image_name=None, image_range=None, human_subject=human_subject, number_of_processes=constants.NUMBER_OF_PROCESSES, save_probability_maps=False)
\ No newline at end of file
+def main(dataset_name, human_subject=None, resume='auto'):
+    " human_subject can be a list of subjects, in which case all of them are run in a single process "
+    " resume can be auto, never or ask, and indicates what to do if a previous execution was interrupted (see Metrics/scripts/trials_journal.py) "
+    if isinstance(human_subject, list):
+        setup_and_run_subjects(dataset_name, config_name=constants.CONFIG_NAME, human_subjects=human_subject, number_of_processes=constants.NUMBER_OF_PROCESSES)
+    else:
+        setup_and_run(dataset_name, config_name=constants.CONFIG_NAME, image_name=None, image_range=None, human_subject=human_subject, number_of_processes=constants.NUMBER_OF_PROCESSES, save_probability_maps=False, resume=resume)
\ No newline at end of file
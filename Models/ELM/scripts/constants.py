@@ -7,7 +7,8 @@ CONFIG_DIR    = path.join('Models', 'ELM', 'configs')
 DATASETS_PATH = 'Datasets'
 RESULTS_PATH  = 'Results'
 SALIENCY_PATH = path.join('Models', 'ELM', 'data', 'saliency')
-TARGET_SIMILARITY_PATH = path.join('Models', 'ELM', 'data', 'target_similarity_maps')
+# Shared by nnIBS and ELM
+TARGET_SIMILARITY_PATH = path.join('Models', 'nnIBS', 'data', 'target_similarity_cache')
 
 NUMBER_OF_PROCESSES = 'all'
 SIGMA      = [[4000, 0], [0, 2600]]
@@ -1,23 +1,15 @@
 import json
-import sys
-from os import makedirs, listdir, path, remove, cpu_count
+from os import makedirs, path, cpu_count
 from . import constants
+from Metrics.scripts import trials_journal, scanpaths_store
 
-def load_checkpoint(output_path):
+def load_checkpoint(output_path, resume):
+    " Applies the resume policy (auto, never or ask) to the journal of the trials already run in output_path (see Metrics/scripts/trials_journal.py) "
+    header, records = trials_journal.resume(output_path, resume)
     checkpoint = {}
-    checkpoint_file = path.join(output_path, 'checkpoint.json')
-    if path.exists(checkpoint_file):
-        answer = input('Checkpoint found! Resume execution? (Y/N): ').upper()
-        if answer not in ['Y', 'N']:
-            print('Invalid answer. Exiting...')
-            sys.exit(-1)
-        if answer == 'Y':
-            checkpoint = load_dict_from_json(checkpoint_file)
-            print('Checkpoint loaded. Resuming execution...\n')
-        if answer == 'N':
-            remove(checkpoint_file)
-            print('Checkpoint deleted\n')
-    
+    if records:
+        checkpoint = {'configuration': header['configuration'], 'trials': records}
+
     return checkpoint
 
 def load_config(config_dir, config_name, image_size, max_scanpath_length, number_of_processes, save_probability_maps, human_scanpaths, checkpoint):
@@ -43,13 +35,34 @@ def load_config(config_dir, config_name, image_size, max_scanpath_length, number
     else:
         print('Successfully loaded ' + config_name + '.json!')
     print('Search model: ' + config['search_model'])
+    if config['search_model'] == 'ibs':
+        print('IBS engine: ' + config.get('ibs_engine', 'vectorized'))
+        if config.get('ibs_integration', 'trapezoid') == 'gauss_hermite':
+            print('IBS integration: Gauss-Hermite quadrature (' + str(config.get('gauss_hermite_nodes', 12)) + ' nodes, ' + config.get('gauss_hermite_norm_cdf', 'ndtr') + ')')
+        else:
+            print('IBS integration: trapezoidal rule')
+        if config.get('ibs_mode', 'exact') == 'pruned':
+            print('IBS mode: pruned (target locations covering ' + str(config.get('ibs_pruning_mass', 0.999)) + ' of the posterior mass)')
+        else:
+            print('IBS mode: exact')
+    if config['search_model'] == 'elm':
+        print('ELM engine: ' + config.get('elm_engine', 'contraction'))
+    if config['search_model'] in ['ibs', 'elm'] and config.get('candidate_search', 'exhaustive') == 'coarse_to_fine':
+        print('Candidate search: coarse to fine (stride ' + str(config.get('candidate_search_stride', 2)) + ', top ' + str(config.get('candidate_search_top_k', 4)) + ')' \
+            + (', verified' if config.get('candidate_search_verify', False) else ''))
     print('Target similarity: ' + config['target_similarity'])
     print('Prior: ' + config['prior'])
     print('Max. saccades: ' + str(config['max_saccades']))
     print('Cell size: ' + str(config['cell_size']))
+    print('Visibility map mode: ' + config.get('visibility_map_mode', 'dense'))
     print('Scale factor: ' + str(config['scale_factor']))
     print('Additive shift: ' + str(config['additive_shift']))
     print('Random seed: ' + str(config['seed']))
+    print('Random streams: ' + config.get('random_streams', 'seed'))
+    if config.get('replicates', 1) > 1:
+        print('Replicates: ' + str(config['replicates']) + ' (seeds ' + str(config['seed']) + ' to ' + str(config['seed'] + config['replicates'] - 1) + ')')
+    if config.get('trial_processes', 1) > 1:
+        print('Trials will be run ' + str(config['trial_processes']) + ' at a time')
     if config['proc_number'] > 1:
         print('Multiprocessing is ENABLED!')
     else:
@@ -74,7 +87,8 @@ def load_dataset_info(dataset_path):
     dataset_info['scanpaths_dir'] = path.join(dataset_path, dataset_info['scanpaths_dir'])
     # Add saliency and target similarity maps dirs
     dataset_info['saliency_dir']  = path.join(constants.SALIENCY_PATH, dataset_info['dataset_name'])
-    dataset_info['target_similarity_dir'] = path.join(constants.TARGET_SIMILARITY_PATH, dataset_info['dataset_name'])
+    # Target similarity maps are cached by content, so there is a single cache for every dataset
+    dataset_info['target_similarity_dir'] = constants.TARGET_SIMILARITY_PATH
 
     return dataset_info
 
@@ -82,29 +96,28 @@ def load_human_scanpaths(human_scanpaths_dir, human_subject):
     if human_subject is None:
         return {}
 
-    human_scanpaths_files = listdir(human_scanpaths_dir)
-    human_subject_str     = str(human_subject)
+    humans_scanpaths  = scanpaths_store.load(human_scanpaths_dir)
+    human_subject_str = str(human_subject)
     if human_subject < 10: human_subject_str = '0' + human_subject_str
-    human_subject_file    = 'subj' + human_subject_str + '_scanpaths.json'
-    if not human_subject_file in human_scanpaths_files:
+    if not human_subject in humans_scanpaths.subjects:
         raise NameError('Scanpaths for human subject ' + human_subject_str + ' not found!')
     
-    human_scanpaths = load_dict_from_json(path.join(human_scanpaths_dir, human_subject_file))
+    human_scanpaths = humans_scanpaths.subject_scanpaths(human_subject)
 
     return human_scanpaths
 
 def load_trials_properties(trials_properties_file, image_name, image_range, human_scanpaths, checkpoint):
     trials_properties = load_dict_from_json(trials_properties_file)
     
-    if checkpoint:
-        trials_properties = checkpoint['trials_properties']
-    elif image_name is not None:
+    if image_name is not None:
         trials_properties = get_trial_properties_for_image(trials_properties, image_name)
     elif image_range is not None:
         trials_properties = get_trial_properties_in_range(trials_properties, image_range)
     
     if human_scanpaths:
         trials_properties = get_trial_properties_for_subject(trials_properties, human_scanpaths)
+    if checkpoint:
+        trials_properties = trials_journal.remaining_trials(trials_properties, checkpoint['trials'])
 
     return trials_properties
 
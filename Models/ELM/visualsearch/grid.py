@@ -11,32 +11,49 @@ class Grid:
 
     def reduce(self, image, mode):
         " Given an image, its dimensions are reduced by a factor of cell_size. The new values in each position of the grid correspond to the mean or max values of that portion of the image "
+        " Cells are reduced all at once: with np.maximum.reduceat for 'max', and by reshaping the image into blocks (one per cell) for 'mean'. In the last row and column, "
+        " cells are cut off by the offset. Results are the same as when reducing each cell on its own "
         """ Input:
-                image (2D array) : image to be reduced to a grid
+                image (2D array) : image to be reduced to a grid. Pixels beyond the grid (if any) are ignored
                 mode (string)    : how to reduce values to a cell, it can be either 'mean' or 'max'
             Output:
                 grid (2D array)  : matrix where each position contains the mean or max value of the corresponding portion of the image of size cell_size
         """
+        if mode not in ['mean', 'max']:
+            raise ValueError('Invalid reduction mode, valid options are: mean, max')
+        image_size = (self.grid_size - 1) * self.cell_size + np.where(self.offset, self.offset, self.cell_size)
+        image = np.asarray(image)[:image_size[0], :image_size[1]]
+        if image.shape != tuple(image_size):
+            raise ValueError('The image is smaller than the grid')
+
+        if mode == 'max':
+            rows_starts    = np.arange(0, image_size[0], self.cell_size)
+            columns_starts = np.arange(0, image_size[1], self.cell_size)
+
+            return np.maximum.reduceat(np.maximum.reduceat(image, rows_starts, axis=0), columns_starts, axis=1).astype(float)
+
+        # Each cell's values are laid out contiguously, in the same order as in the image, so that np.mean sums them as it would for the cell alone
         grid = np.empty(shape=self.grid_size)
-        
-        for row in range(self.grid_size[0]):
-            for column in range(self.grid_size[1]):
-                start_row, start_column = np.array([row, column]) * self.cell_size 
-                end_row, end_column     = np.array([start_row, start_column]) + self.cell_size
-                
-                # Check for edge cases
-                if self.offset[0] and row == self.grid_size[0] - 1:
-                    end_row    = start_row + self.offset[0]
-                if self.offset[1] and column == self.grid_size[1] - 1:
-                    end_column = start_column + self.offset[1]
-
-                if mode == 'mean':
-                    grid[row, column] = np.mean(image[start_row:end_row, start_column:end_column])
-                elif mode == 'max':
-                    grid[row, column] = np.max(image[start_row:end_row, start_column:end_column])
-        
+        for cells_rows, pixels_rows, cell_height in self.bands(axis=0):
+            for cells_columns, pixels_columns, cell_width in self.bands(axis=1):
+                region = image[pixels_rows, pixels_columns]
+                blocks = region.reshape(region.shape[0] // cell_height, cell_height, region.shape[1] // cell_width, cell_width).swapaxes(1, 2)
+                grid[cells_rows, cells_columns] = np.mean(blocks.reshape(blocks.shape[:2] + (cell_height * cell_width,)), axis=-1)
+
         return grid
 
+    def bands(self, axis):
+        " Splits the grid along the given axis in a band of full cells, followed by a band with the last cell if it's cut off by the offset "
+        """ Output:
+                bands (list of (slice, slice, int)) : cells and pixels spanned by each band, alongside the size of its cells (in pixels)
+        """
+        full_cells = self.grid_size[axis] - (1 if self.offset[axis] else 0)
+        bands = [(slice(0, full_cells), slice(0, full_cells * self.cell_size), self.cell_size)]
+        if self.offset[axis]:
+            bands.append((slice(full_cells, full_cells + 1), slice(full_cells * self.cell_size, full_cells * self.cell_size + self.offset[axis]), self.offset[axis]))
+
+        return bands
+
     def map_to_cell(self, pixel):
         " Given a pixel in the image, this function returns the corresponding coordinate of the pixel in the grid "
         """ Input:
@@ -44,7 +61,11 @@ class Grid:
             Output:
                 cell (int, int)  : corresponding cell of the pixel in the image
         """
-        return np.array(pixel, dtype=int) // self.cell_size
+        return (int(pixel[0]) // self.cell_size, int(pixel[1]) // self.cell_size)
+
+    def map_to_cells(self, pixels):
+        " Same as map_to_cell, for an array of pixels of shape (..., 2) "
+        return np.asarray(pixels).astype(int) // self.cell_size
 
     def map_cell_to_pixels(self, cell):
         " Given a cell in the grid, this function returns the corresponding pixel in the image, centered in the cell "
@@ -53,17 +74,19 @@ class Grid:
             Output:
                 pixel (int, int) : corresponding pixel at the center of the cell in the image
         """
-        cell_center = np.array(cell) * self.cell_size
-        
+        return (self.cell_center(int(cell[0]), axis=0), self.cell_center(int(cell[1]), axis=1))
+
+    def map_cells_to_pixels(self, cells):
+        " Same as map_cell_to_pixels, for an array of cells of shape (..., 2) "
+        cells = np.asarray(cells, dtype=int)
+        cells_start = cells * self.cell_size
+
         # If the cell is outside of the image, use the offset
-        if self.offset[0] and cell[0] == self.grid_size[0] - 1:
-            cell_center[0] = cell_center[0] + self.offset[0] - 1
-        else:
-            cell_center[0] = cell_center[0] + self.cell_size // 2
+        return np.where(np.logical_and(self.offset > 0, cells == self.grid_size - 1), cells_start + self.offset - 1, cells_start + self.cell_size // 2)
 
-        if self.offset[1] and cell[1] == self.grid_size[1] - 1:
-            cell_center[1] = cell_center[1] + self.offset[1] - 1
-        else:
-            cell_center[1] = cell_center[1] + self.cell_size // 2
+    def cell_center(self, cell, axis):
+        " Pixel at the center of the given row (axis 0) or column (axis 1) of the grid "
+        if self.offset[axis] and cell == self.grid_size[axis] - 1:
+            return cell * self.cell_size + int(self.offset[axis]) - 1
 
-        return cell_center
\ No newline at end of file
+        return cell * self.cell_size + self.cell_size // 2
@@ -3,7 +3,7 @@ from scipy.stats import entropy
 from ..utils import utils
 
 class ELMModel:
-    def __init__(self, grid_size, visibility_map, save_probability_maps):
+    def __init__(self, grid_size, visibility_map, save_probability_maps, engine='contraction', debug=False, candidate_search=None):
         self.grid_size              = grid_size
         self.visibility_map         = visibility_map
         self.current_entropy_map    = np.empty(shape=grid_size)
@@ -11,15 +11,81 @@ class ELMModel:
         # self.norm_cdf_table = self.create_norm_cdf_table(norm_cdf_tolerance)
         # self.number_of_processes = number_of_processes
         self.save_probability_maps = save_probability_maps
+        # 'contraction' computes the whole map at once (see VisibilityMap.squared_sum_at_every_fixation); 'loop' is the reference implementation
+        if engine not in ['contraction', 'loop']:
+            raise ValueError('Invalid ELM engine, valid options are: contraction, loop')
+        self.engine = engine
+        # If True, the posterior, the visibility map and the resulting map are checked for negative values (stopping at a breakpoint if there are any)
+        self.debug  = debug
+        # If given (CandidateSearch), the next fixation is searched for coarse-to-fine instead of scoring every cell (see search_candidates)
+        self.candidate_search = candidate_search
     
     def expected_information_gain_map(self, expected_ig_map, posterior):
         """Computes the expected information gain for each cell in the grid"""
-        # H = entropy(posterior)
-        # necesito tener la fijacion actual
-        # para cada posible fijacion futura tengo que calcular la ganancia de informacion de esa fijacion
+        """ The posterior can also be a stack of posteriors (of shape (n, grid rows, grid columns)), in which case a map is computed for each of them """
+        if self.debug:
+            self.check_for_negative_values(posterior)
+
+        if self.engine == 'contraction':
+            expected_ig_map[...] = 1/2 * self.visibility_map.squared_sum_at_every_fixation(posterior)
+        else:
+            # H = entropy(posterior)
+            # necesito tener la fijacion actual
+            # para cada posible fijacion futura tengo que calcular la ganancia de informacion de esa fijacion
+            for w in range(self.grid_size[0]):
+                for h in range(self.grid_size[1]):
+                    # la ganancia esperada de realizar una fijacion a la posicion (w,h)
+                    posterior_weighted = posterior * (self.visibility_map.at_fixation((w,h))**2)
+                    expected_ig_map[..., w, h] = 1/2 * posterior_weighted.sum(axis=(-2, -1))
+
+        if self.debug and expected_ig_map.min() < 0:
+            breakpoint()
+
+    def expected_information_gain_at_candidates(self, expected_ig_map, posterior, candidates):
+        " Same as expected_information_gain_map, for a single posterior and only at the given candidate fixations (list of (int, int)) "
+        if not candidates:
+            return
+        if self.debug:
+            self.check_for_negative_values(posterior)
+
+        if self.engine == 'contraction':
+            expected_ig_map[tuple(np.transpose(candidates))] = 1/2 * self.visibility_map.squared_sum_at_fixations(posterior, candidates)
+        else:
+            for w, h in candidates:
+                posterior_weighted = posterior * (self.visibility_map.at_fixation((w,h))**2)
+                expected_ig_map[w, h] = 1/2 * posterior_weighted.sum()
+
+    def search_candidates(self, expected_ig_maps, posteriors):
+        " Computes the expected information gain at the coarse candidates of self.candidate_search for each posterior, and then at the cells around the best of them "
+        " The rest of the cells are NaN. If the search is verified, the exhaustive maps are computed as well, and they are the ones kept "
+        expected_ig_maps[...] = np.nan
+        for expected_ig_map, posterior in zip(expected_ig_maps, posteriors):
+            self.expected_information_gain_at_candidates(expected_ig_map, posterior, self.candidate_search.coarse_candidates)
+            self.expected_information_gain_at_candidates(expected_ig_map, posterior, self.candidate_search.refined_candidates(expected_ig_map))
+
+        if not self.candidate_search.verify:
+            for expected_ig_map in expected_ig_maps:
+                self.candidate_search.record(expected_ig_map)
+            return
+
+        refined_maps = expected_ig_maps.copy()
+        self.expected_information_gain_map(expected_ig_maps, posteriors)
+        for refined_map, expected_ig_map in zip(refined_maps, expected_ig_maps):
+            self.candidate_search.record(refined_map, self.best_fixation(refined_map), self.best_fixation(expected_ig_map))
+
+    def best_fixation(self, expected_ig_map):
+        " The first maximum in row-major order, as np.where would give (cells which weren't computed, if any, are NaN) "
+        return np.unravel_index(np.nanargmax(expected_ig_map), self.grid_size)
+
+    def close(self):
+        " Prints the telemetry of the candidate search, if any "
+        if self.candidate_search is not None:
+            self.candidate_search.print_telemetry()
+
+    def check_for_negative_values(self, posterior):
+        " Debugging checks, which were originally made for each cell "
         for w in range(self.grid_size[0]):
             for h in range(self.grid_size[1]):
-                # la ganancia esperada de realizar una fijacion a la posicion (w,h)
                 posterior_weighted  = posterior * (self.visibility_map.at_fixation((w,h))**2)
                 neg_flag_posteriorw = posterior_weighted < 0
                 neg_flag_visibility = self.visibility_map.at_fixation((w,h)) < 0
@@ -27,25 +93,40 @@ class ELMModel:
                     print("posterior_weighted flag: ", neg_flag_posteriorw.any())
                     print("visibility flag: ", neg_flag_visibility.any())
                     breakpoint()
-                expected_ig_map[w][h] = 1/2 * posterior_weighted.sum()
-        if expected_ig_map.min() < 0:
-            breakpoint()
     
     def next_fixation(self, posterior, image_name, fixation_number, output_path):
-        
-        expected_ig_map = np.empty(shape=self.grid_size)
-        # Compute the expected information gain map
-        self.expected_information_gain_map(expected_ig_map, posterior)
-        
+        next_fixations, _ = self.next_fixations([posterior], image_name, [fixation_number], output_path)
+
+        return next_fixations[0]
+
+    def next_fixations(self, posteriors, image_name, fixation_numbers, output_path):
+        " Same as next_fixation, for several posteriors at once (such as those of each replicate of a search, or those of a human scanpath) "
+        " The expected information gain maps of all of them are computed together "
+        """ Input:
+                fixation_numbers (list of int) : fixation number of each posterior, used to save it (None if it isn't to be saved)
+            Output:
+                next_fixations (list of (int, int))  : next fixation for each posterior
+                probability_maps (list of 2D arrays) : probability map saved for each posterior
+        """
+        stacked_posteriors = np.array(posteriors)
+        expected_ig_maps   = np.empty(shape=stacked_posteriors.shape)
+        # Compute the expected information gain maps
+        if self.candidate_search is None:
+            self.expected_information_gain_map(expected_ig_maps, stacked_posteriors)
+        else:
+            self.search_candidates(expected_ig_maps, stacked_posteriors)
+
         # Save the entropy map reduction
-        if self.save_probability_maps:
-            utils.save_probability_map(output_path, image_name, posterior, fixation_number, map_type='probability_maps')
-        
-        # Get the fixation which minimizes the expected entropy
-        coordinates = np.where(expected_ig_map == np.amax(expected_ig_map))
-        next_fix    = (coordinates[0][0], coordinates[1][0])
+        for posterior, fixation_number in zip(posteriors, fixation_numbers):
+            if self.save_probability_maps and fixation_number is not None:
+                utils.save_probability_map(output_path, image_name, posterior, fixation_number, map_type='probability_maps')
+
+        # Get the fixation which minimizes the expected entropy (the first one in row-major order, as np.where would give)
+        maximums = np.nanargmax(expected_ig_maps.reshape(len(expected_ig_maps), -1), axis=1)
+        rows, columns  = np.unravel_index(maximums, self.grid_size)
+        next_fixations = list(zip(rows, columns))
         #breakpoint
         # Update internal state for debug
-        self.last_fixation = next_fix
-        self.current_entropy_map = expected_ig_map
-        return next_fix
\ No newline at end of file
+        self.last_fixation = next_fixations[-1]
+        self.current_entropy_map = expected_ig_maps[-1]
+        return next_fixations, list(posteriors)
@@ -14,10 +14,27 @@ class GreedyModel:
             
             (The rest of the input arguments are used to save the probability map to a CSV file.)
         """
-        coordinates = np.where(posterior == np.amax(posterior))
-        next_fix    = (coordinates[0][0], coordinates[1][0])
+        next_fixations, _ = self.next_fixations([posterior], image_name, [fixation_number], output_path)
 
-        if self.save_probability_maps:
-            utils.save_probability_map(output_path, image_name, posterior, fixation_number)
+        return next_fixations[0]
 
-        return next_fix
\ No newline at end of file
+    def next_fixations(self, posteriors, image_name, fixation_numbers, output_path):
+        " Same as next_fixation, for several posteriors at once (such as those of each replicate of a search, or those of a human scanpath) "
+        """ Input:
+                posteriors (list of 2D arrays) : posterior probability for each cell in the grid
+                fixation_numbers (list of int) : fixation number of each posterior, used to save it (None if it isn't to be saved)
+            Output:
+                next_fixations (list of (int, int))  : next fixation for each posterior
+                probability_maps (list of 2D arrays) : probability map saved for each posterior
+        """
+        # The first maximum in row-major order, as np.where would give
+        stacked_posteriors = np.array(posteriors)
+        maximums = np.argmax(stacked_posteriors.reshape(len(stacked_posteriors), -1), axis=1)
+        rows, columns  = np.unravel_index(maximums, stacked_posteriors.shape[1:])
+        next_fixations = list(zip(rows, columns))
+
+        for posterior, fixation_number in zip(posteriors, fixation_numbers):
+            if self.save_probability_maps and fixation_number is not None:
+                utils.save_probability_map(output_path, image_name, posterior, fixation_number)
+
+        return next_fixations, list(posteriors)
@@ -0,0 +1,126 @@
+from .ssim import Ssim
+import numba
+import numpy as np
+from skimage import transform, img_as_ubyte
+from skimage.util.dtype import dtype_range
+
+""" Same target similarity map as Ssim: for each pixel in the image, a patch of the size of the target (centred on that pixel) is compared with the target image
+    via SSIM as computed by skimage (the mean of the SSIM of every 7x7 window in the patch, with the sample covariance), discarding the part of the target that
+    falls outside of the image. Results are the same, up to floating point rounding (~1e-10), but the map takes seconds instead of hours.
+    The means and variances of each window don't depend on where the target is placed, so they're computed only once, with summed-area tables, for the image
+    and the target. The covariance does: for each pixel, the product of the patch and the target is summed over every window with a summed-area table,
+    in a compiled loop (which takes time proportional to the number of pixels times the size of the target, and runs on every core).
+"""
+
+# Constants used by skimage's structural_similarity
+K1 = 0.01
+K2 = 0.03
+# Side of the windows over which skimage's structural_similarity computes SSIM
+WINDOW_SIZE = 7
+# As in Ssim, patches smaller than this (in either dimension) have a similarity of zero
+MIN_PATCH_SIZE = 7
+
+class Fast_ssim(Ssim):
+    version = 2
+
+    def compute_target_similarity(self, image, target, target_bbox):
+        target_size = target.shape[:2]
+        # Rescale target to its size in the image
+        target_size_in_image = (target_bbox[2] - target_bbox[0], target_bbox[3] - target_bbox[1])
+        if target_size != target_size_in_image:
+            target = img_as_ubyte(transform.resize(target, target_size_in_image))
+
+        image_size = image.shape[:2]
+        if len(image.shape) > 2:
+            # As in skimage, the SSIM of coloured images is the mean of the SSIM of each channel
+            ssim_values = np.mean([self.compute_ssim_map(image[:, :, channel], target[:, :, channel], image_size, target_size_in_image) for channel in range(image.shape[2])], axis=0)
+        else:
+            ssim_values = self.compute_ssim_map(image, target, image_size, target_size_in_image)
+
+        return ssim_values.astype(np.float32)
+
+    def compute_ssim_map(self, image, target, image_size, target_size):
+        " Computes the SSIM between the target and the patch of the image centred at each pixel, with the same border handling as handle_image_borders "
+        """ Input:
+                image  (2D array) : single channel of the search image
+                target (2D array) : single channel of the target image, rescaled to its size in the image
+            Output:
+                ssim_values (2D array) : matrix of the size of the image with the SSIM value of each patch
+        """
+        data_range = dtype_range[image.dtype.type][1] - dtype_range[image.dtype.type][0]
+        off_bounds_area = self.get_image_off_bounds_area(target_size)
+
+        # Bounds of the patch of each row and column, alongside the corresponding bounds in the target
+        rows_in_image, rows_in_target       = self.patches_bounds(image_size[0], target_size[0], off_bounds_area[0])
+        columns_in_image, columns_in_target = self.patches_bounds(image_size[1], target_size[1], off_bounds_area[1])
+
+        # Integer pixel values are summed exactly as floats
+        image  = image.astype(np.float64)
+        target = target.astype(np.float64)
+        ssim_values = np.zeros(shape=image_size)
+        if min(image_size) < WINDOW_SIZE or min(target_size) < WINDOW_SIZE:
+            return ssim_values
+
+        windowed_ssim(image, target, self.windows_sums(image), self.windows_sums(np.square(image)), self.windows_sums(target), self.windows_sums(np.square(target)), \
+            rows_in_image[0], rows_in_image[1], rows_in_target[0], columns_in_image[0], columns_in_image[1], columns_in_target[0], \
+            (K1 * data_range) ** 2, (K2 * data_range) ** 2, WINDOW_SIZE, MIN_PATCH_SIZE, ssim_values)
+
+        return ssim_values
+
+    def patches_bounds(self, image_length, target_length, off_bounds_length):
+        " For each row (or column) of the image, it returns where the patch starts and ends, both in the image and in the target "
+        starts = np.arange(image_length) - off_bounds_length
+        start_in_image = np.clip(starts, 0, image_length)
+        end_in_image   = np.clip(starts + target_length, 0, image_length)
+
+        return (start_in_image, end_in_image), (start_in_image - starts, end_in_image - starts)
+
+    def windows_sums(self, values):
+        " Sum of values over each WINDOW_SIZE x WINDOW_SIZE window, indexed by its upper left corner, computed with a summed-area table "
+        summed_area_table = np.zeros(shape=(values.shape[0] + 1, values.shape[1] + 1))
+        summed_area_table[1:, 1:] = np.cumsum(np.cumsum(values, axis=0), axis=1)
+
+        return summed_area_table[WINDOW_SIZE:, WINDOW_SIZE:] - summed_area_table[:-WINDOW_SIZE, WINDOW_SIZE:] \
+            - summed_area_table[WINDOW_SIZE:, :-WINDOW_SIZE] + summed_area_table[:-WINDOW_SIZE, :-WINDOW_SIZE]
+
+@numba.jit(nopython=True, parallel=True, cache=True)
+def windowed_ssim(image, target, image_sums, image_squares_sums, target_sums, target_squares_sums, rows_start, rows_end, target_rows_start, \
+    columns_start, columns_end, target_columns_start, c1, c2, window_size, min_patch_size, ssim_values):
+    " For each pixel, the mean over every window in its patch of the SSIM between the patch and the target (as in skimage's structural_similarity) "
+    " Window sums are indexed by the window's upper left corner. ssim_values is filled in place, with the rows of the image split among threads "
+    window_area = window_size * window_size
+    cov_norm    = window_area / (window_area - 1)
+    for row in numba.prange(image.shape[0]):
+        height = rows_end[row] - rows_start[row]
+        if height < min_patch_size:
+            continue
+        products_table = np.zeros((target.shape[0] + 1, target.shape[1] + 1))
+        for column in range(image.shape[1]):
+            width = columns_end[column] - columns_start[column]
+            if width < min_patch_size:
+                continue
+
+            # Summed-area table of the product of the patch and the target
+            for i in range(height):
+                row_sum = 0.0
+                for j in range(width):
+                    row_sum += image[rows_start[row] + i, columns_start[column] + j] * target[target_rows_start[row] + i, target_columns_start[column] + j]
+                    products_table[i + 1, j + 1] = products_table[i, j + 1] + row_sum
+
+            ssim_sum = 0.0
+            for i in range(height - window_size + 1):
+                for j in range(width - window_size + 1):
+                    image_row, image_column   = rows_start[row] + i, columns_start[column] + j
+                    target_row, target_column = target_rows_start[row] + i, target_columns_start[column] + j
+                    products_sum = products_table[i + window_size, j + window_size] - products_table[i, j + window_size] \
+                        - products_table[i + window_size, j] + products_table[i, j]
+
+                    image_mean  = image_sums[image_row, image_column] / window_area
+                    target_mean = target_sums[target_row, target_column] / window_area
+                    image_variance  = cov_norm * (image_squares_sums[image_row, image_column] / window_area - image_mean * image_mean)
+                    target_variance = cov_norm * (target_squares_sums[target_row, target_column] / window_area - target_mean * target_mean)
+                    covariance      = cov_norm * (products_sum / window_area - image_mean * target_mean)
+
+                    ssim_sum += ((2 * image_mean * target_mean + c1) * (2 * covariance + c2)) / \
+                        ((image_mean ** 2 + target_mean ** 2 + c1) * (image_variance + target_variance + c2))
+            ssim_values[row, column] = ssim_sum / ((height - window_size + 1) * (width - window_size + 1))
@@ -3,6 +3,9 @@ from .target_similarity import TargetSimilarity
 """ Target similarity is computed as in Geisler et. al. (2005). That is to say, no further calculations are made """
 
 class Geisler(TargetSimilarity):
+    # There is no map to store
+    cacheable = False
+
     def compute_target_similarity(self, image, target, target_bbox):
         return None
     
@@ -1,8 +1,8 @@
 import torch
-import torch.nn as nn
-from torchvision.models import vgg16, VGG16_Weights
+import torch.nn.functional as F
 import numpy as np
 from .target_similarity import TargetSimilarity
+from . import cnn_registry
 from torchvision import transforms
 from skimage import img_as_ubyte, exposure, transform
 from PIL import Image
@@ -13,60 +13,35 @@ from PIL import Image
 """ This code is an adaptation to PyTorch """
 
 class Ivsn(TargetSimilarity):
+    # Backbone (as named in cnn_registry) and sizes at which the target and the blocks of the image are fed to it
+    backbone    = 'vgg16'
+    target_size = (32, 32)
+    block_size  = (224, 224)
+
     def compute_target_similarity(self, image, target, target_bbox):
-        target_height, target_width = 32, 32
-        block_height, block_width   = 224, 224
+        block_height, block_width = self.block_size
         # These blocks will be the input of the CNN
-        image_blocks = self.divide_into_blocks(image, (block_height, block_width))
-
-        # Load the model
-        model = vgg16(weights=VGG16_Weights.IMAGENET1K_V1)
-
-        conv_size = 1
-        num_layers = 31
-        num_templates = 512  
-
-        model_target = nn.Sequential(*list(model.features.children())[:num_layers])
-        model_image  = nn.Sequential(*list(model.features.children())[:(num_layers - 1)])   
+        image_blocks = self.divide_into_blocks(image, self.block_size)
 
-        # Set models in evaluation mode
-        model_image.eval()
-        model_target.eval() 
+        # The model is loaded only once per process
+        cnn_registry.set_number_of_threads(self.number_of_processes)
+        model_image, model_target = cnn_registry.get_backbone(self.backbone)
 
-        MMConv = nn.Conv2d(num_templates, 1, conv_size, padding=1)
+        # Cast as 32-bit float since the model parameters are 32-bit floats
+        batch_target = self.preprocess(Image.fromarray(target).convert('RGB'), self.target_size).unsqueeze(0).float()
+        # Every block is fed to the CNN in a single mini-batch
+        batch_image  = torch.stack([self.preprocess(Image.fromarray(image_block['img_block']).convert('RGB'), self.block_size) for image_block in image_blocks]).float()
 
-        target = Image.fromarray(target).convert('RGB')
-        target_transformation = transforms.Compose([
-            transforms.Resize((target_height, target_width)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-        ])
-        target = target_transformation(target)
+        with torch.no_grad():
+            # Get the feature maps
+            output_stimuli = model_image(batch_image)
+            output_target  = model_target(batch_target)
+            # Output is the convolution of both representations
+            out = F.conv2d(output_stimuli, output_target, padding=1).squeeze(1).numpy()
 
         target_similarity_map = np.zeros(shape=image.shape[:2])
-        for image_block in image_blocks:
-            block_data = Image.fromarray(image_block['img_block']).convert('RGB')
-            image_transformation = transforms.Compose([
-                transforms.Resize((block_height, block_width)),
-                transforms.ToTensor(),
-                transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-            ])
-            block_data = image_transformation(block_data)
-
-            # View as mini-batch of size 1
-            # cast as 32-bit float since the model parameters are 32-bit floats
-            batch_image  = block_data.unsqueeze(0).float()
-            batch_target = target.unsqueeze(0).float()
-
-            with torch.no_grad():
-                # Get the feature maps
-                output_stimuli = model_image(batch_image) .squeeze()
-                output_target  = model_target(batch_target)
-                MMConv.weight = nn.parameter.Parameter(output_target, requires_grad=False)
-                # Output is the convolution of both representations
-                out = MMConv(output_stimuli.unsqueeze(0)).squeeze()
-
-            target_similarity_block = transform.resize(out.numpy(), image_block['img_block'].shape[:2])
+        for image_block, block_out in zip(image_blocks, out):
+            target_similarity_block = transform.resize(block_out, image_block['img_block'].shape[:2])
             from_row    = image_block['from_row']
             from_column = image_block['from_column']
             to_row    = from_row + block_height
@@ -76,6 +51,16 @@ class Ivsn(TargetSimilarity):
         target_similarity_map = exposure.rescale_intensity(target_similarity_map, out_range=(0, 1))
         return target_similarity_map
 
+    def preprocess(self, image, size):
+        " Resizes and normalizes an image (PIL), returning it as a tensor "
+        transformation = transforms.Compose([
+            transforms.Resize(size),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+        ])
+
+        return transformation(image)
+
     def divide_into_blocks(self, image, block_size):
         image_blocks = []
         img_height, img_width = image.shape[0], image.shape[1]
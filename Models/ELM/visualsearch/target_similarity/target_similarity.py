@@ -1,23 +1,30 @@
 import numpy as np
-from os import path
-from skimage import io
+from collections import OrderedDict
 from ..utils import utils
 
+# Number of fixations whose mu and sigma are kept in memory
+MU_SIGMA_CACHE_SIZE = 8
+
 class TargetSimilarity():
-    def __init__(self, image_name, image, target, target_bbox, visibility_map, scale_factor, additive_shift, grid, seed, number_of_processes, save_similarity_maps, target_similarity_dir):
-        # Set the seed for generating random noise
-        np.random.seed(seed)
+    # Target similarity maps are stored in the cache under a key which includes the version of the method that built them
+    # Subclasses must increase it whenever their results change
+    version   = 1
+    cacheable = True
 
+    def __init__(self, image_name, image, target, target_bbox, visibility_map, scale_factor, additive_shift, grid, random_generator, number_of_processes, save_similarity_maps, similarity_cache):
+        # Source of random noise, which belongs to this trial only (see utils.create_trial_random_generator)
+        self.random_generator      = random_generator
         self.number_of_processes   = number_of_processes
         self.save_similarity_maps  = save_similarity_maps
         self.grid                  = grid
         self.image_name            = image_name
-        self.target_similarity_dir = target_similarity_dir
+        self.similarity_cache      = similarity_cache
 
         self.create_target_similarity_map(image, target, target_bbox, visibility_map, scale_factor, additive_shift)
 
     def create_target_similarity_map(self, image, target, target_bbox, visibility_map, scale_factor, additive_shift):
         " Creates the target similarity map for a given image, target and visibility map.  "
+        " The values of the normal distribution at each fixation (mu and sigma) are computed on demand by mu_and_sigma_at_fixation "
         """ Input:
                 image  (2D array) : search image
                 target (2D array) : target image
@@ -25,39 +32,38 @@ class TargetSimilarity():
                 visibility_map (VisibilityMap) : visibility map which indicates how focus decays over distance from the fovea
                 scale_factor   (int) : modulates the inverse of the visibility and prevents the variance from diverging
                 additive_shift (int) : modulates the inverse of the visibility and prevents the variance from diverging
-            Output:
-                sigma, mu (4D arrays) : values of the normal distribution for each possible fixation in the grid. It's based on target similarity and visibility
         """
         grid_size = self.grid.size()
         target_bbox_in_grid = np.empty(len(target_bbox), dtype=np.int)
         target_bbox_in_grid[0], target_bbox_in_grid[1] = self.grid.map_to_cell((target_bbox[0], target_bbox[1]))
         target_bbox_in_grid[2], target_bbox_in_grid[3] = self.grid.map_to_cell((target_bbox[2], target_bbox[3]))
 
-        # Initialize mu, where each cell has a value of 0.5 if the target is present and -0.5 otherwise
-        self.mu = np.zeros(shape=(grid_size[0], grid_size[1], grid_size[0], grid_size[1])) - 0.5
-        for row in range(target_bbox_in_grid[0], target_bbox_in_grid[2] + 1):
-            for column in range(target_bbox_in_grid[1], target_bbox_in_grid[3] + 1):
-                self.mu[row, column] = np.zeros(shape=grid_size) + 0.5
-        
-        # Initialize sigma
-        self.sigma = np.ones(shape=self.mu.shape)
-        # Variance now depends on the visibility
-        self.sigma = self.sigma / (visibility_map.normalized_at_every_fixation() * scale_factor + additive_shift)
+        # Initialize the target mask, where each cell has a value of 0.5 if the target is present and -0.5 otherwise
+        self.target_mask = np.zeros(shape=grid_size) - 0.5
+        self.target_mask[target_bbox_in_grid[0]:target_bbox_in_grid[2] + 1, target_bbox_in_grid[1]:target_bbox_in_grid[3] + 1] = 0.5
+
+        # Variance depends on the visibility
+        self.visibility_map = visibility_map
+        self.scale_factor   = scale_factor
+        self.additive_shift = additive_shift
+        # Set by add_info_to_mu. If it remains None, mu is given by the target mask alone
+        self.target_similarity_map = None
+        self.mu_sigma_cache        = OrderedDict()
               
         # If precomputed, load target similarity map
-        save_path = path.join(self.target_similarity_dir, self.__class__.__name__)
-        filename  = self.image_name[:-4] + '.png'
-        file_path = path.join(save_path, filename)
-        if path.exists(file_path):
-            target_similarity_map = io.imread(file_path)
-        else:
+        target_similarity_map = None
+        if self.cacheable:
+            cache_key = self.similarity_cache.key(self.__class__.__name__, self.version, image, target, target_bbox)
+            target_similarity_map = self.similarity_cache.load(cache_key)
+        if target_similarity_map is None:
             if not utils.is_coloured(image) and utils.is_coloured(target):
                 target = utils.to_grayscale(target)
             # Calculate target similarity based on a specific method  
             print('Building target similarity map...')
             target_similarity_map = self.compute_target_similarity(image, target, target_bbox)
-            if self.save_similarity_maps:
-                utils.save_similarity_map(save_path, filename, target_similarity_map)
+            if self.cacheable and self.save_similarity_maps:
+                self.similarity_cache.store(cache_key, target_similarity_map, {'method': self.__class__.__name__, 'version': self.version, 'image': self.image_name, \
+                    'target_bbox': list(map(int, target_bbox)), 'image_size': list(image.shape[:2])})
         
         # Add target similarity and visibility info to mu
         self.add_info_to_mu(target_similarity_map, visibility_map)
@@ -69,33 +75,60 @@ class TargetSimilarity():
         pass
 
     def add_info_to_mu(self, target_similarity_map, visibility_map):
-        """ Once target similarity has been computed, its information is added to mu, alongside the visibility map """
+        """ Once target similarity has been computed, it is reduced to the grid, so that its information is added to mu (alongside the visibility map) at each fixation """
         # Reduce to grid
         target_similarity_map = self.grid.reduce(target_similarity_map, mode='max')
 
         # Convert values to the interval [-0.5, 0.5] 
         target_similarity_map = target_similarity_map - np.min(target_similarity_map)
-        target_similarity_map = target_similarity_map / np.max(target_similarity_map) - 0.5
-        # Make it the same shape as mu
-        grid_size = self.grid.size()
-        target_similarity_map = np.tile(target_similarity_map[:, :, np.newaxis, np.newaxis], (1, 1, grid_size[0], grid_size[1]))
-
-        # Modify mu in order to incorporate target similarity and visibility
-        self.mu = self.mu * (visibility_map.normalized_at_every_fixation() + 0.5) + target_similarity_map * (1 - visibility_map.normalized_at_every_fixation() + 0.5)
-        # Convert values to the interval [-1, 1]
-        self.mu = self.mu / 2
+        self.target_similarity_map = target_similarity_map / np.max(target_similarity_map) - 0.5
 
         return
+
+    def mu_and_sigma_at_fixation(self, fixation):
+        " Given a fixation in the grid, it returns the values of the normal distribution (mu and sigma) of each cell, based on target similarity and visibility "
+        " The values of the last MU_SIGMA_CACHE_SIZE fixations are kept in memory "
+        """ Input:
+                fixation (int, int) : cell in the grid on which the observer is fixating
+            Output:
+                mu, sigma (2D arrays) : values of the normal distribution at each cell of the grid
+        """
+        fixation = tuple(fixation)
+        if fixation in self.mu_sigma_cache:
+            self.mu_sigma_cache.move_to_end(fixation)
+            return self.mu_sigma_cache[fixation]
+
+        visibility_map_at_fixation = self.visibility_map.normalized_at_fixation(fixation)
+        sigma = 1 / (visibility_map_at_fixation * self.scale_factor + self.additive_shift)
+        mu    = self.target_mask
+        if self.target_similarity_map is not None:
+            # Modify mu in order to incorporate target similarity and visibility
+            mu = mu * (visibility_map_at_fixation + 0.5) + self.target_similarity_map * (1 - visibility_map_at_fixation + 0.5)
+            # Convert values to the interval [-1, 1]
+            mu = mu / 2
+
+        self.mu_sigma_cache[fixation] = (mu, sigma)
+        if len(self.mu_sigma_cache) > MU_SIGMA_CACHE_SIZE:
+            self.mu_sigma_cache.popitem(last=False)
+
+        return mu, sigma
     
-    def at_fixation(self, fixation):
+    def at_fixation(self, fixation, random_noise=None):
         " Given a fixation in the grid, it returns the target similarity map, represented as a 2D array of scalars with added random noise "
         """ Input:
-                fixation (int, int) : cell in the grid on which the observer is fixating
+                fixation (int, int)      : cell in the grid on which the observer is fixating
+                random_noise (2D array)  : standard normal noise to add; if None, it is drawn from the trial's random generator
             Output:
                 target_similarity_map (2D array of floats) : matrix the size of the grid, where each value is a scalar which represents how similar the position is to the target
         """
+        mu, sigma = self.mu_and_sigma_at_fixation(fixation)
+        if random_noise is None:
+            random_noise = self.random_noise(self.random_generator)
+
+        return sigma * random_noise + mu
+
+    def random_noise(self, random_generator):
+        " Draws a matrix of the size of the grid with standard normal noise "
         grid_size = self.grid.size()
         # For backwards compatibility with MATLAB, it's necessary to transpose the matrix
-        random_noise = np.transpose(np.random.standard_normal((grid_size[1], grid_size[0])))
-
-        return self.sigma[:, :, fixation[0], fixation[1]] * random_noise + self.mu[:, :, fixation[0], fixation[1]]
+        return np.transpose(random_generator.standard_normal((grid_size[1], grid_size[0])))
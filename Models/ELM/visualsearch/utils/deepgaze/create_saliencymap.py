@@ -1,6 +1,5 @@
 import argparse
 import numpy as np
-import matplotlib.pyplot as plt
 from scipy.ndimage import zoom
 from scipy.special import logsumexp
 from skimage import io, color, img_as_ubyte
@@ -10,50 +9,86 @@ environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 import sys
 import tensorflow.compat.v1 as tf
 
+""" DeepGaze II is loaded once per process: its graph is imported and its session is kept open, so each saliency map costs a single forward pass """
+
+CHECK_POINT  = 'DeepGazeII.ckpt'  # DeepGaze II
+loaded_model = None
+
+def get_model():
+    " Returns the DeepGaze II model of this process, loading it the first time it is requested "
+    global loaded_model
+    if loaded_model is None:
+        loaded_model = DeepGazeII()
+
+    return loaded_model
+
+class DeepGazeII:
+    def __init__(self):
+        # Ignore warnings
+        tf.logging.set_verbosity(tf.logging.ERROR)
+        # To make tf 2.0 compatible with tf1.0 code, we disable the tf2.0 functionalities
+        tf.disable_eager_execution()
+
+        script_path = path.dirname(__file__)
+        # Precomputed log density over a 1024x1024 image
+        self.centerbias_template = np.load(path.join(script_path, 'centerbias.npy'))
+        self.centerbiases = {}
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            saver = tf.train.import_meta_graph(path.join(script_path, '{}.meta'.format(CHECK_POINT)))
+            self.input_tensor      = tf.get_collection('input_tensor')[0]
+            self.centerbias_tensor = tf.get_collection('centerbias_tensor')[0]
+            self.log_density       = tf.get_collection('log_density')[0]
+        self.session = tf.Session(graph=self.graph)
+        saver.restore(self.session, path.join(script_path, CHECK_POINT))
+
+    def centerbias(self, image_size):
+        " Returns the center bias log density for images of the given size, rescaling the template only once per size "
+        if image_size not in self.centerbiases:
+            centerbias = zoom(self.centerbias_template, (image_size[0] / 1024, image_size[1] / 1024), order=0, mode='nearest')
+            # renormalize log density
+            centerbias -= logsumexp(centerbias)
+            self.centerbiases[image_size] = centerbias[:, :, np.newaxis] # HWC, 1 channel (log density)
+
+        return self.centerbiases[image_size]
+
+    def predict(self, images):
+        " Computes the saliency map of each image in a single forward pass. Images must all have the same size "
+        """ Input:
+                images (list of 2D or 3D arrays) : images of the same height and width, either grayscale or RGB
+            Output:
+                saliency_maps (3D array) : saliency map of each image, with values between 0 and 1
+        """
+        image_size = (images[0].shape[0], images[0].shape[1])
+        images_data = np.stack([color.gray2rgb(image) if len(image.shape) < 3 else image for image in images]) # BHWC, three channels (RGB)
+        centerbias_data = np.repeat(self.centerbias(image_size)[np.newaxis], len(images), axis=0)
+
+        log_density_prediction = self.session.run(self.log_density, {
+            self.input_tensor: images_data,
+            self.centerbias_tensor: centerbias_data,
+        })
+        density = np.exp(log_density_prediction[:, :, :, 0])
+
+        # Same scale as the grayscale maps that used to be saved (min-max normalization), but without quantization
+        minimums = density.min(axis=(1, 2), keepdims=True)
+        maximums = density.max(axis=(1, 2), keepdims=True)
+
+        return ((density - minimums) / (maximums - minimums)).astype(np.float32)
+
+    def close(self):
+        self.session.close()
+
 def create_saliencymap_for_image(image, save_path):
     print('Creating saliency map for search image...')
-    # Ignore warnings
-    tf.logging.set_verbosity(tf.logging.ERROR)
-    # To make tf 2.0 compatible with tf1.0 code, we disable the tf2.0 functionalities
-    tf.disable_eager_execution()
-
-    # load precomputed log density over a 1024x1024 image
-    script_path = path.dirname(__file__)
-    centerbias_template = np.load(path.join(script_path, 'centerbias.npy'))
-    # rescale to match image size
-    img_size   = (image.shape[0], image.shape[1])
-    centerbias = zoom(centerbias_template, (img_size[0]/1024, img_size[1]/1024), order=0, mode='nearest')
-    # renormalize log density
-    centerbias -= logsumexp(centerbias)
-
-    centerbias_data = centerbias[np.newaxis, :, :, np.newaxis]  # BHWC, 1 channel (log density)
-
-    tf.reset_default_graph()
-    check_point = 'DeepGazeII.ckpt'  # DeepGaze II
-    new_saver   = tf.train.import_meta_graph(path.join(script_path, '{}.meta'.format(check_point)))
-
-    input_tensor      = tf.get_collection('input_tensor')[0]
-    centerbias_tensor = tf.get_collection('centerbias_tensor')[0]
-    log_density       = tf.get_collection('log_density')[0]
-
-    if len(image.shape) < 3:
-        image = color.gray2rgb(image)
-    image_data = image[np.newaxis, :, :, :]  # BHWC, three channels (RGB)
-
-    with tf.Session() as sess:
-        new_saver.restore(sess, path.join(script_path, check_point))
-        
-        log_density_prediction = sess.run(log_density, {
-            input_tensor: image_data,
-            centerbias_tensor: centerbias_data,
-        })
+    saliency_map = get_model().predict([image])[0]
 
     if not path.exists(path.dirname(save_path)):
         makedirs(path.dirname(save_path))
-    plt.imsave(save_path, np.exp(log_density_prediction[0, :, :, 0]), cmap=plt.cm.gray)
-    # Remove channels and keep one
-    image = io.imread(save_path)
-    io.imsave(save_path, img_as_ubyte(color.rgb2gray(image)))
+    if save_path.endswith('.npy'):
+        np.save(save_path, saliency_map)
+    else:
+        io.imsave(save_path, img_as_ubyte(saliency_map))
 
 
 if __name__ == '__main__':
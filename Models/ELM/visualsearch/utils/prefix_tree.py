@@ -0,0 +1,44 @@
+""" Prefix tree of the fixations (in grid cells) made by human subjects on an image, used when the model follows their scanpaths.
+    Each node corresponds to the first fixations of one or more scanpaths, and keeps the state of the search and the posterior after them,
+    alongside the probability map computed from it and the fixation the model would have made next (which are filled in once they are computed).
+    Thus, subjects which share their first fixations on the image (as happens often once they are mapped to the grid) compute them only once.
+    The random noise added at each fixation is drawn in order from the trial's stream and kept, so that it depends only on the image and the fixation number:
+    results are the same as when each scanpath is searched on its own.
+"""
+
+class PrefixTree:
+    def __init__(self, random_generator, initial_state):
+        """ Input:
+                random_generator (RandomState or Generator) : source of random noise of the trial (see utils.create_trial_random_generator)
+                initial_state (tuple) : state of the search before the first fixation is processed
+        """
+        self.random_generator = random_generator
+        self.noise = []
+        self.root  = Node(initial_state)
+
+    def random_noise(self, fixation_number, target_similarity_map):
+        " Returns the random noise added to the target similarity map at the given fixation number, drawing it (and the previous ones) if necessary "
+        while len(self.noise) <= fixation_number:
+            self.noise.append(target_similarity_map.random_noise(self.random_generator))
+
+        return self.noise[fixation_number]
+
+class Node:
+    def __init__(self, state, posterior=None):
+        self.state           = state
+        self.posterior       = posterior
+        self.next_fixation   = None
+        self.probability_map = None
+        self.children        = {}
+
+    def child(self, fixation):
+        return self.children.get(tuple(fixation))
+
+    def is_computed(self):
+        return self.probability_map is not None
+
+    def add_child(self, fixation, state, posterior):
+        child = Node(state, posterior)
+        self.children[tuple(fixation)] = child
+
+        return child
@@ -1,8 +1,9 @@
 import json
+import zlib
 import numpy  as np
-import pandas as pd
-from os import makedirs, path, remove, listdir
+from os import path
 from skimage import io, transform, img_as_ubyte, color
+from Metrics.scripts import probability_maps, trials_journal
 
 def is_coloured(image):
     return len(image.shape) > 2
@@ -10,44 +11,41 @@ def is_coloured(image):
 def to_grayscale(image):
     return img_as_ubyte(color.rgb2gray(image))
 
+def create_trial_random_generator(seed, image_name, random_streams):
+    " Creates the source of random noise of a trial, which depends only on the seed and, optionally, on the image's name "
+    " Therefore, results don't depend on the order in which trials are run, nor on how many of them are run concurrently "
+    """ Input:
+            seed (int)              : random seed of the configuration
+            image_name (string)     : name of the search image of the trial
+            random_streams (string) : 'seed' gives every trial the same stream (as np.random.seed(seed) did),
+                                      'seed_and_image' derives an independent stream from the seed and the image's name
+        Output:
+            random_generator (RandomState or Generator) : random number generator of the trial
+    """
+    if random_streams == 'seed':
+        return np.random.RandomState(seed)
+    elif random_streams == 'seed_and_image':
+        return np.random.default_rng([seed, zlib.crc32(image_name.encode())])
+    else:
+        raise ValueError('Invalid random streams, valid options are: seed, seed_and_image')
+
 def load_data_from_checkpoint(output_path):
-    checkpoint_file = path.join(output_path, 'checkpoint.json')
-    scanpaths     = {}
-    targets_found = 0
-    time_elapsed  = 0
-    if path.exists(checkpoint_file):
-        checkpoint    = load_from_json(checkpoint_file)
-        scanpaths     = checkpoint['scanpaths']
-        targets_found = checkpoint['targets_found']
-        time_elapsed  = checkpoint['time_elapsed']
+    " Gathers the results of the trials in the journal of output_path (see Metrics/scripts/trials_journal.py), if execution is being resumed "
+    _, records    = trials_journal.load(output_path)
+    scanpaths     = {image_name: record['scanpath'] for image_name, record in records.items()}
+    replicates    = {image_name: record['replicates'] for image_name, record in records.items() if 'replicates' in record}
+    targets_found = sum(scanpath['target_found'] for scanpath in scanpaths.values())
+    time_elapsed  = max([record['time_elapsed'] for record in records.values()], default=0)
     
-    return scanpaths, targets_found, time_elapsed
-
-def save_checkpoint(config, scanpaths, targets_found, trials_properties, time_elapsed, output_path):
-    checkpoint = {}
-    checkpoint['configuration']     = config
-    checkpoint['targets_found']     = targets_found
-    checkpoint['time_elapsed']      = time_elapsed
-    checkpoint['scanpaths']         = scanpaths
-    checkpoint['trials_properties'] = remove_trials_already_processed(trials_properties, scanpaths)
-
-    save_to_json(path.join(output_path, 'checkpoint.json'), checkpoint)
-    print('\nCheckpoint saved at ' + output_path)
-    print('Run the script again to resume execution')
-
-def erase_checkpoint(output_path):
-    checkpoint_file = path.join(output_path, 'checkpoint.json')
-    if path.exists(checkpoint_file):
-        remove(checkpoint_file)
-
-def remove_trials_already_processed(trials_properties, scanpaths):
-    remaining_trials = []
-    for trial in trials_properties:
-        image_name = trial['image']
-        if not image_name in scanpaths:
-            remaining_trials.append(trial)
-    
-    return remaining_trials
+    return scanpaths, replicates, targets_found, time_elapsed
+
+def create_checkpoint_record(image_name, scanpaths, replicates, time_elapsed):
+    " Record of a finished trial in the journal, from which execution can be resumed "
+    record = {'scanpath': scanpaths[image_name], 'time_elapsed': time_elapsed}
+    if image_name in replicates:
+        record['replicates'] = replicates[image_name]
+
+    return record
 
 def save_scanpaths(output_path, scanpaths, filename='Scanpaths.json'):
     save_to_json(path.join(output_path, filename), scanpaths)
@@ -69,30 +67,26 @@ def load_image(img_path, name, image_size='default'):
     return img
 
 def save_probability_map(output_path, image_name, probability_map, fixation_number, map_type='probability_maps'):
-    """ Saves the probability map of a fixation in a csv file. 
+    """ Appends the probability map of a fixation to the image's store (see Metrics/scripts/probability_maps.py). 
         Input:
             map_type (str): can be 'probability_maps' or 'entropy_maps'
     """
     save_path = path.join(output_path, map_type, image_name[:-4])
-    if not path.exists(save_path):
-        makedirs(save_path)
+    probability_maps.save(probability_map, fixation_number + 1, save_path)
 
-    posterior_df = pd.DataFrame(probability_map)
-    posterior_df.to_csv(path.join(save_path, 'fixation_' + str(fixation_number + 1) + '.csv'), index=False)
+def log_pruning_error_bound(output_path, image_name, fixation_number, error_bound, number_of_target_locations):
+    """ Appends the error bound of the probability map of a fixation computed by pruned IBS (see BayesianModel.target_locations_to_integrate)
+        to the CSV file pruning_error_bounds.csv in output_path, alongside the number of target locations integrated
+    """
+    log_file = path.join(output_path, 'pruning_error_bounds.csv')
+    write_header = not path.exists(log_file)
+    with open(log_file, 'a') as log:
+        if write_header:
+            log.write('image,fixation,error_bound,target_locations\n')
+        log.write(image_name + ',' + str(fixation_number + 1) + ',' + repr(float(error_bound)) + ',' + str(number_of_target_locations) + '\n')
 
 def exists_probability_maps_for_image(image_name, output_path):
-    probability_maps_path = path.join(output_path, path.join('probability_maps', image_name[:-4]))
-    probability_maps = []
-    if path.exists(probability_maps_path):
-        probability_maps = listdir(probability_maps_path)
-
-    return bool(probability_maps)
-
-def save_similarity_map(output_path, filename, target_similarity_map):
-    if not path.exists(output_path):
-        makedirs(output_path)
-
-    io.imsave(path.join(output_path, filename), img_as_ubyte(target_similarity_map), check_contrast=False)
+    return probability_maps.exists(path.join(output_path, path.join('probability_maps', image_name[:-4])))
 
 def add_white_gaussian_noise(image, snr_db):
     """ Input:
@@ -121,6 +115,15 @@ def add_scanpath_to_dict(image_name, image_scanpath, target_bbox, target_object,
                  'X' : list(map(int, scanpath_x)), 'Y' : list(map(int, scanpath_y)), 'target_object' : target_object, 'max_fixations' : config['max_saccades'] + 1
         }
 
+def add_replicates_to_dict(image_name, image_scanpath, target_bbox, target_object, grid, config, dataset_name, dict_):
+    " Same as add_scanpath_to_dict, for the scanpath made by each replicate of the search (alongside the seed it corresponds to) "
+    replicates = {}
+    for replicate, replicate_scanpath in enumerate(image_scanpath['replicates']):
+        add_scanpath_to_dict(replicate, replicate_scanpath, target_bbox, target_object, grid, config, dataset_name, replicates)
+        replicates[replicate]['seed'] = config['seed'] + replicate
+
+    dict_[image_name] = list(replicates.values())
+
 def are_within_boundaries(top_left_coordinates, bottom_right_coordinates, top_left_coordinates_to_compare, bottom_right_coordinates_to_compare):
     return top_left_coordinates[0] >= top_left_coordinates_to_compare[0] and top_left_coordinates[1] >= top_left_coordinates_to_compare[1] \
          and bottom_right_coordinates[0] < bottom_right_coordinates_to_compare[0] and bottom_right_coordinates[1] < bottom_right_coordinates_to_compare[1]
@@ -1,14 +1,26 @@
 import numpy as np
 from scipy.stats import multivariate_normal
+from multiprocessing import shared_memory
 
 " The visibility map represents how focus decays over distance from the fovea "
 " This implementation uses the gaussian distribution, where the mean values correspond to the center of the fixation in pixels "
 " The covariance matrix was calculated before hand by estimating the vision angle of the fovea to the screen in the human experiments "
 
 class VisibilityMap:
-    def __init__(self, image_size, grid, sigma):
-        self.visibility_map = self.create(image_size, grid, sigma)
-        self.visibility_map_normalized = self.convert_to_unit_interval()
+    def __init__(self, image_size, grid, sigma, mode='dense'):
+        " In 'dense' mode, the visibility map of every fixation is precomputed and stored in a 4D array (grid size x grid size) "
+        " In 'compact' mode, only the two 1D gaussians the visibility map factors into are stored (one per axis), and the "
+        " visibility map at a given fixation is computed on demand, so that memory and construction time are linear in the grid size "
+        if mode == 'dense':
+            self.visibility_map = self.create(image_size, grid, sigma)
+            self.visibility_map_normalized = self.convert_to_unit_interval()
+        elif mode == 'compact':
+            self.rows_factor, self.columns_factor, self.rows_terms, self.columns_terms, self.log_constant, self.offset, self.maximum = \
+                self.create_factors(image_size, grid, sigma)
+            self.scale = 3 / self.maximum
+        else:
+            raise ValueError('Invalid visibility map mode, valid options are: dense, compact')
+        self.mode = mode
 
     def create(self, image_size, grid, sigma):
         " Creates a visibility map for a given image and cell size. The output's shape is grid size x grid size."
@@ -25,11 +37,13 @@ class VisibilityMap:
         y_range = np.linspace(0, image_size[1], grid.size()[1])
 
         x_matrix, y_matrix = np.meshgrid(x_range, y_range)
+        quantiles = np.transpose([y_matrix.flatten(), x_matrix.flatten()])
+        cells     = np.stack(np.meshgrid(np.arange(grid.size()[0]), np.arange(grid.size()[1]), indexing='ij'), axis=-1)
+        fixations = grid.map_cells_to_pixels(cells)
         for row in range(grid.size()[0]):
             for column in range(grid.size()[1]):
-                fixation = grid.map_cell_to_pixels((row, column))
+                fixation = fixations[row, column]
 
-                quantiles = np.transpose([y_matrix.flatten(), x_matrix.flatten()])
                 mvn_at_fixation = multivariate_normal.pdf(quantiles, mean=[fixation[1], fixation[0]], cov=sigma)
                 mvn_at_fixation = np.reshape(mvn_at_fixation, grid.size(), order='F')
 
@@ -41,6 +55,56 @@ class VisibilityMap:
 
         return visibility_map
     
+    def create_factors(self, image_size, grid, sigma):
+        " Builds the factors of the visibility map created by create, which is separable when sigma is diagonal: "
+        " visibility_map[a, b, c, d] = (rows_factor[a, c] * columns_factor[b, d] - offset) * scale "
+        " Since the products of the factors differ from create's values by rounding, which is amplified by IBS where the visibility is tiny, "
+        " the exponents of the multivariate normal along each axis are stored as well, so that at_fixation repeats the operations of create "
+        " (those of scipy's multivariate_normal.pdf, followed by the same rescaling) and returns the same values "
+        """ Input:
+                image_size (int, int) : height and width of the image, respectively, in pixels
+                grid  (Grid)          : representation of the image in cells
+                sigma (2D array)      : covariance matrix of the multivariate normal. It must be diagonal
+            Output:
+                rows_factor (2D array)    : matrix of size grid height x grid height, with the constant of the multivariate normal already applied
+                columns_factor (2D array) : matrix of size grid width x grid width
+                rows_terms (2D array)     : squared Mahalanobis distance along the rows, of size grid height x grid height
+                columns_terms (2D array)  : squared Mahalanobis distance along the columns, of size grid width x grid width
+                log_constant (float)      : logarithm of the normalization constant of the multivariate normal (times -2)
+                offset (float)            : minimum value of the visibility map before rescaling
+                maximum (float)           : maximum value of the visibility map after subtracting the offset (it's then rescaled to 3)
+        """
+        sigma = np.array(sigma, dtype=float)
+        if sigma[0, 1] or sigma[1, 0]:
+            raise ValueError('The compact visibility map requires a diagonal covariance matrix')
+
+        # Same points as in create, where the gaussian centered in cell (a, b) is evaluated at (x_range[c], y_range[d])
+        x_range = np.linspace(0, image_size[0], grid.size()[0])
+        y_range = np.linspace(0, image_size[1], grid.size()[1])
+        cells_centers_rows    = grid.map_cells_to_pixels(np.stack([np.arange(grid.size()[0]), np.zeros(grid.size()[0], dtype=int)], axis=-1))[:, 0]
+        cells_centers_columns = grid.map_cells_to_pixels(np.stack([np.zeros(grid.size()[1], dtype=int), np.arange(grid.size()[1])], axis=-1))[:, 1]
+
+        # The first coordinate of the multivariate normal corresponds to the columns of the image, and the second one to the rows
+        constant       = 1 / (2 * np.pi * np.sqrt(sigma[0, 0] * sigma[1, 1]))
+        rows_factor    = constant * np.exp(-0.5 * np.square(x_range[np.newaxis, :] - cells_centers_rows[:, np.newaxis]) / sigma[1, 1])
+        columns_factor = np.exp(-0.5 * np.square(y_range[np.newaxis, :] - cells_centers_columns[:, np.newaxis]) / sigma[0, 0])
+
+        # As in multivariate_normal.pdf, deviations are whitened by the covariance object. Since sigma is diagonal, each one only has a component
+        # along its own axis, and the Mahalanobis distance is the sum of both (which doesn't depend on the order)
+        covariance    = multivariate_normal(mean=np.zeros(2), cov=sigma).cov_object
+        log_constant  = covariance.rank * np.log(2 * np.pi) + covariance.log_pdet
+        rows_devs     = x_range[np.newaxis, :] - cells_centers_rows[:, np.newaxis]
+        columns_devs  = y_range[np.newaxis, :] - cells_centers_columns[:, np.newaxis]
+        rows_terms    = np.sum(np.square(covariance.whiten(np.stack([np.zeros_like(rows_devs), rows_devs], axis=-1))), axis=-1)
+        columns_terms = np.sum(np.square(covariance.whiten(np.stack([columns_devs, np.zeros_like(columns_devs)], axis=-1))), axis=-1)
+
+        # Rounding is monotonic, so the extreme values of the visibility map are reached at the extreme distances along each axis
+        extreme_values = np.exp(-0.5 * (log_constant + np.array([np.max(columns_terms) + np.max(rows_terms), np.min(columns_terms) + np.min(rows_terms)])))
+        offset  = extreme_values[0]
+        maximum = extreme_values[1] - offset
+
+        return rows_factor, columns_factor, rows_terms, columns_terms, log_constant, offset, maximum
+
     def convert_to_unit_interval(self):
         " Returns a matrix where values go from zero to one for each fixation, where one corresponds to the maximum value in visibility_map at the corresponding fixation "
         grid_size = (self.visibility_map.shape[0], self.visibility_map.shape[1])
@@ -59,8 +123,122 @@ class VisibilityMap:
             Output:
                 visibility_map (2D array of floats) : matrix the size of the grid, where each value is a scalar which represents how much the view diminishes
         """
+        if self.mode == 'compact':
+            mahalanobis_distances = self.columns_terms[np.newaxis, :, fixation[1]] + self.rows_terms[:, fixation[0], np.newaxis]
+            visibility_map = np.exp(-0.5 * (self.log_constant + mahalanobis_distances)) - self.offset
+
+            return visibility_map / self.maximum * 3
+
         return self.visibility_map[:, :, fixation[0], fixation[1]]
-    
+
+    def squared_sum_at_every_fixation(self, weights):
+        " Returns, for every fixation (c, d), the sum of weights times the squared visibility map at that fixation: sum(weights * at_fixation((c, d)) ** 2) "
+        " In compact mode, the squared visibility map is expanded as scale ** 2 * (rows_factor ** 2 * columns_factor ** 2 - 2 * offset * rows_factor * columns_factor + offset ** 2), "
+        " so that it takes two products of matrices per axis. In dense mode, it takes a single product with the (flattened) squared visibility map, which is built the first time "
+        """ Input:
+                weights (array) : matrix the size of the grid, or a stack of them (of shape (n, grid rows, grid columns))
+            Output:
+                squared_sum (array) : matrix the size of the grid (or a stack of them) where each value corresponds to a fixation
+        """
+        if self.mode == 'compact':
+            squared_sum  = np.matmul(np.matmul(np.square(self.rows_factor).T, weights), np.square(self.columns_factor))
+            squared_sum -= 2 * self.offset * np.matmul(np.matmul(self.rows_factor.T, weights), self.columns_factor)
+            squared_sum += np.square(self.offset) * np.sum(weights, axis=(-2, -1), keepdims=True)
+
+            return np.square(self.scale) * squared_sum
+
+        weights = np.asarray(weights)
+
+        return np.matmul(weights.reshape(weights.shape[:-2] + (-1,)), self.flattened_squared_visibility_map()).reshape(weights.shape)
+
+    def squared_sum_at_fixations(self, weights, fixations):
+        " Same as squared_sum_at_every_fixation, but only for the given fixations (list of (int, int)) and a single matrix of weights "
+        """ Output:
+                squared_sum (1D array) : sum(weights * at_fixation(fixation) ** 2) for each fixation
+        """
+        rows, columns = np.array(fixations, dtype=int).reshape(-1, 2).T
+        if self.mode == 'compact':
+            rows_factor, columns_factor = self.rows_factor[:, rows], self.columns_factor[:, columns]
+            squared_sum  = np.sum(np.square(rows_factor) * np.matmul(weights, np.square(columns_factor)), axis=0)
+            squared_sum -= 2 * self.offset * np.sum(rows_factor * np.matmul(weights, columns_factor), axis=0)
+            squared_sum += np.square(self.offset) * np.sum(weights)
+
+            return np.square(self.scale) * squared_sum
+
+        grid_size = self.visibility_map.shape[:2]
+
+        return np.matmul(np.ravel(weights), self.flattened_squared_visibility_map()[:, rows * grid_size[1] + columns])
+
+    def flattened_squared_visibility_map(self):
+        " In dense mode, the squared visibility map of every fixation (as a column), which is built the first time it is needed "
+        if getattr(self, 'squared_visibility_map', None) is None:
+            grid_size = self.visibility_map.shape[:2]
+            self.squared_visibility_map = np.square(self.visibility_map).reshape(grid_size[0] * grid_size[1], grid_size[0] * grid_size[1])
+
+        return self.squared_visibility_map
+
+    def normalized_at_fixation(self, fixation):
+        " Given a fixation in the grid, it returns the visibility map at that fixation, where each value goes from zero to one "
+        if self.mode == 'compact':
+            visibility_map_at_fixation = self.at_fixation(fixation)
+            return visibility_map_at_fixation / np.max(visibility_map_at_fixation)
+
+        return self.visibility_map_normalized[:, :, fixation[0], fixation[1]]
+
     def normalized_at_every_fixation(self):
         " It returns the visibility map for every fixation possible, represented as a 4D array, where each value goes from zero to one"
-        return self.visibility_map_normalized
\ No newline at end of file
+        " In compact mode, the 4D array is built on every call "
+        if self.mode == 'compact':
+            grid_size = (self.rows_factor.shape[0], self.columns_factor.shape[0])
+            visibility_map_normalized = np.empty(shape=grid_size + grid_size)
+            for row in range(grid_size[0]):
+                for column in range(grid_size[1]):
+                    visibility_map_normalized[:, :, row, column] = self.normalized_at_fixation((row, column))
+
+            return visibility_map_normalized
+
+        return self.visibility_map_normalized
+
+    def to_shared_memory(self):
+        " Copies the visibility map to a new shared memory block, so that other processes can attach to it with from_shared_memory "
+        " In compact mode there is nothing to share, since its factors are small enough to be sent to each process "
+        """ Output:
+                shared_mem (SharedMemory) : shared memory block (None in compact mode). The caller is responsible for closing and unlinking it
+                shared_visibility_map_info (dict) : name of the block, and shape and dtype of the visibility map stored in it
+        """
+        if self.mode == 'compact':
+            return None, {'mode': self.mode, 'rows_factor': self.rows_factor, 'columns_factor': self.columns_factor, 'rows_terms': self.rows_terms, \
+                'columns_terms': self.columns_terms, 'log_constant': self.log_constant, 'offset': self.offset, 'maximum': self.maximum}
+
+        shared_mem    = shared_memory.SharedMemory(create=True, size=self.visibility_map.nbytes)
+        shared_matrix = np.ndarray(self.visibility_map.shape, dtype=self.visibility_map.dtype, buffer=shared_mem.buf)
+        shared_matrix[:] = self.visibility_map[:]
+
+        return shared_mem, {'mode': self.mode, 'name': shared_mem.name, 'shape': self.visibility_map.shape, 'dtype': self.visibility_map.dtype.str}
+
+    @classmethod
+    def from_shared_memory(cls, shared_visibility_map_info):
+        " Creates a read-only visibility map backed by a shared memory block created with to_shared_memory "
+        " In dense mode, only at_fixation is available, since the normalized visibility map is not shared "
+        visibility_map = cls.__new__(cls)
+        visibility_map.mode = shared_visibility_map_info['mode']
+        if visibility_map.mode == 'compact':
+            visibility_map.rows_factor    = shared_visibility_map_info['rows_factor']
+            visibility_map.columns_factor = shared_visibility_map_info['columns_factor']
+            visibility_map.rows_terms     = shared_visibility_map_info['rows_terms']
+            visibility_map.columns_terms  = shared_visibility_map_info['columns_terms']
+            visibility_map.log_constant   = shared_visibility_map_info['log_constant']
+            visibility_map.offset  = shared_visibility_map_info['offset']
+            visibility_map.maximum = shared_visibility_map_info['maximum']
+            visibility_map.scale   = 3 / visibility_map.maximum
+
+            return visibility_map
+
+        # Keep a reference to the block, so that it isn't released while in use
+        visibility_map.shared_mem     = shared_memory.SharedMemory(name=shared_visibility_map_info['name'])
+        visibility_map.visibility_map = np.ndarray(shared_visibility_map_info['shape'], dtype=np.dtype(shared_visibility_map_info['dtype']), \
+            buffer=visibility_map.shared_mem.buf)
+        visibility_map.visibility_map.flags.writeable = False
+        visibility_map.visibility_map_normalized = None
+
+        return visibility_map
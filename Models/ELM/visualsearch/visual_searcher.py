@@ -1,8 +1,11 @@
 from .models.elm_model      import ELMModel
-from .models.bayesian_model import BayesianModel
+from .models.bayesian_model import BayesianModel, GAUSS_HERMITE_NODES, PRUNING_MASS
 from .models.greedy_model   import GreedyModel
+from .models.candidate_search import CandidateSearch
 from Metrics.scripts import human_scanpath_prediction
 from .utils import utils
+from .utils.similarity_cache import SimilarityCache
+from .utils.prefix_tree import PrefixTree
 from . import prior
 import numpy as np
 import time
@@ -13,9 +16,25 @@ class VisualSearcher:
         " Creates a new instance of the visual search model "
         """ Input:
                 Config (dict). One entry. Fields:
-                    search_model          (string) : bayesian, greedy
-                    target_similarity     (string) : correlation, geisler, ssim, ivsn
+                    search_model          (string) : ibs, greedy, elm
+                    ibs_engine            (string) : vectorized (default) or loop. Only used by the ibs search model
+                    ibs_integration       (string) : trapezoid (default) or gauss_hermite. Only used by the ibs search model
+                    gauss_hermite_nodes   (int)    : number of nodes of the Gauss-Hermite quadrature rule (12 by default)
+                    gauss_hermite_norm_cdf (string): ndtr (default) or table. Indicates how normcdf is evaluated by the Gauss-Hermite quadrature rule
+                    ibs_integration_check (bool)   : compares every probability map against the one computed with the trapezoidal rule (False by default)
+                    ibs_mode              (string) : exact (default) or pruned. In pruned mode, only the most likely target locations are integrated over
+                    ibs_pruning_mass      (float)  : share of the posterior mass covered by the target locations integrated over in pruned mode (0.999 by default)
+                    candidate_search      (string) : exhaustive (default) or coarse_to_fine. Indicates how the ibs and elm search models look for the next fixation
+                    candidate_search_stride (int)  : spacing (in cells) between the coarse candidates of the coarse_to_fine search (2 by default)
+                    candidate_search_top_k  (int)  : number of coarse candidates around which the coarse_to_fine search scores every cell (4 by default)
+                    candidate_search_verify (bool) : scores every cell as well, keeps the exhaustive choice and reports how often the refined one matches it (False by default)
+                    elm_engine            (string) : contraction (default) or loop. Only used by the elm search model
+                    elm_debug             (bool)   : checks for negative values when computing the expected information gain (False by default). Only used by the elm search model
+                    target_similarity     (string) : correlation, geisler, ssim, fast_ssim, ivsn, ivsn_effnet, ivsn_resnext. fast_ssim builds the same map as ssim, in a fraction of the time
                     prior                 (string) : deepgaze, mlnet, flat, center
+                    seed                  (int)    : seed of the random noise added to the target similarity map
+                    random_streams        (string) : seed (default) or seed_and_image. Indicates what the random noise of each trial is derived from
+                    replicates            (int)    : number of searches run on each image, each with its own random noise (1 by default). Ignored when following human scanpaths
                     max_saccades          (int)    : maximum number of saccades allowed
                     cell_size             (int)    : size (in pixels) of the cells in the grid
                     scale_factor          (int)    : modulates the variance of target similarity and prevents 1 / d' from diverging in bayesian search
@@ -23,7 +42,8 @@ class VisualSearcher:
                     save_probability_maps (bool)   : indicates whether to save the probability map to a file after each saccade or not
                     proc_number           (int)    : number of processes on which to execute bayesian search
                     save_similarity_maps  (bool)   : indicates whether to save the target similarity map for each image in bayesian search
-                target_similarity_dir (string)  : folder path where the target similarity maps are stored
+                    similarity_cache_max_mb (int)  : maximum size (in megabytes) of the target similarity maps cache (2048 by default)
+                target_similarity_dir (string)  : folder path where the target similarity maps are cached
                 human_scanpaths (dict)          : if not empty, it contains the human scanpaths which the model will use as fixations
                 grid            (Grid)          : representation of an image with cells instead of pixels
                 visibility_map  (VisibilityMap) : visibility map with the size of the grid
@@ -34,15 +54,21 @@ class VisualSearcher:
         self.scale_factor             = config['scale_factor']
         self.additive_shift           = config['additive_shift']
         self.seed                     = config['seed']
+        self.random_streams           = config.get('random_streams', 'seed')
+        self.replicates               = config.get('replicates', 1)
         self.save_probability_maps    = config['save_probability_maps']
         self.save_similarity_maps     = config['save_similarity_maps']
         self.number_of_processes      = config['proc_number']
         self.visibility_map           = visibility_map
-        self.search_model             = self.initialize_model(config['search_model'], config['norm_cdf_tolerance'])
-        self.target_similarity_dir    = target_similarity_dir
+        self.search_model             = self.initialize_model(config)
+        self.similarity_cache         = SimilarityCache(target_similarity_dir, config.get('similarity_cache_max_mb', 2048))
         self.target_similarity_method = config['target_similarity']
         self.output_path              = output_path
         self.human_scanpaths          = human_scanpaths
+        # Target similarity map of the last image searched, which is reused when the same image is searched again (such as with another subject's scanpath)
+        self.last_target_similarity   = None
+        # Prefix trees of the human fixations on the last image searched, indexed by prior (see utils/prefix_tree.py)
+        self.prefix_trees             = (None, {})
         self.init_max_saccades        = config['max_saccades']
 
     def search(self, image_name, image, image_prior, target, target_bbox, initial_fixation):
@@ -57,8 +83,9 @@ class VisualSearcher:
                 initial_fixation (int, int) : row and column of the first fixation on the search image
             Output:
                 image_scanpath   (dict)      : scanpath made by the model on the search image, alongside a 'target_found' field which indicates if the target was found
-                probability_maps (csv files) : if self.save_probability_maps is True, the probability map for each saccade is stored in a .csv file inside a folder in self.output_path 
-                similarity_maps  (png files) : if self.save_similarity_maps is True, the target similarity map for each image is stored inside a folder in self.output_path
+                probability_maps (binary files) : if self.save_probability_maps is True, the probability map for each saccade is stored in a folder in self.output_path (see Metrics/scripts/probability_maps.py) 
+                replicates (list of dict)    : if self.replicates is greater than one, image_scanpath also has the scanpath made by each replicate (see search_replicates)
+                similarity_maps  (npy files) : if self.save_similarity_maps is True, the target similarity map for each image is stored in the cache (see utils/similarity_cache.py)
         """
         # Convert prior to grid
         image_prior = self.grid.reduce(image_prior, mode='mean')
@@ -100,11 +127,18 @@ class VisualSearcher:
             return {}
 
         target_similarity_map = self.initialize_target_similarity_map(image, target, target_bbox, image_name)
+        if self.replicates > 1 and not self.human_scanpaths:
+            return self.search_replicates(image_name, image_prior, target_bbox_in_grid, fixations[0], target_similarity_map)
 
         # Initialize variables for computing each fixation        
         likelihood = np.zeros(shape=grid_size)
         posterior  = image_prior
         weighted_template_response = np.zeros(shape=grid_size)
+        if self.human_scanpaths:
+            # Fixations shared with previous scanpaths on the same image are not computed again
+            prefix_tree = self.initialize_prefix_tree(image_name, target_bbox, image_prior, initial_state=(weighted_template_response, image_prior))
+            node        = prefix_tree.root
+            replayed_nodes = []
         
         # Search
         print('Fixation:', end=' ')
@@ -129,13 +163,20 @@ class VisualSearcher:
 
             #likelihood = likelihood + target_similarity_map.at_fixation(current_fixation) * (np.square(self.visibility_map.at_fixation(current_fixation)))
             #likelihood_times_prior = posterior * np.exp(likelihood)
-            weighted_template_response = weighted_template_response + target_similarity_map.at_fixation(current_fixation) * (np.square(self.visibility_map.at_fixation(current_fixation)))
-            likelihood_times_prior = image_prior * np.exp(weighted_template_response)
-            marginal  = np.sum(likelihood_times_prior)
-            posterior = likelihood_times_prior / marginal
+            if self.human_scanpaths:
+                # Only the posterior is computed here, since the next fixation is already known
+                node = self.replay_fixation(prefix_tree, node, current_fixation, fixation_number, target_similarity_map)
+                replayed_nodes.append(node)
+                continue
+
+            weighted_template_response, posterior = self.update_posterior(weighted_template_response, image_prior, current_fixation, target_similarity_map)
 
             fixations[fixation_number + 1] = self.search_model.next_fixation(posterior, image_name, fixation_number, self.output_path)
             
+        if self.human_scanpaths:
+            self.evaluate_replayed_fixations(replayed_nodes, image_name)
+            for fixation_number, node in enumerate(replayed_nodes):
+                fixations[fixation_number + 1] = node.next_fixation
         end = time.time()
 
         if target_found:
@@ -156,27 +197,185 @@ class VisualSearcher:
 
         return { 'target_found' : target_found, 'scanpath_x' : scanpath_x_coordinates, 'scanpath_y' : scanpath_y_coordinates }
     
+    def search_replicates(self, image_name, image_prior, target_bbox_in_grid, initial_fixation, target_similarity_map):
+        " Runs self.replicates searches on the image at once, each with its own stream of random noise: replicate r uses the one the search would have if the seed were seed + r "
+        " Everything else (prior, target similarity map, visibility map) is shared, and the posteriors of the replicates are stacked, "
+        " so that the likelihood updates and the choice of the next fixations are vectorized "
+        """ Input:
+                image_prior (2D array)         : prior, already summed
+                target_bbox_in_grid (array)    : bounding box of the target in grid cells
+                initial_fixation (int, int)    : cell of the first fixation
+            Output:
+                image_scanpath (dict) : scanpath made by the first replicate (which is the same as the one made without replicates), 
+                                        alongside a 'replicates' field with the scanpath of each replicate (first one included)
+            (Probability maps, if saved, are those of the first replicate.)
+        """
+        grid_size = self.grid.size()
+        random_generators = [target_similarity_map.random_generator] + \
+            [utils.create_trial_random_generator(self.seed + replicate, image_name, self.random_streams) for replicate in range(1, self.replicates)]
+
+        fixations = np.empty(shape=(self.replicates, self.max_saccades + 1, 2), dtype=int)
+        fixations[:, 0] = initial_fixation
+        weighted_template_responses = np.zeros(shape=(self.replicates,) + grid_size)
+        posteriors = np.empty(shape=(self.replicates,) + grid_size)
+        scanpaths_length = np.full(self.replicates, self.max_saccades + 1)
+        targets_found    = np.zeros(self.replicates, dtype=bool)
+
+        # Replicates which are still searching
+        active = np.arange(self.replicates)
+        start  = time.time()
+        for fixation_number in range(self.max_saccades + 1):
+            current_fixations = fixations[active, fixation_number]
+            found = np.array([utils.are_within_boundaries(fixation, fixation, (target_bbox_in_grid[0], target_bbox_in_grid[1]), (target_bbox_in_grid[2] + 1, target_bbox_in_grid[3] + 1)) \
+                for fixation in current_fixations], dtype=bool)
+            targets_found[active[found]]    = True
+            scanpaths_length[active[found]] = fixation_number + 1
+            active = active[np.logical_not(found)]
+
+            # If the limit has been reached, don't compute the next fixation
+            if fixation_number == self.max_saccades or active.size == 0:
+                break
+
+            current_fixations = fixations[active, fixation_number]
+            random_noises     = [target_similarity_map.random_noise(random_generators[replicate]) for replicate in active]
+            weighted_template_responses[active], posteriors[active] = self.update_posteriors(weighted_template_responses[active], image_prior, current_fixations, target_similarity_map, random_noises)
+
+            next_fixations, _ = self.search_model.next_fixations(list(posteriors[active]), image_name, \
+                [fixation_number if replicate == 0 else None for replicate in active], self.output_path)
+            fixations[active, fixation_number + 1] = next_fixations
+
+        print('Targets found: ' + str(np.count_nonzero(targets_found)) + '/' + str(self.replicates) + ' replicates')
+        print('Time elapsed: ' + str(time.time() - start) + '\n')
+
+        replicates = []
+        for replicate in range(self.replicates):
+            replicate_fixations = fixations[replicate, :scanpaths_length[replicate]]
+            replicates.append({ 'target_found' : bool(targets_found[replicate]), 'scanpath_x' : self.get_coordinates(replicate_fixations, axis=1), \
+                'scanpath_y' : self.get_coordinates(replicate_fixations, axis=0) })
+
+        return dict(replicates[0], replicates=replicates)
+
+    def close(self):
+        " Releases the resources held by the search model (such as its pool of workers), if any "
+        if hasattr(self.search_model, 'close'):
+            self.search_model.close()
+
     def get_coordinates(self, fixations, axis):
         fixations_as_list = np.array(fixations).flatten()
 
         return [fixations_as_list[fix_number] for fix_number in range(axis, len(fixations_as_list), 2)]
 
-    def initialize_model(self, search_model, norm_cdf_tolerance):
+    def initialize_model(self, config):
+        search_model     = config['search_model']
+        candidate_search = self.initialize_candidate_search(config)
         if search_model == 'greedy':
             return GreedyModel(self.save_probability_maps)
         elif search_model == 'ibs':
-            return BayesianModel(self.grid.size(), self.visibility_map, norm_cdf_tolerance, self.number_of_processes, self.save_probability_maps)
+            return BayesianModel(self.grid.size(), self.visibility_map, config['norm_cdf_tolerance'], self.number_of_processes, self.save_probability_maps, \
+                engine=config.get('ibs_engine', 'vectorized'), integration=config.get('ibs_integration', 'trapezoid'), \
+                gauss_hermite_nodes=config.get('gauss_hermite_nodes', GAUSS_HERMITE_NODES), gauss_hermite_norm_cdf=config.get('gauss_hermite_norm_cdf', 'ndtr'), \
+                check_integration=config.get('ibs_integration_check', False), mode=config.get('ibs_mode', 'exact'), pruning_mass=config.get('ibs_pruning_mass', PRUNING_MASS), \
+                candidate_search=candidate_search)
         elif search_model == 'elm':
-            return ELMModel(self.grid.size(), self.visibility_map, self.save_probability_maps)
+            return ELMModel(self.grid.size(), self.visibility_map, self.save_probability_maps, \
+                engine=config.get('elm_engine', 'contraction'), debug=config.get('elm_debug', False), candidate_search=candidate_search)
         else:
             raise ValueError('Invalid search model, valid options are: greedy, ibs, elm')
 
+    def initialize_candidate_search(self, config):
+        candidate_search = config.get('candidate_search', 'exhaustive')
+        if candidate_search == 'exhaustive':
+            return None
+        elif candidate_search == 'coarse_to_fine':
+            return CandidateSearch(self.grid.size(), config.get('candidate_search_stride', 2), config.get('candidate_search_top_k', 4), \
+                config.get('candidate_search_verify', False))
+        else:
+            raise ValueError('Invalid candidate search, valid options are: exhaustive, coarse_to_fine')
+
+    def update_posterior(self, weighted_template_response, image_prior, fixation, target_similarity_map, random_noise=None):
+        " Adds the information gathered at the given fixation to the weighted template response, and computes the posterior from it "
+        """ Input:
+                random_noise (2D array) : noise added to the target similarity map; if None, it is drawn from the trial's random generator
+            Output:
+                weighted_template_response, posterior (2D arrays) : updated weighted template response and posterior, of the size of the grid
+        """
+        weighted_template_response = weighted_template_response + target_similarity_map.at_fixation(fixation, random_noise) * (np.square(self.visibility_map.at_fixation(fixation)))
+        likelihood_times_prior = image_prior * np.exp(weighted_template_response)
+        marginal  = np.sum(likelihood_times_prior)
+
+        return weighted_template_response, likelihood_times_prior / marginal
+
+    def update_posteriors(self, weighted_template_responses, image_prior, fixations, target_similarity_map, random_noises):
+        " Same as update_posterior, for stacked weighted template responses (of shape (n, grid rows, grid columns)), each one with its own fixation and random noise "
+        target_similarity_maps = np.array([target_similarity_map.at_fixation(fixation, random_noise) for fixation, random_noise in zip(fixations, random_noises)])
+        visibility_maps        = np.array([self.visibility_map.at_fixation(fixation) for fixation in fixations])
+
+        weighted_template_responses = weighted_template_responses + target_similarity_maps * (np.square(visibility_maps))
+        likelihood_times_prior = image_prior * np.exp(weighted_template_responses)
+        marginals = np.sum(likelihood_times_prior, axis=(1, 2), keepdims=True)
+
+        return weighted_template_responses, likelihood_times_prior / marginals
+
+    def replay_fixation(self, prefix_tree, node, fixation, fixation_number, target_similarity_map):
+        " Moves down the prefix tree to the given human fixation, whose posterior is computed only if no previous scanpath on the image has gone through the same fixations "
+        child = node.child(fixation)
+        if child is None:
+            weighted_template_response, image_prior = node.state
+            random_noise = prefix_tree.random_noise(fixation_number, target_similarity_map)
+            weighted_template_response, posterior = self.update_posterior(weighted_template_response, image_prior, fixation, target_similarity_map, random_noise)
+            child = node.add_child(fixation, (weighted_template_response, image_prior), posterior)
+
+        return child
+
+    def evaluate_replayed_fixations(self, nodes, image_name):
+        " Computes the probability maps (and next fixations) of the replayed fixations which hadn't been computed before, and saves the maps of the rest "
+        " Since every posterior is known beforehand, the search model computes all the new maps at once (concurrently, if it has a pool of workers) "
+        """ Input:
+                nodes (list of Node) : nodes of the prefix tree corresponding to each replayed fixation, in order
+        """
+        # Nodes shared with previous scanpaths always come first
+        first_pending = next((fixation_number for fixation_number, node in enumerate(nodes) if not node.is_computed()), len(nodes))
+        if self.save_probability_maps:
+            for fixation_number in range(first_pending):
+                utils.save_probability_map(self.output_path, image_name, nodes[fixation_number].probability_map, fixation_number)
+
+        pending_nodes = nodes[first_pending:]
+        if pending_nodes:
+            next_fixations, probability_maps = self.search_model.next_fixations([node.posterior for node in pending_nodes], image_name, \
+                range(first_pending, len(nodes)), self.output_path)
+            for node, next_fixation, probability_map in zip(pending_nodes, next_fixations, probability_maps):
+                node.next_fixation, node.probability_map = next_fixation, probability_map
+
+    def initialize_prefix_tree(self, image_name, target_bbox, image_prior, initial_state):
+        " Returns the prefix tree of the human fixations on the image, which is shared by the scanpaths of every subject on it "
+        trial_key = (image_name, tuple(target_bbox))
+        if self.prefix_trees[0] != trial_key:
+            # Only the trees of the image being searched are kept
+            self.prefix_trees = (trial_key, {})
+        # Subjects may start from a different prior (it depends on the maximum number of saccades)
+        prior_key = image_prior.tobytes()
+        prefix_trees = self.prefix_trees[1]
+        if prior_key not in prefix_trees:
+            random_generator = utils.create_trial_random_generator(self.seed, image_name, self.random_streams)
+            prefix_trees[prior_key] = PrefixTree(random_generator, initial_state)
+
+        return prefix_trees[prior_key]
+
     def initialize_target_similarity_map(self, image, target, target_bbox, image_name):
         # Load corresponding module, which has the same name in lower case
         module = importlib.import_module('.target_similarity.' + self.target_similarity_method.lower(), 'Models.ELM.visualsearch')
         # Get the class
         target_similarity_class = getattr(module, self.target_similarity_method.capitalize())
-        target_similarity_map   = target_similarity_class(image_name, image, target, target_bbox, self.visibility_map, self.scale_factor, self.additive_shift, self.grid, self.seed, \
-            self.number_of_processes, self.save_similarity_maps, self.target_similarity_dir)
+        random_generator        = utils.create_trial_random_generator(self.seed, image_name, self.random_streams)
+        trial_key = (image_name, tuple(target_bbox))
+        if self.last_target_similarity is not None and self.last_target_similarity[0] == trial_key:
+            # Only the random noise depends on the search itself, so it starts over
+            target_similarity_map = self.last_target_similarity[1]
+            target_similarity_map.random_generator = random_generator
+        else:
+            target_similarity_map = target_similarity_class(image_name, image, target, target_bbox, self.visibility_map, self.scale_factor, self.additive_shift, self.grid, random_generator, \
+                self.number_of_processes, self.save_similarity_maps, self.similarity_cache)
+            self.last_target_similarity = (trial_key, target_similarity_map)
+
         return target_similarity_map
 
@@ -1,7 +1,8 @@
 import numpy as np
 from . import constants
-from os import path, listdir
+from os import path
 from .irl_dcb import utils
+from Metrics.scripts import scanpaths_store
 from .irl_dcb.data import LHF_IRL
 from .irl_dcb.build_belief_maps import build_belief_maps
 
@@ -92,14 +93,13 @@ def load_human_scanpaths(human_scanpaths_dir, human_subject, grid_size):
     if human_subject is None:
         return {}
 
-    human_scanpaths_files = listdir(human_scanpaths_dir)
-    human_subject_str     = str(human_subject)
+    humans_scanpaths  = scanpaths_store.load(human_scanpaths_dir)
+    human_subject_str = str(human_subject)
     if human_subject < 10: human_subject_str = '0' + human_subject_str
-    human_subject_file    = 'subj' + human_subject_str + '_scanpaths.json'
-    if not human_subject_file in human_scanpaths_files:
+    if not human_subject in humans_scanpaths.subjects:
         raise NameError('Scanpaths for human subject ' + human_subject_str + ' not found!')
     
-    human_scanpaths = utils.load_dict_from_json(path.join(human_scanpaths_dir, human_subject_file))
+    human_scanpaths = humans_scanpaths.subject_scanpaths(human_subject)
 
     rescale_scanpaths(human_scanpaths, grid_size)
 
@@ -2,11 +2,10 @@ import numpy as np
 import torch
 import json
 import warnings
-import pandas as pd
 import os
 from math import floor
 from torch.distributions import Categorical
-from Metrics.scripts import human_scanpath_prediction
+from Metrics.scripts import human_scanpath_prediction, probability_maps
 warnings.filterwarnings("ignore", category=UserWarning)
 
 def get_max_scanpath_length(scanpaths_list):
@@ -82,11 +81,7 @@ def probability_maps_for_batch(img_names_batch, output_path):
     exist_prob_maps_for_batch = True
     for image_name in img_names_batch:
         probability_maps_path = os.path.join(output_path, 'probability_maps', image_name[:-4])
-        prob_maps_image = []
-        if os.path.exists(probability_maps_path):
-            prob_maps_image = os.listdir(probability_maps_path)
-
-        if not prob_maps_image:
+        if not probability_maps.exists(probability_maps_path):
             exist_prob_maps_for_batch = False
             break
     
@@ -107,8 +102,6 @@ def save_and_compute_metrics(probs, human_scanpaths_batch, img_names_batch, outp
             continue
 
         save_path = os.path.join(output_path, 'probability_maps', trial_img_name[:-4])
-        if not os.path.exists(save_path):
-            os.makedirs(save_path)
 
         if not presaved:
             trial_prob_maps = [prob_batch[index] for prob_batch in probs[:trial_length - 1]]
@@ -121,8 +114,7 @@ def save_and_compute_metrics(probs, human_scanpaths_batch, img_names_batch, outp
                 target_found_earlier = are_within_boundaries(current_fixation, current_fixation, 
                     (trial_target_bbox[0], trial_target_bbox[1]), (trial_target_bbox[2] + 1, trial_target_bbox[3] + 1))
 
-                prob_map_df = pd.DataFrame(prob_map)
-                prob_map_df.to_csv(os.path.join(save_path, 'fixation_' + str(fix_number + 1) + '.csv'), index=False)
+                probability_maps.save(prob_map, fix_number + 1, save_path)
         
         human_scanpath_prediction.save_scanpath_prediction_metrics(trial, trial_img_name, output_path)
 
@@ -317,6 +309,15 @@ def multi_hot_coding(bbox, patch_size, patch_num):
 
     return aoi_ratio[0]
 
+def action_to_checkpoint_record(action):
+    " Record of a trial's trajectory (as built by gen_scanpaths) in the journal, from which execution can be resumed (see Metrics/scripts/trials_journal.py) "
+    task_name, img_name, initial_fix, condition, actions = action
+    return {'action': [task_name, img_name, [float(initial_fix[0]), float(initial_fix[1])], condition, actions.tolist()]}
+
+def checkpoint_record_to_action(record):
+    task_name, img_name, initial_fix, condition, actions = record['action']
+    return (task_name, img_name, initial_fix, condition, torch.tensor(actions))
+
 def actions2scanpaths(actions, patch_num, patch_size, im_w, im_h, dataset_name, max_saccades):
     scanpaths = {}
     for traj in actions:
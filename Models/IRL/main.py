@@ -11,11 +11,14 @@ from torch.utils.data import DataLoader
 from .irl_dcb.models import LHF_Policy_Cond_Small
 from .irl_dcb.environment import IRL_Env4LHF
 from .irl_dcb import utils
+from Metrics.scripts import trials_journal
 
 torch.manual_seed(42619)
 np.random.seed(42619)
 
-def main(dataset_name, human_subject=None):
+def main(dataset_name, human_subject=None, resume='auto'):
+    " human_subject can be a list of subjects, in which case all of them are run in a single process "
+    " resume can be auto, never or ask, and indicates what to do if a previous execution was interrupted (see Metrics/scripts/trials_journal.py) "
     device  = torch.device('cpu')
     hparams = path.join(constants.HPARAMS_PATH, 'default.json')
     hparams = JsonConfig(hparams)
@@ -37,20 +40,27 @@ def main(dataset_name, human_subject=None):
 
     # For computing different metrics; used only through argument --h
     human_scanpaths_dir = path.join(dataset_path, dataset_info['scanpaths_dir'])
+    hparams.Data.max_traj_length = dataset_info['max_scanpath_length'] - 1
+    if isinstance(human_subject, list):
+        run_subjects(human_subject, human_scanpaths_dir, trials_properties, images_dir, new_image_size, grid_size, DCB_dir_HR, DCB_dir_LR, hparams, dataset_name, output_path, device)
+        return
+
     human_scanpaths     = load_human_scanpaths(human_scanpaths_dir, human_subject, grid_size)
     if human_scanpaths:
         human_subject_str = '0' + str(human_subject) if human_subject < 10 else str(human_subject)
         output_path = path.join(output_path, 'subjects_predictions', 'subject_' + human_subject_str)
-
-    hparams.Data.max_traj_length = dataset_info['max_scanpath_length'] - 1
+    _, checkpoint = trials_journal.resume(output_path, resume)
 
     # Process trials, creating belief maps when necessary, and get target's bounding box for each trial
     bbox_annos = process_trials(trials_properties, images_dir, human_scanpaths, new_image_size, grid_size, DCB_dir_HR, DCB_dir_LR)
 
+    # Trials already run by an interrupted execution are skipped
+    trials_to_run = trials_journal.remaining_trials(trials_properties, checkpoint)
+
     # Get categories and load image data
-    dataset = process_eval_data(trials_properties, human_scanpaths, DCB_dir_HR, DCB_dir_LR, bbox_annos, grid_size, hparams)
+    dataset = process_eval_data(trials_to_run, human_scanpaths, DCB_dir_HR, DCB_dir_LR, bbox_annos, grid_size, hparams)
     
-    batch_size = min(len(trials_properties), 64)
+    batch_size = max(min(len(trials_to_run), 64), 1)
     img_loader = DataLoader(dataset['img_test'],
                             batch_size=batch_size,
                             shuffle=False,
@@ -59,37 +69,31 @@ def main(dataset_name, human_subject=None):
     print('Number of images: ', len(dataset['img_test']))
 
     # Load trained model
-    task_eye  = torch.eye(len(dataset['catIds'])).to(device)
-    generator = LHF_Policy_Cond_Small(hparams.Data.patch_count,
-                                      len(dataset['catIds']), task_eye,
-                                      constants.NUMBER_OF_BELIEF_MAPS).to(device)
-    
-    utils.load('best', generator, 'generator', pkg_dir=constants.TRAINED_MODELS_PATH, device=device)
-    generator.eval()
+    generator = load_generator(dataset['catIds'], hparams, device)
 
     # Build environment
-    env_test = IRL_Env4LHF(hparams.Data,
-                           max_step=hparams.Data.max_traj_length,
-                           mask_size=hparams.Data.IOR_size,
-                           status_update_mtd=hparams.Train.stop_criteria,
-                           device=device,
-                           inhibit_return=True,
-                           init_mtd='manual')
+    env_test = build_environment(hparams, device)
 
     # Generate scanpaths
     print('Generating scanpaths...')
-    all_actions = gen_scanpaths(generator,
-                                env_test,
-                                img_loader,
-                                bbox_annos,
-                                hparams.Data.patch_num,
-                                hparams.Data.patch_size,
-                                hparams.Data.max_traj_length,
-                                hparams.Data.im_w,
-                                hparams.Data.im_h,
-                                human_scanpaths,
-                                num_sample=1,
-                                output_path=output_path)
+    journal = trials_journal.Journal(output_path)
+    try:
+        all_actions = gen_scanpaths(generator,
+                                    env_test,
+                                    img_loader,
+                                    bbox_annos,
+                                    hparams.Data.patch_num,
+                                    hparams.Data.patch_size,
+                                    hparams.Data.max_traj_length,
+                                    hparams.Data.im_w,
+                                    hparams.Data.im_h,
+                                    human_scanpaths,
+                                    num_sample=1,
+                                    output_path=output_path,
+                                    journal=journal)
+    finally:
+        journal.close()
+    all_actions = [utils.checkpoint_record_to_action(record) for record in checkpoint.values()] + all_actions
     
     scanpaths     = utils.actions2scanpaths(all_actions, hparams.Data.patch_num, hparams.Data.patch_size, hparams.Data.im_w, hparams.Data.im_h, dataset_name, hparams.Data.max_traj_length)
     targets_found = utils.cutFixOnTarget(scanpaths, bbox_annos, hparams.Data.patch_size)
@@ -100,8 +104,80 @@ def main(dataset_name, human_subject=None):
         utils.save_scanpaths(output_path, human_scanpaths, filename='Subject_scanpaths.json')
     else:    
         utils.save_scanpaths(output_path, scanpaths)
+    trials_journal.erase(output_path)
+
+def run_subjects(human_subjects, human_scanpaths_dir, trials_properties, images_dir, new_image_size, grid_size, DCB_dir_HR, DCB_dir_LR, hparams, dataset_name, output_path, device):
+    """ Runs the model following the scanpaths of each of the given human subjects.
+        Trials are processed (building their belief maps when necessary) only once, for every image on which any of the subjects has a scanpath,
+        and the trained model and the environment are loaded only once as well.
+    """
+    subjects_scanpaths = {}
+    for human_subject in human_subjects:
+        subjects_scanpaths[human_subject] = load_human_scanpaths(human_scanpaths_dir, human_subject, grid_size)
+    subjects_images = set(image_name for human_scanpaths in subjects_scanpaths.values() for image_name in human_scanpaths)
+
+    bbox_annos = process_trials(trials_properties, images_dir, subjects_images, new_image_size, grid_size, DCB_dir_HR, DCB_dir_LR)
+
+    generator, env_test = None, None
+    for human_subject in human_subjects:
+        human_scanpaths   = subjects_scanpaths[human_subject]
+        human_subject_str = '0' + str(human_subject) if human_subject < 10 else str(human_subject)
+        subject_path      = path.join(output_path, 'subjects_predictions', 'subject_' + human_subject_str)
+        subject_trials    = [trial for trial in trials_properties if trial['image'] in human_scanpaths]
+        if not subject_trials:
+            continue
+
+        dataset = process_eval_data(subject_trials, human_scanpaths, DCB_dir_HR, DCB_dir_LR, bbox_annos, grid_size, hparams)
+        img_loader = DataLoader(dataset['img_test'],
+                                batch_size=min(len(subject_trials), 64),
+                                shuffle=False,
+                                num_workers=cpu_count())
+        if generator is None:
+            generator = load_generator(dataset['catIds'], hparams, device)
+            env_test  = build_environment(hparams, device)
+
+        print('Subject ' + human_subject_str + '. Generating scanpaths...')
+        all_actions = gen_scanpaths(generator,
+                                    env_test,
+                                    img_loader,
+                                    bbox_annos,
+                                    hparams.Data.patch_num,
+                                    hparams.Data.patch_size,
+                                    hparams.Data.max_traj_length,
+                                    hparams.Data.im_w,
+                                    hparams.Data.im_h,
+                                    human_scanpaths,
+                                    num_sample=1,
+                                    output_path=subject_path)
+
+        scanpaths     = utils.actions2scanpaths(all_actions, hparams.Data.patch_num, hparams.Data.patch_size, hparams.Data.im_w, hparams.Data.im_h, dataset_name, hparams.Data.max_traj_length)
+        targets_found = utils.cutFixOnTarget(scanpaths, bbox_annos, hparams.Data.patch_size)
+
+        print('Total targets found: ' + str(targets_found) + '/' + str(len(scanpaths)))
+
+        utils.save_scanpaths(subject_path, human_scanpaths, filename='Subject_scanpaths.json')
+
+def load_generator(catIds, hparams, device):
+    task_eye  = torch.eye(len(catIds)).to(device)
+    generator = LHF_Policy_Cond_Small(hparams.Data.patch_count,
+                                      len(catIds), task_eye,
+                                      constants.NUMBER_OF_BELIEF_MAPS).to(device)
+    
+    utils.load('best', generator, 'generator', pkg_dir=constants.TRAINED_MODELS_PATH, device=device)
+    generator.eval()
+
+    return generator
+
+def build_environment(hparams, device):
+    return IRL_Env4LHF(hparams.Data,
+                       max_step=hparams.Data.max_traj_length,
+                       mask_size=hparams.Data.IOR_size,
+                       status_update_mtd=hparams.Train.stop_criteria,
+                       device=device,
+                       inhibit_return=True,
+                       init_mtd='manual')
 
-def gen_scanpaths(generator, env_test, test_img_loader, bbox_annos, patch_num, patch_size, max_traj_len, im_w, im_h, human_scanpaths, num_sample, output_path):
+def gen_scanpaths(generator, env_test, test_img_loader, bbox_annos, patch_num, patch_size, max_traj_len, im_w, im_h, human_scanpaths, num_sample, output_path, journal=None):
     all_actions = []
     for i_sample in range(num_sample):
         progress = tqdm(test_img_loader)
@@ -136,5 +212,8 @@ def gen_scanpaths(generator, env_test, test_img_loader, bbox_annos, patch_num, p
                 all_actions.extend([(cat_names_batch[i], img_names_batch[i], initial_fix_batch[i],
                                      'present', trajs['actions'][:, i])
                                     for i in range(env_test.batch_size)])
+                if journal is not None:
+                    for action in all_actions[-env_test.batch_size:]:
+                        journal.append(action[1], utils.action_to_checkpoint_record(action))
     
     return all_actions
\ No newline at end of file
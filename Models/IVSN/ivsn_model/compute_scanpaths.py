@@ -2,39 +2,71 @@ import numpy as np
 from . import utils
 from os import listdir, path
 from skimage import io, transform, exposure
-from Metrics.scripts import human_scanpath_prediction
+from Metrics.scripts import human_scanpath_prediction, trials_journal
 
 """
 Puts together data produced by the CNN and creates an attention map for the image, which is used to compute the scanpaths, with a winner-takes-all strategy.
 Scanpaths are saved in a JSON file.
 """
 
-def parse_model_data(preprocessed_images_dir, trials_properties, human_scanpaths, image_size, max_fixations, receptive_size, dataset_name, output_path):
-    scanpaths = {}
-    targets_found = 0
-    for trial in trials_properties:
-        image_name = trial['image']
-        img_id     = image_name[:-4]
-
-        # If following human subject's scanpaths, load them
-        human_trial_scanpath = utils.get_human_scanpath_for_trial(human_scanpaths, image_name)
-
-        attention_map  = load_model_data(preprocessed_images_dir, img_id, image_size)
-        trial_scanpath = create_scanpath_for_trial(trial, attention_map, human_trial_scanpath, image_size, max_fixations, receptive_size, dataset_name, output_path)
-
-        if human_trial_scanpath:
-            human_scanpath_prediction.save_scanpath_prediction_metrics(human_trial_scanpath, trial['image'], output_path)
-
-        scanpaths[image_name] = trial_scanpath
-        if trial_scanpath['target_found']:
-            targets_found += 1
+def parse_model_data(preprocessed_images_dir, trials_properties, human_scanpaths, image_size, max_fixations, receptive_size, dataset_name, output_path, checkpoint={}):
+    " checkpoint holds the records of the trials run by an interrupted execution, which are added to the results (see Metrics/scripts/trials_journal.py) "
+    scanpaths = {image_name: record['scanpath'] for image_name, record in checkpoint.items()}
+    targets_found = sum(scanpath['target_found'] for scanpath in scanpaths.values())
+    journal = trials_journal.Journal(output_path)
+    try:
+        for trial in trials_properties:
+            image_name = trial['image']
+            img_id     = image_name[:-4]
+
+            # If following human subject's scanpaths, load them
+            human_trial_scanpath = utils.get_human_scanpath_for_trial(human_scanpaths, image_name)
+
+            attention_map  = load_model_data(preprocessed_images_dir, img_id, image_size)
+            trial_scanpath = create_scanpath_for_trial(trial, attention_map, human_trial_scanpath, image_size, max_fixations, receptive_size, dataset_name, output_path)
+
+            if human_trial_scanpath:
+                human_scanpath_prediction.save_scanpath_prediction_metrics(human_trial_scanpath, trial['image'], output_path)
+
+            scanpaths[image_name] = trial_scanpath
+            if trial_scanpath['target_found']:
+                targets_found += 1
+            journal.append(image_name, {'scanpath': trial_scanpath})
+    finally:
+        journal.close()
     
-    print('Total targets found: ' + str(targets_found) + '/' + str(len(trials_properties)))
+    print('Total targets found: ' + str(targets_found) + '/' + str(len(scanpaths)))
 
     if human_scanpaths:
         utils.save_scanpaths(output_path, human_scanpaths, filename='Subject_scanpaths.json')
     else:
         utils.save_scanpaths(output_path, scanpaths)
+    trials_journal.erase(output_path)
+
+def parse_model_data_for_subjects(preprocessed_images_dir, trials_properties, subjects_scanpaths, image_size, max_fixations, receptive_size, dataset_name, output_paths):
+    """ Same as parse_model_data, following the scanpaths of several human subjects (indexed by subject number, as their output paths).
+        The attention map of each image is built only once and shared by every subject with a scanpath on it.
+    """
+    targets_found = {subject: 0 for subject in subjects_scanpaths}
+    for trial in trials_properties:
+        image_name     = trial['image']
+        trial_subjects = [subject for subject in subjects_scanpaths if image_name in subjects_scanpaths[subject]]
+        if not trial_subjects:
+            continue
+
+        attention_map = load_model_data(preprocessed_images_dir, image_name[:-4], image_size)
+        for subject in trial_subjects:
+            human_trial_scanpath = subjects_scanpaths[subject][image_name]
+            # Inhibition of return modifies the attention map, so each subject gets its own copy
+            trial_scanpath = create_scanpath_for_trial(trial, np.copy(attention_map), human_trial_scanpath, image_size, max_fixations, receptive_size, dataset_name, output_paths[subject])
+            human_scanpath_prediction.save_scanpath_prediction_metrics(human_trial_scanpath, image_name, output_paths[subject])
+
+            if trial_scanpath['target_found']:
+                targets_found[subject] += 1
+
+    for subject in subjects_scanpaths:
+        print('Subject ' + str(subject) + '. Total targets found: ' + str(targets_found[subject]) + '/' + str(len(subjects_scanpaths[subject])))
+        utils.save_scanpaths(output_paths[subject], subjects_scanpaths[subject], filename='Subject_scanpaths.json')
 
 def create_scanpath_for_trial(trial, attention_map, human_trial_scanpath, image_size, max_fixations, receptive_size, dataset_name, output_path):
     # Load target's boundaries
@@ -1,7 +1,7 @@
 import json
-import pandas as pd
-from os import path, makedirs, listdir
+from os import path, makedirs
 from math import floor
+from Metrics.scripts import probability_maps, scanpaths_store
 
 def rescale_coordinate(value, old_size, new_size):
     return floor((value / old_size) * new_size)
@@ -25,24 +25,19 @@ def keep_human_trials(human_scanpaths, trials_properties):
 
 def save_probability_map(fixation_number, image_name, probability_map, output_path):
     save_path = path.join(output_path, 'probability_maps', image_name[:-4])
-    if not path.exists(save_path):
-        makedirs(save_path)
-
-    probability_map_df = pd.DataFrame(probability_map)
-    probability_map_df.to_csv(path.join(save_path, 'fixation_' + str(fixation_number + 1) + '.csv'), index=False)
+    probability_maps.save(probability_map, fixation_number + 1, save_path)
 
 def load_human_scanpaths(human_scanpaths_dir, human_subject):
     if human_subject is None:
         return {}
 
-    human_scanpaths_files = listdir(human_scanpaths_dir)
-    human_subject_str     = str(human_subject)
+    humans_scanpaths  = scanpaths_store.load(human_scanpaths_dir)
+    human_subject_str = str(human_subject)
     if human_subject < 10: human_subject_str = '0' + human_subject_str
-    human_subject_file    = 'subj' + human_subject_str + '_scanpaths.json'
-    if not human_subject_file in human_scanpaths_files:
+    if not human_subject in humans_scanpaths.subjects:
         raise NameError('Scanpaths for human subject ' + human_subject_str + ' not found!')
     
-    human_scanpaths = load_dict_from_json(path.join(human_scanpaths_dir, human_subject_file))
+    human_scanpaths = humans_scanpaths.subject_scanpaths(human_subject)
 
     # Convert to int
     for trial in human_scanpaths:
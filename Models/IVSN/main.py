@@ -1,12 +1,15 @@
 from . import constants
 from .ivsn_model import image_preprocessing, IVSN, compute_scanpaths, utils
 from os import path
+from Metrics.scripts import trials_journal
 
 """ Runs the IVSN model on a given dataset.
     Running order is image_preprocessing.py first, IVSN.py next, and compute_scanpaths.py last.
 """
 
-def main(dataset_name, human_subject=None):
+def main(dataset_name, human_subject=None, resume='auto'):
+    " human_subject can be a list of subjects, in which case all of them are run in a single process "
+    " resume can be auto, never or ask, and indicates what to do if a previous execution was interrupted (see Metrics/scripts/trials_journal.py) "
     dataset_path = path.join(constants.DATASETS_PATH, dataset_name)
     output_path  = path.join(constants.RESULTS_PATH, dataset_name + '_dataset', 'IVSN')
 
@@ -23,6 +26,10 @@ def main(dataset_name, human_subject=None):
 
     # For computing different metrics; used only through argument --h
     human_scanpaths_dir = path.join(dataset_path, dataset_info['scanpaths_dir'])
+    if isinstance(human_subject, list):
+        run_subjects(human_subject, human_scanpaths_dir, trials_properties, images_dir, targets_dir, max_fixations, images_size, receptive_size, dataset_full_name, output_path)
+        return
+
     human_scanpaths     = utils.load_human_scanpaths(human_scanpaths_dir, human_subject)
     if human_scanpaths:
         human_subject_str = '0' + str(human_subject) if human_subject < 10 else str(human_subject)
@@ -31,6 +38,33 @@ def main(dataset_name, human_subject=None):
         output_path       = path.join(output_path, 'subjects_predictions', 'subject_' + human_subject_str)
         trials_properties = utils.keep_human_trials(human_scanpaths, trials_properties)
 
+    # Trials already run by an interrupted execution are skipped
+    _, checkpoint     = trials_journal.resume(output_path, resume)
+    trials_properties = trials_journal.remaining_trials(trials_properties, checkpoint)
+
+    preprocessed_images_dir = path.join(constants.PREPROCESSED_IMAGES_PATH, dataset_full_name)
+
+    print('Preprocessing images...')
+    image_preprocessing.chop_images(images_dir, preprocessed_images_dir, images_size, trials_properties)
+    print('Running model...')
+    IVSN.run(trials_properties, targets_dir, preprocessed_images_dir)
+    print('Computing scanpaths...')
+    compute_scanpaths.parse_model_data(preprocessed_images_dir, trials_properties, human_scanpaths, images_size, max_fixations, receptive_size, dataset_full_name, output_path, checkpoint)
+
+def run_subjects(human_subjects, human_scanpaths_dir, trials_properties, images_dir, targets_dir, max_fixations, images_size, receptive_size, dataset_full_name, output_path):
+    """ Runs the model following the scanpaths of each of the given human subjects.
+        Images are preprocessed and their attention maps are computed only once, for every image on which any of the subjects has a scanpath.
+    """
+    subjects_scanpaths = {}
+    output_paths       = {}
+    for human_subject in human_subjects:
+        human_subject_str = '0' + str(human_subject) if human_subject < 10 else str(human_subject)
+
+        subjects_scanpaths[human_subject] = utils.load_human_scanpaths(human_scanpaths_dir, human_subject)
+        output_paths[human_subject]       = path.join(output_path, 'subjects_predictions', 'subject_' + human_subject_str)
+    subjects_images   = set(image_name for human_scanpaths in subjects_scanpaths.values() for image_name in human_scanpaths)
+    trials_properties = utils.keep_human_trials(subjects_images, trials_properties)
+
     preprocessed_images_dir = path.join(constants.PREPROCESSED_IMAGES_PATH, dataset_full_name)
 
     print('Preprocessing images...')
@@ -38,4 +72,4 @@ def main(dataset_name, human_subject=None):
     print('Running model...')
     IVSN.run(trials_properties, targets_dir, preprocessed_images_dir)
     print('Computing scanpaths...')
-    compute_scanpaths.parse_model_data(preprocessed_images_dir, trials_properties, human_scanpaths, images_size, max_fixations, receptive_size, dataset_full_name, output_path)
\ No newline at end of file
+    compute_scanpaths.parse_model_data_for_subjects(preprocessed_images_dir, trials_properties, subjects_scanpaths, images_size, max_fixations, receptive_size, dataset_full_name, output_paths)
\ No newline at end of file
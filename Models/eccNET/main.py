@@ -1,10 +1,13 @@
 from . import constants
 from .visualsearch import run_exp, utils
 from pathlib import Path
+from Metrics.scripts import trials_journal
 
 """ Runs the eccNET model on a given dataset """
 
-def main(dataset_name, human_subject=None):
+def main(dataset_name, human_subject=None, resume='auto'):
+    " human_subject can be a list of subjects, in which case all of them are run in a single process "
+    " resume can be auto, never or ask, and indicates what to do if a previous execution was interrupted (see Metrics/scripts/trials_journal.py) "
     dataset_path = Path(constants.DATASETS_PATH) / dataset_name
     output_path  = Path(constants.RESULTS_PATH) / (dataset_name + '_dataset') / 'eccNET'
 
@@ -27,10 +30,23 @@ def main(dataset_name, human_subject=None):
 
     # For computing hsp (human scanpath prediction) metrics
     human_scanpaths_dir = dataset_path / dataset_info['scanpaths_dir']
+    if isinstance(human_subject, list):
+        subjects_scanpaths = {subject: utils.load_human_scanpaths(subject, img_size, model_img_size, human_scanpaths_dir) for subject in human_subject}
+        output_paths       = {subject: output_path / 'subjects_predictions' / ('subject_' + str(subject).zfill(2)) for subject in human_subject}
+        subjects_images    = set(image_name for human_scanpaths in subjects_scanpaths.values() for image_name in human_scanpaths)
+        trials_properties  = utils.keep_human_trials(subjects_images, trials_properties)
+
+        run_exp.start_subjects(trials_properties, exp_info, images_dir, targets_dir, subjects_scanpaths, constants.CFG_FILE, constants.VGG16_WEIGHTS, output_paths)
+        return
+
     human_scanpaths     = utils.load_human_scanpaths(human_subject, img_size, model_img_size, human_scanpaths_dir)
     if human_scanpaths:
         human_subject_str = str(human_subject).zfill(2)
         output_path       = output_path / 'subjects_predictions' / ('subject_' + human_subject_str)
         trials_properties = utils.keep_human_trials(human_scanpaths, trials_properties)
 
-    run_exp.start(trials_properties, exp_info, images_dir, targets_dir, human_scanpaths, constants.CFG_FILE, constants.VGG16_WEIGHTS, dataset_fullname, output_path)
\ No newline at end of file
+    # Trials already run by an interrupted execution are skipped
+    _, checkpoint     = trials_journal.resume(output_path, resume)
+    trials_properties = trials_journal.remaining_trials(trials_properties, checkpoint)
+
+    run_exp.start(trials_properties, exp_info, images_dir, targets_dir, human_scanpaths, constants.CFG_FILE, constants.VGG16_WEIGHTS, dataset_fullname, output_path, checkpoint)
\ No newline at end of file
@@ -75,6 +75,9 @@ class VisualSearchModel:
 
         self.model_name += model_desc["model_subname"]
 
+        # Data of the last trial searched, which is reused when the same images are searched again (such as with another subject's scanpath)
+        self.last_trial = None
+
     def load_exp_info(self, exp_info, corner_bias=16*4):
         """
         Load the experiment informations
@@ -115,10 +118,14 @@ class VisualSearchModel:
         """
         Perform the visual search on the given search and target image.
         """
-        MMconv_l = self.__create_conv_win(tar_path)
-        gt = self.__load_gt(tg_bbox)
-        stimuli = self.__load_stim(stim_path)
-        ip_stimuli = preprocess_input(stimuli)
+        trial_key = (str(stim_path), str(tar_path), tuple(tg_bbox))
+        if self.last_trial is None or self.last_trial[0] != trial_key:
+            MMconv_l = self.__create_conv_win(tar_path)
+            gt = self.__load_gt(tg_bbox)
+            stimuli = self.__load_stim(stim_path)
+            ip_stimuli = preprocess_input(stimuli)
+            self.last_trial = (trial_key, (MMconv_l, gt, stimuli, ip_stimuli))
+        MMconv_l, gt, stimuli, ip_stimuli = self.last_trial[1]
         visual_field = self.eye_res + self.corner_bias
 
         # eye_res = 736; corner_bias = 64; stim_shape = [736, 896]; model_ip_shape = [1600, 1600] = [2*(eye_res+corner_bias), 2*(eye_res+corner_bias)]
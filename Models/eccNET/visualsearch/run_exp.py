@@ -2,42 +2,88 @@ from . import utils
 import time
 from tqdm import tqdm
 from .model import VisualSearchModel as VisualSearchModel
-from Metrics.scripts import human_scanpath_prediction
+from Metrics.scripts import human_scanpath_prediction, trials_journal
 
-def start(trials_properties, exp_info, imgs_path, tgs_path, human_scanpaths, cfg_file, vgg16_weights, dataset_name, output_path):
-    ecc_param = utils.load_dict_from_json(str(cfg_file))
-    model_cfg = utils.build_modelcfg(ecc_param, str(vgg16_weights))
+def start(trials_properties, exp_info, imgs_path, tgs_path, human_scanpaths, cfg_file, vgg16_weights, dataset_name, output_path, checkpoint={}):
+    " checkpoint holds the records of the trials run by an interrupted execution, which are added to the results (see Metrics/scripts/trials_journal.py) "
+    vs_model = load_model(exp_info, cfg_file, vgg16_weights)
 
-    vs_model = VisualSearchModel(model_cfg)
-    vs_model.load_exp_info(exp_info, corner_bias=exp_info['corner_bias'])
-
-    scanpaths, targets_found = {}, 0
+    scanpaths = {image_name: record['scanpath'] for image_name, record in checkpoint.items()}
+    targets_found = sum(scanpath['target_found'] for scanpath in scanpaths.values())
+    journal = trials_journal.Journal(output_path)
     t0 = time.time()
-    for trial in tqdm(trials_properties):
-        img_path = imgs_path / trial['image']
-        tg_path  = tgs_path / trial['target']
-        img_size = (trial['image_height'], trial['image_width'])
-        tg_bbox  = [trial['target_matched_row'], trial['target_matched_column'], \
-            trial['target_height'] + trial['target_matched_row'], trial['target_width'] + trial['target_matched_column']]
-        tg_bbox  = [utils.rescale_coordinate(tg_bbox[i], img_size[i % 2 == 1], exp_info['stim_shape'][i % 2 == 1]) for i in range(len(tg_bbox))]
-        initial_fix = (trial['initial_fixation_row'], trial['initial_fixation_column'])
-        initial_fix = [utils.rescale_coordinate(initial_fix[i], img_size[i], exp_info['stim_shape'][i]) for i in range(len(initial_fix))]
-
-        human_scanpath = utils.get_scanpath(human_scanpaths, trial['image'])
-
-        trial_fixations, target_found = vs_model.start_search(img_path, tg_path, tg_bbox, initial_fix, human_scanpath, trial['image'], output_path)
-        targets_found += target_found
-        
-        if human_scanpath:
-            human_scanpath_prediction.save_scanpath_prediction_metrics(human_scanpath, trial['image'], output_path)
+    try:
+        for trial in tqdm(trials_properties):
+            img_path, tg_path, img_size, tg_bbox, initial_fix = load_trial(trial, exp_info, imgs_path, tgs_path)
 
-        scanpaths[trial['image']] = utils.build_trialscanpath(trial_fixations, target_found, tg_bbox, img_size=exp_info['stim_shape'], 
-            max_fix=exp_info['NumFix'], receptive_size=exp_info['ior_size'], tg_object=trial['target_object'], dataset=dataset_name)
+            human_scanpath = utils.get_scanpath(human_scanpaths, trial['image'])
+
+            trial_fixations, target_found = vs_model.start_search(img_path, tg_path, tg_bbox, initial_fix, human_scanpath, trial['image'], output_path)
+            targets_found += target_found
+            
+            if human_scanpath:
+                human_scanpath_prediction.save_scanpath_prediction_metrics(human_scanpath, trial['image'], output_path)
+
+            scanpaths[trial['image']] = utils.build_trialscanpath(trial_fixations, target_found, tg_bbox, img_size=exp_info['stim_shape'], 
+                max_fix=exp_info['NumFix'], receptive_size=exp_info['ior_size'], tg_object=trial['target_object'], dataset=dataset_name)
+            journal.append(trial['image'], {'scanpath': scanpaths[trial['image']]})
+    finally:
+        journal.close()
         
-    print('Total targets found: {}/{}'.format(targets_found, len(trials_properties)))
+    print('Total targets found: {}/{}'.format(targets_found, len(scanpaths)))
     print('Total time: {:.2f} seconds'.format(time.time() - t0))
     
     if human_scanpaths:
         utils.save_scanpaths(human_scanpaths, output_path, filename='Subject_scanpaths.json')
     else:
-        utils.save_scanpaths(scanpaths, output_path)
\ No newline at end of file
+        utils.save_scanpaths(scanpaths, output_path)
+    trials_journal.erase(output_path)
+
+def start_subjects(trials_properties, exp_info, imgs_path, tgs_path, subjects_scanpaths, cfg_file, vgg16_weights, output_paths):
+    """ Same as start, following the scanpaths of several human subjects (indexed by subject number, as their output paths).
+        The model is loaded only once, and the data of each image (such as the target's convolutional windows) is shared by every subject with a scanpath on it.
+    """
+    vs_model = load_model(exp_info, cfg_file, vgg16_weights)
+
+    targets_found = {subject: 0 for subject in subjects_scanpaths}
+    t0 = time.time()
+    for trial in tqdm(trials_properties):
+        trial_subjects = [subject for subject in subjects_scanpaths if trial['image'] in subjects_scanpaths[subject]]
+        if not trial_subjects:
+            continue
+        img_path, tg_path, img_size, tg_bbox, initial_fix = load_trial(trial, exp_info, imgs_path, tgs_path)
+
+        for subject in trial_subjects:
+            human_scanpath = subjects_scanpaths[subject][trial['image']]
+
+            trial_fixations, target_found = vs_model.start_search(img_path, tg_path, tg_bbox, initial_fix, human_scanpath, trial['image'], output_paths[subject])
+            targets_found[subject] += target_found
+
+            human_scanpath_prediction.save_scanpath_prediction_metrics(human_scanpath, trial['image'], output_paths[subject])
+
+    for subject in subjects_scanpaths:
+        print('Subject {}. Total targets found: {}/{}'.format(subject, targets_found[subject], len(subjects_scanpaths[subject])))
+        utils.save_scanpaths(subjects_scanpaths[subject], output_paths[subject], filename='Subject_scanpaths.json')
+    print('Total time: {:.2f} seconds'.format(time.time() - t0))
+
+def load_model(exp_info, cfg_file, vgg16_weights):
+    ecc_param = utils.load_dict_from_json(str(cfg_file))
+    model_cfg = utils.build_modelcfg(ecc_param, str(vgg16_weights))
+
+    vs_model = VisualSearchModel(model_cfg)
+    vs_model.load_exp_info(exp_info, corner_bias=exp_info['corner_bias'])
+
+    return vs_model
+
+def load_trial(trial, exp_info, imgs_path, tgs_path):
+    """ Returns the paths of the search image and the target, alongside the target's bounding box and the initial fixation rescaled to the model's image size """
+    img_path = imgs_path / trial['image']
+    tg_path  = tgs_path / trial['target']
+    img_size = (trial['image_height'], trial['image_width'])
+    tg_bbox  = [trial['target_matched_row'], trial['target_matched_column'], \
+        trial['target_height'] + trial['target_matched_row'], trial['target_width'] + trial['target_matched_column']]
+    tg_bbox  = [utils.rescale_coordinate(tg_bbox[i], img_size[i % 2 == 1], exp_info['stim_shape'][i % 2 == 1]) for i in range(len(tg_bbox))]
+    initial_fix = (trial['initial_fixation_row'], trial['initial_fixation_column'])
+    initial_fix = [utils.rescale_coordinate(initial_fix[i], img_size[i], exp_info['stim_shape'][i]) for i in range(len(initial_fix))]
+
+    return img_path, tg_path, img_size, tg_bbox, initial_fix
\ No newline at end of file
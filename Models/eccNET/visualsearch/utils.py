@@ -1,5 +1,5 @@
 import json
-import pandas as pd
+from Metrics.scripts import probability_maps, scanpaths_store
 
 def rescale_coordinate(value, old_size, new_size):
     return int((value / old_size) * new_size)
@@ -22,10 +22,7 @@ def save_to_json(file, data):
 
 def save_probability_map(fix_number, img_name, probability_map, output_path):
     save_path = output_path / 'probability_maps' / img_name[:-4]
-    if not save_path.exists(): save_path.mkdir(parents=True)
-
-    probability_map_df = pd.DataFrame(probability_map)
-    probability_map_df.to_csv(str(save_path / f'fixation_{fix_number}.csv'), index=False)
+    probability_maps.save(probability_map, fix_number, str(save_path))
 
 def build_expinfo(num_images, max_fixations, img_size, target_size, eye_res, deg_to_pixel, dog_size, weight_pattern='l'):
     exp_info = {'eye_res': eye_res,
@@ -69,13 +66,12 @@ def load_human_scanpaths(human_subject, img_size, model_img_size, human_scanpath
     if human_subject is None:
         return {}
 
-    human_scanpaths_files = [human_scanpaths_file.name for human_scanpaths_file in human_scanpaths_dir.glob('*.json')]
-    human_subject_str     = str(human_subject).zfill(2)
-    human_subject_file    = f'subj{human_subject_str}_scanpaths.json'
-    if not human_subject_file in human_scanpaths_files:
+    humans_scanpaths  = scanpaths_store.load(str(human_scanpaths_dir))
+    human_subject_str = str(human_subject).zfill(2)
+    if not human_subject in humans_scanpaths.subjects:
         raise NameError(f'Scanpaths for subject {human_subject_str} not found!')
     
-    human_scanpaths = load_dict_from_json(human_scanpaths_dir / human_subject_file)
+    human_scanpaths = humans_scanpaths.subject_scanpaths(human_subject)
     # Convert to int and rescale coordinates
     for trial in human_scanpaths:
         scanpath = human_scanpaths[trial]
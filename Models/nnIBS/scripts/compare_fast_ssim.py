@@ -0,0 +1,70 @@
+import argparse
+import sys
+import numpy as np
+from os import path
+from skimage import io, transform, img_as_ubyte
+from skimage.metrics import structural_similarity as ssim
+from ..visualsearch.target_similarity.fast_ssim import Fast_ssim, MIN_PATCH_SIZE
+
+""" Checks that the target similarity map built by fast_ssim is the same as the one built by ssim, on a random sample of pixels
+    (ssim, which calls skimage's structural_similarity for each pixel, would take hours on the whole image). Usage:
+        python -m Models.nnIBS.scripts.compare_fast_ssim -img <image> -target <target> -bbox <row> <column> <end row> <end column>
+"""
+
+# Maximum absolute difference between both maps for them to be considered the same
+TOLERANCE = 1e-6
+
+def compare_with_ssim(image, target, target_bbox, number_of_pixels=1000, seed=0):
+    " Computes both maps on a sample of pixels, the ones of ssim just as Ssim.compute_ssim_single_process does "
+    """ Input:
+            image  (2D array) : search image
+            target (2D array) : target image
+            target_bbox (array) : bounding box (upper left row, upper left column, lower right row, lower right column) of the target in the image
+            number_of_pixels (int) : size of the sample of pixels on which to evaluate ssim
+        Output:
+            comparison (dict) : maximum absolute difference between both maps, and whether it is within TOLERANCE
+    """
+    # Neither method depends on the state of the model, so the target similarity map isn't built when instantiating it
+    fast_ssim = Fast_ssim.__new__(Fast_ssim)
+    fast_ssim_values = fast_ssim.compute_target_similarity(image, target, target_bbox).astype(np.float64)
+
+    target_size_in_image = (target_bbox[2] - target_bbox[0], target_bbox[3] - target_bbox[1])
+    if target.shape[:2] != target_size_in_image:
+        target = img_as_ubyte(transform.resize(target, target_size_in_image))
+    image_size      = image.shape[:2]
+    off_bounds_area = fast_ssim.get_image_off_bounds_area(target_size_in_image)
+    channel_axis    = 2 if len(image.shape) > 2 else None
+
+    random_generator = np.random.default_rng(seed)
+    pixels = random_generator.integers(0, image_size, size=(number_of_pixels, 2))
+    ssim_values = np.zeros(number_of_pixels)
+    for index, (row, column) in enumerate(pixels):
+        target_to_use, row_in_image, column_in_image, end_row, end_column = fast_ssim.handle_image_borders(target, off_bounds_area, row, column, target_size_in_image, image_size)
+        pixels_in_interval = image[row_in_image:end_row, column_in_image:end_column]
+        if np.shape(pixels_in_interval)[0] >= MIN_PATCH_SIZE and np.shape(pixels_in_interval)[1] >= MIN_PATCH_SIZE:
+            ssim_values[index] = ssim(pixels_in_interval, target_to_use, channel_axis=channel_axis)
+    # Ssim stores its values as float32
+    ssim_values = ssim_values.astype(np.float32)
+    maximum_difference = np.max(np.abs(ssim_values - fast_ssim_values[pixels[:, 0], pixels[:, 1]]))
+
+    return {'maximum_difference': maximum_difference, 'same': bool(maximum_difference <= TOLERANCE)}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Checks that the target similarity maps built by fast_ssim and ssim are the same, on a sample of pixels')
+    parser.add_argument('-img', type=str, help='Path to the search image')
+    parser.add_argument('-target', type=str, help='Path to the target image')
+    parser.add_argument('-bbox', type=int, nargs=4, help='Bounding box of the target in the image (upper left row, upper left column, lower right row, lower right column)')
+    parser.add_argument('-pixels', type=int, default=1000, help='Size of the sample of pixels')
+    parser.add_argument('-seed', type=int, default=0, help='Seed of the sample of pixels')
+
+    args = parser.parse_args()
+    if not (path.isfile(args.img) and path.isfile(args.target)):
+        print('Wrong path to image or target file')
+        sys.exit(-1)
+
+    comparison = compare_with_ssim(io.imread(args.img), io.imread(args.target), args.bbox, args.pixels, args.seed)
+    print('Max. absolute difference: ' + str(comparison['maximum_difference']) + ' (tolerance: ' + str(TOLERANCE) + ')')
+    if not comparison['same']:
+        print('The maps differ')
+        sys.exit(-1)
+    print('The maps are the same')
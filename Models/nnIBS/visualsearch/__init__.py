@@ -1 +1 @@
-from .main import run
+from .main import run, run_human_subjects
@@ -3,6 +3,9 @@ from .visual_searcher import VisualSearcher
 from .grid import Grid
 from .utils import utils
 from . import prior
+from Metrics.scripts import trials_journal
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import util, Event
 import numpy as np
 import time
 import sys
@@ -12,23 +15,42 @@ import sys
 def run(config, dataset_info, trials_properties, human_scanpaths, output_path, sigma):
     """ Input:
             Config (dict). One entry. Fields:
-                search_model      (string)   : bayesian, greedy
-                target_similarity (string)   : correlation, geisler, ssim, ivsn
+                search_model      (string)   : ibs, greedy, elm
+                ibs_engine        (string)   : vectorized (default) or loop. Only used by the ibs search model
+                ibs_integration   (string)   : trapezoid (default) or gauss_hermite. Only used by the ibs search model
+                gauss_hermite_nodes (int)    : number of nodes of the Gauss-Hermite quadrature rule (12 by default)
+                gauss_hermite_norm_cdf (string) : ndtr (default) or table. Indicates how normcdf is evaluated by the Gauss-Hermite quadrature rule
+                ibs_integration_check (bool) : compares every probability map against the one computed with the trapezoidal rule (False by default)
+                ibs_mode          (string)   : exact (default) or pruned. In pruned mode, only the most likely target locations are integrated over
+                ibs_pruning_mass  (float)    : share of the posterior mass covered by the target locations integrated over in pruned mode (0.999 by default)
+                candidate_search  (string)   : exhaustive (default) or coarse_to_fine. Indicates how the ibs and elm search models look for the next fixation
+                candidate_search_stride (int) : spacing (in cells) between the coarse candidates of the coarse_to_fine search (2 by default)
+                candidate_search_top_k  (int) : number of coarse candidates around which the coarse_to_fine search scores every cell (4 by default)
+                candidate_search_verify (bool) : scores every cell as well, keeps the exhaustive choice and reports how often the refined one matches it (False by default)
+                target_similarity (string)   : correlation, geisler, ssim, fast_ssim, ivsn, ivsn_effnet, ivsn_resnext. fast_ssim builds the same map as ssim, in a fraction of the time
                 prior             (string)   : deepgaze, mlnet, flat, center
+                prior_batch_size  (int)      : number of images fed to DeepGaze II at once when precomputing priors (4 by default)
+                prior_processes   (int)      : number of processes on which to precompute DeepGaze II priors (1 by default)
                 max_saccades      (int)      : maximum number of saccades allowed
                 cell_size         (int)      : size (in pixels) of the cells in the grid
+                visibility_map_mode (string) : dense (default) or compact. The latter computes the visibility map at each fixation on demand, using far less memory
                 scale_factor      (int)      : modulates the variance of target similarity and prevents 1 / d' from diverging in bayesian search
                 additive_shift    (int)      : modulates the variance of target similarity and prevents 1 / d' from diverging in bayesian search
                 save_probability_maps (bool) : indicates whether to save the probability map to a file after each saccade or not
                 proc_number       (int)      : number of processes on which to execute bayesian search
+                trial_processes   (int)      : number of trials to run concurrently (1 by default). The proc_number processes are split among them
                 image_size        (int, int) : image size on which the model will operate
                 save_similarity_maps (bool)  : indicates whether to save the target similarity map for each image in bayesian search
+                similarity_cache_max_mb (int) : maximum size (in megabytes) of the target similarity maps cache (2048 by default)
+                replicates        (int)      : number of searches run on each image, each with the random noise of seed, seed + 1, ..., seed + replicates - 1 (1 by default)
+                checkpoint_flush_trials  (int) : the checkpoint is written to disk every checkpoint_flush_trials finished trials (10 by default)...
+                checkpoint_flush_seconds (int) : ... or every checkpoint_flush_seconds seconds, whichever comes first (60 by default)
             Dataset info (dict). One entry. Fields:
                 name          (string)         : name of the dataset
                 images_dir    (string)         : folder path where search images are stored
                 targets_dir   (string)         : folder path where the targets are stored
                 saliency_dir  (string)         : folder path where the saliency maps are stored
-                target_similarity_dir (string) : folder path where the target similarity maps are stored
+                target_similarity_dir (string) : folder path where the target similarity maps are cached
                 image_height  (int)            : default image height (in pixels)
                 image_width   (int)            : default image width (in pixels)
             Trials properties (dict):
@@ -46,70 +68,232 @@ def run(config, dataset_info, trials_properties, human_scanpaths, output_path, s
             sigma (2D array)       : covariance matrix used for building the visibility map
         Output:
             Output_path/scanpaths/Scanpaths.json: Dictionary indexed by image name where each entry contains the scanpath for that given image, alongside the configuration used.
+            Output_path/scanpaths/Scanpaths_replicates.json: Same as Scanpaths.json, but each entry is the list of scanpaths made by every replicate (only if replicates is greater than one).
             Output_path/probability_maps/: In this folder, the probability map computed for each saccade is stored. This is done for every image in trials_properties. (Only if save_probability_maps is true.)
-            Output_path/similarity_maps/: In this folder, the target similarity map computed for each image is stored. This is done for every image in trials_properties. (Only if save_similarity_maps is true.)
+            Output_path/pruning_error_bounds.csv: Error bound of the probability map of each fixation. (Only if search_model is ibs and ibs_mode is pruned.)
+            dataset_info['target_similarity_dir']: Content-addressed cache where the target similarity map computed for each image is stored (see utils/similarity_cache.py), shared by every run and model. (Only if save_similarity_maps is true.)
+            Output_path/trials_journal.jsonl: Checkpoint with the results of the trials finished so far, from which an interrupted execution is resumed. It's deleted once every trial is finished.
     """
-    images_dir            = dataset_info['images_dir']
-    targets_dir           = dataset_info['targets_dir']
-    saliency_dir          = dataset_info['saliency_dir']
-    target_similarity_dir = dataset_info['target_similarity_dir']
-    prior_name    = config['prior']
-    
-    image_size = (dataset_info['image_height'], dataset_info['image_width'])
-    cell_size  = config['cell_size']
-
+    cell_size        = config['cell_size']
     model_image_size = config['image_size']
-    
-    # Initialize objects
-    grid            = Grid(np.array(model_image_size), cell_size)
-    visibility_map  = VisibilityMap(model_image_size, grid, sigma)
-    visual_searcher = VisualSearcher(config, grid, visibility_map, target_similarity_dir, output_path, human_scanpaths)
+
+    # Human scanpaths are replayed sequentially, since their metrics are saved to a single file
+    trial_processes = config.get('trial_processes', 1)
+    if trial_processes > 1 and human_scanpaths:
+        print('Trials will be run sequentially, since human scanpaths are used as fixations')
+        trial_processes = 1
+    if config.get('replicates', 1) > 1 and human_scanpaths:
+        print('Only one replicate will be run, since human scanpaths are used as fixations')
+    if human_scanpaths:
+        config = exhaustive_candidate_search(config)
+
+    grid = Grid(np.array(model_image_size), cell_size)
 
     # Rescale human scanpaths' coordinates (if any) to those of the grid
     utils.rescale_scanpaths(grid, human_scanpaths)
 
-    print('Press Ctrl + C to interrupt execution and save a checkpoint \n')
+    print('Press Ctrl + C to interrupt execution. Finished trials are saved in a checkpoint as they are run \n')
 
     # If resuming execution, load previously generated data
-    scanpaths, targets_found, previous_time = utils.load_data_from_checkpoint(output_path)
+    scanpaths, replicates, targets_found, previous_time = utils.load_data_from_checkpoint(output_path)
+    previous_trials = list(scanpaths.keys())
+
+    # Compute missing priors beforehand, so that trials only read them
+    prior.precompute([trial['image'] for trial in trials_properties], dataset_info['images_dir'], model_image_size, config['prior'], dataset_info['saliency_dir'], \
+        batch_size=config.get('prior_batch_size', 4), number_of_processes=config.get('prior_processes', 1))
 
     trial_number = len(scanpaths)
     total_trials = len(trials_properties) + trial_number
+    cache_hits, cache_misses = 0, 0
     start = time.time()
+    if trial_processes > 1:
+        searched_trials = search_concurrently(config, dataset_info, trials_properties, output_path, sigma, trial_processes, trial_number, total_trials)
+    else:
+        searched_trials = search_sequentially(config, dataset_info, trials_properties, human_scanpaths, output_path, sigma, grid, trial_number, total_trials)
+    journal = trials_journal.Journal(output_path, header={'configuration': config}, flush_trials=config.get('checkpoint_flush_trials', trials_journal.FLUSH_TRIALS), \
+        flush_seconds=config.get('checkpoint_flush_seconds', trials_journal.FLUSH_SECONDS))
     try:
-        for trial in trials_properties:
-            trial_number += 1
-            image_name  = trial['image']
-            target_name = trial['target'] 
-            print('Searching in image ' + image_name + ' (' + str(trial_number) + '/' + str(total_trials) + ')...')
-            
-            image       = utils.load_image(images_dir, image_name, model_image_size)
-            target      = utils.load_image(targets_dir, target_name)
-            image_prior = prior.load(image, image_name, model_image_size, prior_name, saliency_dir)
-            
-            initial_fixation = (trial['initial_fixation_row'], trial['initial_fixation_column'])
-            initial_fixation = [utils.rescale_coordinate(initial_fixation[i], image_size[i], model_image_size[i]) for i in range(len(initial_fixation))]
-            target_bbox      = [trial['target_matched_row'], trial['target_matched_column'], \
-                                    trial['target_height'] + trial['target_matched_row'], trial['target_width'] + trial['target_matched_column']]
-            target_bbox      = [utils.rescale_coordinate(target_bbox[i], image_size[i % 2 == 1], model_image_size[i % 2 == 1]) for i in range(len(target_bbox))]
-
-            trial_scanpath = visual_searcher.search(image_name, image, image_prior, target, target_bbox, initial_fixation)
-
+        for trial, trial_scanpath, target_bbox, cache_statistics in searched_trials:
+            cache_hits   += cache_statistics[0]
+            cache_misses += cache_statistics[1]
             if trial_scanpath:
                 # If there were no errors, save the scanpath
-                utils.add_scanpath_to_dict(image_name, trial_scanpath, target_bbox, trial['target_object'], grid, config, dataset_info['dataset_name'], scanpaths)
+                utils.add_scanpath_to_dict(trial['image'], trial_scanpath, target_bbox, trial['target_object'], grid, config, dataset_info['dataset_name'], scanpaths)
                 targets_found += trial_scanpath['target_found']
+                if 'replicates' in trial_scanpath:
+                    utils.add_replicates_to_dict(trial['image'], trial_scanpath, target_bbox, trial['target_object'], grid, config, dataset_info['dataset_name'], replicates)
+                journal.append(trial['image'], utils.create_checkpoint_record(trial['image'], scanpaths, replicates, time.time() - start + previous_time))
     except KeyboardInterrupt:
-        time_elapsed = time.time() - start + previous_time
-        utils.save_checkpoint(config, scanpaths, targets_found, trials_properties, time_elapsed, output_path)        
+        journal.close()
+        print('\nCheckpoint saved at ' + output_path)
+        print('Run the script again to resume execution')
         sys.exit(0)
+    finally:
+        searched_trials.close()
+        journal.close()
+
+    # Trials may finish in any order when run concurrently; keep the order in which they were given
+    trials_order = previous_trials + [trial['image'] for trial in trials_properties]
+    scanpaths    = {image_name: scanpaths[image_name] for image_name in trials_order if image_name in scanpaths}
+    replicates   = {image_name: replicates[image_name] for image_name in trials_order if image_name in replicates}
 
     time_elapsed = time.time() - start + previous_time
     if human_scanpaths:
         utils.save_scanpaths(output_path, human_scanpaths, filename='Subject_scanpaths.json')
     else:
         utils.save_scanpaths(output_path, scanpaths)
-    utils.erase_checkpoint(output_path)
+    if replicates:
+        utils.save_scanpaths(output_path, replicates, filename='Scanpaths_replicates.json')
+    trials_journal.erase(output_path)
 
     print('Total targets found: ' + str(targets_found) + '/' + str(len(scanpaths)))
-    print('Total time elapsed:  ' + str(round(time_elapsed, 4))   + ' seconds')
\ No newline at end of file
+    print('Total time elapsed:  ' + str(round(time_elapsed, 4))   + ' seconds')
+    print('Target similarity cache: ' + str(cache_hits) + ' hits, ' + str(cache_misses) + ' misses')
+
+def run_human_subjects(config, dataset_info, trials_properties, subjects_scanpaths, output_paths, sigma):
+    " Runs the visual search model following the scanpaths of several human subjects, in a single process "
+    " Trials are run image by image, so that what doesn't depend on the subject (images, prior, target similarity map, and the model itself) is loaded or computed only once "
+    """ Input:
+            Config, dataset info and sigma are the same as in run.
+            trials_properties (dict)  : trials on which to run the model; each one is run with the scanpaths of every subject who has one for its image
+            subjects_scanpaths (dict) : human scanpaths of each subject, indexed by subject number
+            output_paths (dict)       : folder path where the results of each subject will be stored, indexed by subject number
+        Output:
+            The same files as run, in the output path of each subject. If execution is interrupted, running it again skips the images whose probability maps were already computed.
+    """
+    config = exhaustive_candidate_search(config)
+    grid   = Grid(np.array(config['image_size']), config['cell_size'])
+    for human_scanpaths in subjects_scanpaths.values():
+        utils.rescale_scanpaths(grid, human_scanpaths)
+
+    prior.precompute([trial['image'] for trial in trials_properties], dataset_info['images_dir'], config['image_size'], config['prior'], dataset_info['saliency_dir'], \
+        batch_size=config.get('prior_batch_size', 4), number_of_processes=config.get('prior_processes', 1))
+
+    visibility_map  = VisibilityMap(config['image_size'], grid, sigma, mode=config.get('visibility_map_mode', 'dense'))
+    visual_searcher = VisualSearcher(config, grid, visibility_map, dataset_info['target_similarity_dir'], output_path=None, human_scanpaths={})
+    # When run on its own, the searcher of each subject keeps the number of saccades of the subject's previous trial, which is used for summing the prior
+    subjects_max_saccades = {subject: config['max_saccades'] for subject in subjects_scanpaths}
+
+    start = time.time()
+    try:
+        for trial_number, trial in enumerate(trials_properties):
+            image_name     = trial['image']
+            trial_subjects = [subject for subject in subjects_scanpaths if image_name in subjects_scanpaths[subject]]
+            if not trial_subjects:
+                continue
+            print('Searching in image ' + image_name + ' (' + str(trial_number + 1) + '/' + str(len(trials_properties)) + ') with the scanpaths of ' + str(len(trial_subjects)) + ' subjects...')
+            image, target, image_prior, target_bbox, initial_fixation = load_trial(trial, dataset_info, config)
+
+            for subject in trial_subjects:
+                visual_searcher.human_scanpaths = subjects_scanpaths[subject]
+                visual_searcher.output_path     = output_paths[subject]
+                visual_searcher.max_saccades    = subjects_max_saccades[subject]
+                visual_searcher.search(image_name, image, image_prior, target, target_bbox, initial_fixation)
+                subjects_max_saccades[subject]  = visual_searcher.max_saccades
+    finally:
+        visual_searcher.close()
+
+    for subject in subjects_scanpaths:
+        utils.save_scanpaths(output_paths[subject], subjects_scanpaths[subject], filename='Subject_scanpaths.json')
+
+    print('Total time elapsed:  ' + str(round(time.time() - start, 4)) + ' seconds')
+
+def exhaustive_candidate_search(config):
+    " Human scanpath prediction needs the whole probability map of each fixation, so every cell is scored when following human scanpaths "
+    if config.get('candidate_search', 'exhaustive') != 'exhaustive':
+        print('Every cell will be scored, since human scanpaths are used as fixations')
+        config = dict(config, candidate_search='exhaustive')
+
+    return config
+
+def search_sequentially(config, dataset_info, trials_properties, human_scanpaths, output_path, sigma, grid, trial_number, total_trials):
+    " Runs the visual search model on each trial, one after the other "
+    " Yields each trial alongside its scanpath and the target bounding box (rescaled to the model's image size) and the cache's hits and misses "
+    visibility_map  = VisibilityMap(config['image_size'], grid, sigma, mode=config.get('visibility_map_mode', 'dense'))
+    visual_searcher = VisualSearcher(config, grid, visibility_map, dataset_info['target_similarity_dir'], output_path, human_scanpaths)
+    try:
+        for trial in trials_properties:
+            trial_number += 1
+            trial_scanpath, target_bbox, cache_statistics = search_trial(visual_searcher, trial, dataset_info, config, trial_number, total_trials)
+
+            yield trial, trial_scanpath, target_bbox, cache_statistics
+    finally:
+        visual_searcher.close()
+
+def search_concurrently(config, dataset_info, trials_properties, output_path, sigma, trial_processes, trial_number, total_trials):
+    " Runs the visual search model on trial_processes trials at a time, each one in a different process "
+    " The proc_number processes are split among them, and each trial uses its own random generator, so results are the same as when run sequentially "
+    " Yields each trial alongside its scanpath and the target bounding box (rescaled to the model's image size) and the cache's hits and misses, as they finish "
+    workers_config = dict(config, proc_number=max(1, config['proc_number'] // trial_processes))
+    stop_event = Event()
+    executor   = ProcessPoolExecutor(max_workers=trial_processes, initializer=init_trial_worker, initargs=(workers_config, dataset_info, output_path, sigma, stop_event))
+    try:
+        tasks = [executor.submit(search_trial_in_worker, trial, trial_number + index + 1, total_trials) for index, trial in enumerate(trials_properties)]
+        for task in as_completed(tasks):
+            yield task.result()
+    finally:
+        # If execution is interrupted, pending trials are discarded (including those already handed to the workers)
+        stop_event.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def search_trial(visual_searcher, trial, dataset_info, config, trial_number, total_trials):
+    " Loads the images of the trial, rescales its coordinates to the model's image size and runs the visual search model on it "
+    """ Output:
+            trial_scanpath (dict) : scanpath made by the model (empty if there were errors)
+            target_bbox (array)   : bounding box of the target, rescaled to the model's image size
+            cache_statistics (int, int) : hits and misses of the target similarity maps cache during the trial
+    """
+    image_name = trial['image']
+    print('Searching in image ' + image_name + ' (' + str(trial_number) + '/' + str(total_trials) + ')...')
+    image, target, image_prior, target_bbox, initial_fixation = load_trial(trial, dataset_info, config)
+
+    similarity_cache = visual_searcher.similarity_cache
+    cache_hits, cache_misses = similarity_cache.hits, similarity_cache.misses
+    trial_scanpath = visual_searcher.search(image_name, image, image_prior, target, target_bbox, initial_fixation)
+    cache_statistics = (similarity_cache.hits - cache_hits, similarity_cache.misses - cache_misses)
+
+    return trial_scanpath, target_bbox, cache_statistics
+
+def load_trial(trial, dataset_info, config):
+    " Loads the search image, the target and the prior of the trial, and rescales the target bounding box and the initial fixation to the model's image size "
+    image_size       = (dataset_info['image_height'], dataset_info['image_width'])
+    model_image_size = config['image_size']
+    image_name  = trial['image']
+    target_name = trial['target'] 
+    
+    image       = utils.load_image(dataset_info['images_dir'], image_name, model_image_size)
+    target      = utils.load_image(dataset_info['targets_dir'], target_name)
+    image_prior = prior.load(image, image_name, model_image_size, config['prior'], dataset_info['saliency_dir'])
+    
+    initial_fixation = (trial['initial_fixation_row'], trial['initial_fixation_column'])
+    initial_fixation = [utils.rescale_coordinate(initial_fixation[i], image_size[i], model_image_size[i]) for i in range(len(initial_fixation))]
+    target_bbox      = [trial['target_matched_row'], trial['target_matched_column'], \
+                            trial['target_height'] + trial['target_matched_row'], trial['target_width'] + trial['target_matched_column']]
+    target_bbox      = [utils.rescale_coordinate(target_bbox[i], image_size[i % 2 == 1], model_image_size[i % 2 == 1]) for i in range(len(target_bbox))]
+
+    return image, target, image_prior, target_bbox, initial_fixation
+
+""" Each process running trials concurrently holds its own visual searcher, which is reused across trials """
+worker_searcher = None
+worker_dataset_info = None
+worker_config = None
+worker_stop_event = None
+
+def init_trial_worker(config, dataset_info, output_path, sigma, stop_event):
+    global worker_searcher, worker_dataset_info, worker_config, worker_stop_event
+    grid           = Grid(np.array(config['image_size']), config['cell_size'])
+    visibility_map = VisibilityMap(config['image_size'], grid, sigma, mode=config.get('visibility_map_mode', 'dense'))
+    worker_searcher     = VisualSearcher(config, grid, visibility_map, dataset_info['target_similarity_dir'], output_path, human_scanpaths={})
+    worker_dataset_info = dataset_info
+    worker_config       = config
+    worker_stop_event   = stop_event
+    # Release the resources held by the searcher (such as IBS's pool of workers) when the process exits
+    util.Finalize(worker_searcher, worker_searcher.close, exitpriority=10)
+
+def search_trial_in_worker(trial, trial_number, total_trials):
+    if worker_stop_event.is_set():
+        return trial, {}, None, (0, 0)
+
+    trial_scanpath, target_bbox, cache_statistics = search_trial(worker_searcher, trial, worker_dataset_info, worker_config, trial_number, total_trials)
+
+    return trial, trial_scanpath, target_bbox, cache_statistics
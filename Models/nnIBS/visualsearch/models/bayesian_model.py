@@ -1,20 +1,65 @@
 import numpy as np
 import warnings
+import time
 from scipy.stats import norm
+from scipy.special import ndtr
 from scipy.interpolate import interp1d
-from multiprocessing import Process, shared_memory
+from multiprocessing import Pool
 from ..utils import utils
-from os import cpu_count
+from ..visibility_map import VisibilityMap
+import signal
+
+# Number of points on which the integral over w is evaluated
+INTEGRATION_POINTS = 50
+# Upper bound on the number of elements of the (fixations, target locations, cells, w) integrand evaluated at once by the vectorized engine
+MAX_BLOCK_ELEMENTS = 2 ** 23
+# Default number of nodes of the Gauss-Hermite quadrature rule, when it is used instead of the trapezoidal rule
+GAUSS_HERMITE_NODES = 12
+# Default share of the posterior mass covered by the target locations on which pruned IBS integrates
+PRUNING_MASS = 0.999
 
 class BayesianModel:
-    def __init__(self, grid_size, visibility_map, norm_cdf_tolerance, number_of_processes, save_probability_maps):
+    def __init__(self, grid_size, visibility_map, norm_cdf_tolerance, number_of_processes, save_probability_maps, engine='vectorized', \
+        integration='trapezoid', gauss_hermite_nodes=GAUSS_HERMITE_NODES, gauss_hermite_norm_cdf='ndtr', check_integration=False, mode='exact', pruning_mass=PRUNING_MASS, \
+        candidate_search=None):
         self.grid_size      = grid_size
         self.visibility_map = visibility_map
-        self.norm_cdf_table = self.create_norm_cdf_table(norm_cdf_tolerance)
+        self.norm_cdf_tolerance  = norm_cdf_tolerance
+        self.norm_cdf_table      = self.create_norm_cdf_table(norm_cdf_tolerance)
         self.number_of_processes = number_of_processes
+        # The pool of workers is created the first time it is needed, and it lives until close() is called
+        self.workers_pool   = None
+        self.shared_visibility_map = None
+        # 'vectorized' evaluates every target location in a single NumPy pass; 'loop' is the reference implementation
+        if engine not in ['vectorized', 'loop']:
+            raise ValueError('Invalid IBS engine, valid options are: vectorized, loop')
+        self.engine = engine
+        # 'trapezoid' integrates over w with the trapezoidal rule on INTEGRATION_POINTS points; 'gauss_hermite' uses a Gauss-Hermite quadrature rule,
+        # which takes far fewer evaluations of the integrand (see integrate_gauss_hermite)
+        if integration not in ['trapezoid', 'gauss_hermite']:
+            raise ValueError('Invalid IBS integration method, valid options are: trapezoid, gauss_hermite')
+        if gauss_hermite_norm_cdf not in ['ndtr', 'table']:
+            raise ValueError('Invalid Gauss-Hermite normcdf method, valid options are: ndtr, table')
+        self.integration = integration
+        self.gauss_hermite_nodes, self.gauss_hermite_weights = self.create_gauss_hermite_rule(gauss_hermite_nodes)
+        self.gauss_hermite_norm_cdf = gauss_hermite_norm_cdf
+        self.uniform_norm_cdf_table = self.create_uniform_norm_cdf_table(norm_cdf_tolerance)
+        # If True, every probability map is also computed with the trapezoidal rule, and the differences are reported when the model is closed
+        self.check_integration  = check_integration and integration != 'trapezoid'
+        self.integration_report = {'maps': 0, 'max_absolute_error': 0.0, 'max_relative_error': 0.0, 'changed_fixations': 0, 'time': 0.0, 'reference_time': 0.0}
+        # 'exact' integrates over every possible target location; 'pruned' only over the most likely ones, which cover pruning_mass of the posterior
+        # (see target_locations_to_integrate). The error bound of each probability map is logged to the output path
+        if mode not in ['exact', 'pruned']:
+            raise ValueError('Invalid IBS mode, valid options are: exact, pruned')
+        if not 0 < pruning_mass <= 1:
+            raise ValueError('The pruning mass must be in the interval (0, 1]')
+        self.mode         = mode
+        self.pruning_mass = pruning_mass
+        # If given (CandidateSearch), the next fixation is searched for coarse-to-fine instead of scoring every cell (see search_candidates)
+        self.candidate_search = candidate_search
 
         self.save_probability_maps = save_probability_maps
-    
+
     def create_norm_cdf_table(self, norm_cdf_tolerance):
         " Build normal curve table with default mean and variance. Row values go from norm_cdf_tolerance to 1 - norm_cdf_tolerance "
         """ Input:
@@ -26,7 +71,41 @@ class BayesianModel:
         rows    = norm.cdf(columns)
 
         return {'x': columns, 'y': rows}
-    
+
+    def create_uniform_norm_cdf_table(self, norm_cdf_tolerance):
+        " Same as create_norm_cdf_table, but columns are evenly spaced (with the same range and number of columns), "
+        " so that the position of a value in the table is computed in constant time instead of being searched for "
+        """ Input:
+                norm_cdf_tolerance (float) : value from which to compute the normal distribution probabilities
+            Output:
+                uniform_norm_cdf_table (dict) : first column ('x0'), spacing between columns ('step'), cumulative normal distribution values ('y')
+                    and differences between consecutive values ('differences')
+        """
+        norm_cdf_table = self.create_norm_cdf_table(norm_cdf_tolerance)
+        columns = np.linspace(norm_cdf_table['x'][0], norm_cdf_table['x'][-1], len(norm_cdf_table['x']))
+        rows    = norm.cdf(columns)
+
+        return {'x0': columns[0], 'step': columns[1] - columns[0], 'y': rows, 'differences': np.diff(rows)}
+
+    def create_gauss_hermite_rule(self, number_of_nodes):
+        " Nodes and weights of the Gauss-Hermite quadrature rule for the standard normal density: integral(phi(w) * f(w)) ~= sum(weights * f(nodes)) "
+        if number_of_nodes < 1:
+            raise ValueError('The number of Gauss-Hermite nodes must be positive')
+        nodes, weights = np.polynomial.hermite_e.hermegauss(number_of_nodes)
+
+        return nodes, weights / np.sqrt(2 * np.pi)
+
+    def norm_cdf_from_uniform_table(self, values):
+        " Linear interpolation on the uniform normcdf table. As with np.interp, values outside the table take the value at its ends "
+        table     = self.uniform_norm_cdf_table
+        positions = np.subtract(values, table['x0'])
+        positions /= table['step']
+        np.clip(positions, 0, len(table['y']) - 1, out=positions)
+        indexes   = np.minimum(positions.astype(np.intp), len(table['y']) - 2)
+        positions -= indexes
+
+        return table['y'][indexes] + positions * table['differences'][indexes]
+
     def next_fixation(self, posterior, image_name, fixation_number, output_path):
         " Computes the next fixation according to the posterior, which size is equal to the grid "
         """ Input:
@@ -36,94 +115,331 @@ class BayesianModel:
 
             (The rest of the input arguments are used to save the probability map to a CSV file.)
         """
-        probability_at_each_fixation = np.empty(shape=self.grid_size)
+        next_fixations, _ = self.next_fixations([posterior], image_name, [fixation_number], output_path)
+
+        return next_fixations[0]
+
+    def next_fixations(self, posteriors, image_name, fixation_numbers, output_path):
+        " Same as next_fixation, for several posteriors which don't depend on each other's outcome (such as when the fixations are those of a human scanpath) "
+        " With more than one process, the rows of every probability map are handed out to the pool at once, so that all of them are computed concurrently "
+        """ Input:
+                posteriors (list of 2D arrays) : probability maps of the size of the grid
+                fixation_numbers (list of int) : fixation number of each posterior, used to save its probability map (None if it isn't to be saved)
+            Output:
+                next_fixations (list of (int, int))    : next fixation for each posterior
+                probability_maps (list of 2D arrays)   : probability of being correct at each possible fixation, for each posterior
+        """
+        start = time.time()
+        if self.candidate_search is None:
+            probability_maps = self.compute_probability_maps(posteriors, self.integration)
+        else:
+            probability_maps = self.search_candidates(posteriors)
+        if self.check_integration:
+            self.compare_integration(posteriors, probability_maps, time.time() - start)
+
+        next_fixations = []
+        for probability_at_each_fixation, posterior, fixation_number in zip(probability_maps, posteriors, fixation_numbers):
+            if self.save_probability_maps and fixation_number is not None:
+                utils.save_probability_map(output_path, image_name, probability_at_each_fixation, fixation_number)
+            if self.mode == 'pruned' and fixation_number is not None:
+                target_locations, error_bound = self.target_locations_to_integrate(posterior)
+                utils.log_pruning_error_bound(output_path, image_name, fixation_number, error_bound, len(target_locations))
+
+            next_fixations.append(self.best_fixation(probability_at_each_fixation))
+
+        return next_fixations, probability_maps
+
+    def target_locations_to_integrate(self, posterior):
+        " Returns the indexes of the (flattened) grid cells where the probability of being correct is integrated, alongside the error bound this entails "
+        " In 'pruned' mode, these are the fewest cells (taken in decreasing order of posterior) whose posterior mass reaches self.pruning_mass of the total. "
+        " Since the probability of being correct given the target location is at most one, the probability at each fixation is underestimated "
+        " by at most the posterior mass of the discarded cells, which is the error bound (it's the same for every fixation) "
+        """ Input:
+                posterior (2D array) : probability map of the size of the grid
+            Output:
+                target_locations (1D array) : indexes of the cells, in increasing order
+                error_bound (float)         : posterior mass of the discarded cells (zero in 'exact' mode)
+        """
+        posterior_flat = posterior.flatten()
+        if self.mode == 'exact':
+            return np.arange(len(posterior_flat)), 0.0
+
+        posterior_flat    = np.nan_to_num(posterior_flat)
+        decreasing_order  = np.argsort(-posterior_flat, kind='stable')
+        cumulative_mass   = np.cumsum(posterior_flat[decreasing_order])
+        number_of_targets = min(np.searchsorted(cumulative_mass, self.pruning_mass * cumulative_mass[-1]) + 1, len(posterior_flat))
+        target_locations  = np.sort(decreasing_order[:number_of_targets])
+
+        return target_locations, max(cumulative_mass[-1] - cumulative_mass[number_of_targets - 1], 0.0)
+
+    def best_fixation(self, probability_at_each_fixation):
+        " Get the fixation which maximizes the probability of being correct (cells which weren't computed, if any, are NaN) "
+        coordinates = np.where(probability_at_each_fixation == np.nanmax(probability_at_each_fixation))
+
+        return (coordinates[0][0], coordinates[1][0])
+
+    def search_candidates(self, posteriors):
+        " Computes the probability of being correct at the coarse candidates of self.candidate_search for each posterior, and then at the cells around "
+        " the best of them. The probability maps are NaN on the cells which weren't computed. If the search is verified, the exhaustive maps are returned instead "
+        probability_maps = [np.full(shape=self.grid_size, fill_value=np.nan) for _ in posteriors]
+        self.compute_probability_maps(posteriors, self.integration, [self.candidate_search.coarse_candidates] * len(posteriors), probability_maps)
+        refined_candidates = [self.candidate_search.refined_candidates(probability_at_each_fixation) for probability_at_each_fixation in probability_maps]
+        self.compute_probability_maps(posteriors, self.integration, refined_candidates, probability_maps)
+
+        if not self.candidate_search.verify:
+            for probability_at_each_fixation in probability_maps:
+                self.candidate_search.record(probability_at_each_fixation)
+            return probability_maps
+
+        exhaustive_maps = self.compute_probability_maps(posteriors, self.integration)
+        for probability_at_each_fixation, exhaustive_map in zip(probability_maps, exhaustive_maps):
+            self.candidate_search.record(probability_at_each_fixation, self.best_fixation(probability_at_each_fixation), self.best_fixation(exhaustive_map))
+
+        return exhaustive_maps
+
+    def compute_probability_maps(self, posteriors, integration, candidates=None, probability_maps=None):
+        " Computes the probability of being correct at each fixation for each posterior, with the given integration method (trapezoid or gauss_hermite) "
+        """ Input:
+                candidates (list of lists of (int, int)) : fixations at which the probability is computed, for each posterior (every cell of the grid, by default)
+                probability_maps (list of 2D arrays)     : matrices where the probabilities are stored (new ones are created by default)
+            Output:
+                probability_maps (list of 2D arrays) : probability of being correct at each candidate fixation, for each posterior
+        """
+        if probability_maps is None:
+            probability_maps = [np.empty(shape=self.grid_size) for _ in posteriors]
+        if candidates is None:
+            candidates = [[(row, column) for row in range(self.grid_size[0]) for column in range(self.grid_size[1])]] * len(posteriors)
 
         if self.number_of_processes > 1:
-            self.parallelize_probability_computation(probability_at_each_fixation, posterior)
+            self.parallelize_probability_computation(probability_maps, posteriors, candidates, integration)
         else:
-            self.compute_probability_on_rows(probability_at_each_fixation, posterior, rows=range(self.grid_size[0]))
+            for probability_at_each_fixation, posterior, posterior_candidates in zip(probability_maps, posteriors, candidates):
+                self.compute_probability_at_candidates(probability_at_each_fixation, posterior, posterior_candidates, integration=integration)
 
-        if self.save_probability_maps:
-            utils.save_probability_map(output_path, image_name, probability_at_each_fixation, fixation_number)
-        
-        # Get the fixation which maximizes the probability of being correct
-        coordinates = np.where(probability_at_each_fixation == np.max(probability_at_each_fixation))
-        next_fix    = (coordinates[0][0], coordinates[1][0])
+        return probability_maps
+
+    def compare_integration(self, posteriors, probability_maps, elapsed_time):
+        " Computes the probability maps of the posteriors with the trapezoidal rule, and adds their differences with probability_maps to self.integration_report "
+        " The relative error of each map is measured with respect to its maximum (i.e. the probability of being correct at the next fixation) "
+        start = time.time()
+        reference_maps = self.compute_probability_maps(posteriors, 'trapezoid')
+        report = self.integration_report
+        report['reference_time'] += time.time() - start
+        report['time'] += elapsed_time
 
-        return next_fix      
-    
-    def parallelize_probability_computation(self, probability_at_each_fixation, posterior):
+        for probability_at_each_fixation, reference_map in zip(probability_maps, reference_maps):
+            # Only the cells which were computed are compared
+            absolute_error = np.nanmax(np.abs(probability_at_each_fixation - reference_map))
+            report['maps'] += 1
+            report['max_absolute_error'] = max(report['max_absolute_error'], absolute_error)
+            if np.max(reference_map) > 0:
+                report['max_relative_error'] = max(report['max_relative_error'], absolute_error / np.max(reference_map))
+            if self.best_fixation(probability_at_each_fixation) != self.best_fixation(reference_map):
+                report['changed_fixations'] += 1
+
+    def print_integration_report(self):
+        report = self.integration_report
+        print('Gauss-Hermite quadrature (' + str(len(self.gauss_hermite_nodes)) + ' nodes, ' + self.gauss_hermite_norm_cdf + ') vs trapezoidal rule (' \
+            + str(INTEGRATION_POINTS) + ' points) on ' + str(report['maps']) + ' probability maps')
+        print('Max. absolute error: ' + str(report['max_absolute_error']) + '. Max. relative error: ' + str(report['max_relative_error']))
+        print('Next fixations changed: ' + str(report['changed_fixations']) + '/' + str(report['maps']))
+        print('Time elapsed: ' + str(report['time']) + ' (trapezoidal rule: ' + str(report['reference_time']) + ')')
+
+    def parallelize_probability_computation(self, probability_maps, posteriors, candidates, integration):
         " This method is only executed if self.number_of_processes is greater than one "
-        " It divides the computation of the rows of the matrix probability_at_each_fixation in self.number_of_processes processes "
-        """ Input: 
-                probability_at_each_fixation (2D array) : matrix of the size of the grid which will hold the values of the probability of being correct at each location
-                posterior (2D array) : probability map of the size of the grid
+        " Candidates of every matrix in probability_maps are handed out a row's worth (grid width) at a time to a pool of self.number_of_processes workers, "
+        " so that idle workers take the next pending chunk (dynamic scheduling) "
+        """ Input:
+                probability_maps (list of 2D arrays) : matrices of the size of the grid which will hold the values of the probability of being correct at each location
+                posteriors (list of 2D arrays) : probability maps of the size of the grid, one for each matrix in probability_maps
+                candidates (list of lists of (int, int)) : fixations at which the probability is computed, one list for each matrix in probability_maps
+                integration (string) : integration method (trapezoid or gauss_hermite)
         """
-        try:
-            # Processes will iterate over the rows of probability_at_each_fixation. Divide the rows in equal chunks.
-            number_of_procs  = self.number_of_processes
-            number_of_rows   = self.grid_size[0]
-            remainder        = number_of_rows % number_of_procs
-            indexes          = list(range(number_of_rows)) 
-            chunks = [indexes[i * (number_of_rows // number_of_procs) + min(i, remainder):(i + 1) * (number_of_rows // number_of_procs) + min(i + 1, remainder)] for i in range(number_of_procs)]
-
-            # Create shared memory and allocate the matrix in it
-            shared_mem       = shared_memory.SharedMemory(create=True, size=probability_at_each_fixation.nbytes)
-            shared_matrix    = np.ndarray(probability_at_each_fixation.shape, dtype=probability_at_each_fixation.dtype, buffer=shared_mem.buf)
-            shared_matrix[:] = probability_at_each_fixation[:]
-
-            procs = []
-            for chunk in chunks:
-                proc = Process(target=self.proc_compute_probability_on_chunk, args=(shared_mem.name, posterior, chunk, ))
-                procs.append(proc)
-                proc.start()
-            
-            # Wait for each process to complete
-            for proc in procs:
-                proc.join()
-            
-            # Copy back the data
-            probability_at_each_fixation[:] = shared_matrix[:]
-        finally:
-            # Free and release shared memory
-            shared_mem.close()
-            shared_mem.unlink()
-    
-    def proc_compute_probability_on_chunk(self, matrix_pointer, posterior, chunk):
-        " This method is executed by each process, were self.number_of_processes to be greater than one "
-        " It runs on a subset of the rows on probability_at_each_fixation, which is stored at matrix_pointer "
-        try:
-            # Attach to existing shared memory block
-            shared_mem = shared_memory.SharedMemory(name=matrix_pointer)
-            probability_at_each_fixation = np.ndarray(shape=self.grid_size, dtype=np.float64, buffer=shared_mem.buf)
-
-            self.compute_probability_on_rows(probability_at_each_fixation, posterior, chunk)
-        except KeyboardInterrupt:
-            pass
-        finally:
-            # Clean up
-            shared_mem.close()
-
-    def compute_probability_on_rows(self, probability_at_each_fixation, posterior, rows):
+        if self.workers_pool is None:
+            self.start_workers()
+
+        chunk_size = self.grid_size[1]
+        tasks = [(index, posterior, posterior_candidates[chunk_start:chunk_start + chunk_size], integration) \
+            for index, (posterior, posterior_candidates) in enumerate(zip(posteriors, candidates)) for chunk_start in range(0, len(posterior_candidates), chunk_size)]
+        for index, chunk_candidates, values in self.workers_pool.imap_unordered(compute_probability_in_worker, tasks):
+            probability_maps[index][tuple(np.transpose(chunk_candidates))] = values
+
+    def start_workers(self):
+        " Creates a long-lived pool of workers, which attach (read-only) to a shared memory copy of the visibility map "
+        " Only the posterior and the rows to compute are sent to the workers for each fixation "
+        self.shared_visibility_map, shared_visibility_map_info = self.visibility_map.to_shared_memory()
+        self.workers_pool = Pool(processes=self.number_of_processes, initializer=init_worker, \
+            initargs=(shared_visibility_map_info, self.grid_size, self.norm_cdf_tolerance, self.engine, len(self.gauss_hermite_nodes), self.gauss_hermite_norm_cdf, \
+                self.mode, self.pruning_mass))
+
+    def close(self):
+        " Terminates the pool of workers (if any) and frees the shared memory "
+        " If probability maps were checked against the trapezoidal rule, the differences found are printed (and so is the telemetry of the candidate search, if any) "
+        if self.check_integration and self.integration_report['maps']:
+            self.print_integration_report()
+            self.integration_report['maps'] = 0
+        if self.candidate_search is not None:
+            self.candidate_search.print_telemetry()
+        if self.workers_pool is not None:
+            self.workers_pool.terminate()
+            self.workers_pool.join()
+            self.workers_pool = None
+        if self.shared_visibility_map is not None:
+            self.shared_visibility_map.close()
+            self.shared_visibility_map.unlink()
+            self.shared_visibility_map = None
+
+    def compute_probability_on_rows(self, probability_at_each_fixation, posterior, rows, integration=None):
         " Computes the probability of being correct at each fixation on the given subset of rows of the matrix probability_at_each_fixation "
+        candidates = [(row, column) for row in rows for column in range(self.grid_size[1])]
+        self.compute_probability_at_candidates(probability_at_each_fixation, posterior, candidates, integration)
+
+    def compute_probability_at_candidates(self, probability_at_each_fixation, posterior, candidates, integration=None):
+        " Computes the probability of being correct at the given candidate fixations (list of (int, int)) of the matrix probability_at_each_fixation "
+        " The integration method (trapezoid or gauss_hermite) defaults to the model's "
+        if integration is None:
+            integration = self.integration
         # Ignore user warnings due to masked values
         warnings.filterwarnings('ignore', category=UserWarning)
         # Ignore invalid and divide by zero warnings, they'll be dealt with later
         np.seterr(divide='ignore', invalid='ignore', over='ignore')
 
-        probability_of_being_correct = np.empty(shape=self.grid_size)
-        for possible_nextfix_row in rows: 
-            for possible_nextfix_column in range(self.grid_size[1]):
-                visibility_map_at_fixation = self.visibility_map.at_fixation((possible_nextfix_row, possible_nextfix_column))
-                for possible_target_location_row in range(self.grid_size[0]):
-                    for possible_target_location_column in range(self.grid_size[1]):
-                        probability_of_being_correct[possible_target_location_row, possible_target_location_column] = \
-                            self.compute_conditional_probability(possible_target_location_row, possible_target_location_column, posterior, visibility_map_at_fixation)
+        if self.engine == 'vectorized':
+            self.compute_probability_at_candidates_vectorized(probability_at_each_fixation, posterior, candidates, integration)
+            return
+
+        # Target locations which aren't integrated (in 'pruned' mode) don't add to the probability of being correct
+        target_locations = np.unravel_index(self.target_locations_to_integrate(posterior)[0], self.grid_size)
+        probability_of_being_correct = np.zeros(shape=self.grid_size)
+        for possible_nextfix_row, possible_nextfix_column in candidates:
+            visibility_map_at_fixation = self.visibility_map.at_fixation((possible_nextfix_row, possible_nextfix_column))
+            for possible_target_location_row, possible_target_location_column in zip(*target_locations):
+                probability_of_being_correct[possible_target_location_row, possible_target_location_column] = \
+                    self.compute_conditional_probability(possible_target_location_row, possible_target_location_column, posterior, visibility_map_at_fixation, \
+                        integration=integration)
+
+            probability_at_each_fixation[possible_nextfix_row, possible_nextfix_column] = np.nansum(posterior * probability_of_being_correct)
+
+    def compute_probability_at_candidates_vectorized(self, probability_at_each_fixation, posterior, candidates, integration='trapezoid'):
+        " Same as the loop in compute_probability_at_candidates, but every possible target location is evaluated at once "
+        " Candidate fixations (and, if the grid is small enough, blocks of them) are processed in a single broadcasted pass over the (m, b, w) integrand "
+        " The resulting map is the same as the one computed by the loop (operations are carried out in the same order; tolerance is set at a relative difference of 1e-10) "
+        number_of_cells = self.grid_size[0] * self.grid_size[1]
+        posterior_flat  = posterior.flatten()
+        all_target_locations, _ = self.target_locations_to_integrate(posterior)
+        number_of_targets       = len(all_target_locations)
+
+        # Split candidates and target locations in blocks so that the (m, b) tensors have at most MAX_BLOCK_ELEMENTS
+        pairs_per_block      = max(MAX_BLOCK_ELEMENTS // number_of_cells, 1)
+        candidates_per_block = max(pairs_per_block // number_of_cells, 1)
+        targets_per_block    = min(pairs_per_block, number_of_targets)
+        for block_start in range(0, len(candidates), candidates_per_block):
+            block_candidates = candidates[block_start:block_start + candidates_per_block]
+            visibility_maps  = np.array([self.visibility_map.at_fixation(candidate).flatten() for candidate in block_candidates])
+
+            probability_of_being_correct = np.empty(shape=(len(block_candidates), number_of_targets))
+            for targets_start in range(0, number_of_targets, targets_per_block):
+                targets_block    = slice(targets_start, targets_start + targets_per_block)
+                probability_of_being_correct[:, targets_block] = \
+                    self.compute_conditional_probabilities(all_target_locations[targets_block], posterior_flat, visibility_maps, integration)
+
+            for index, candidate in enumerate(block_candidates):
+                probability_at_each_fixation[candidate] = np.nansum(posterior_flat[all_target_locations] * probability_of_being_correct[index])
+
+    def compute_conditional_probabilities(self, target_locations, posterior, visibility_maps, integration='trapezoid'):
+        " Vectorized version of compute_conditional_probability: operations are the same, but they are broadcasted over every target location and visibility map "
+        """ Input:
+                target_locations (1D array) : indexes of the (flattened) grid cells where the target might be
+                posterior        (1D array) : flattened posterior
+                visibility_maps  (2D array) : flattened visibility maps, one for each candidate fixation
+                integration      (string)   : trapezoid or gauss_hermite
+            Output:
+                probability_of_being_correct (2D array) : conditional probability for each candidate fixation (rows) and target location (columns)
+        """
+        # Axes are (candidate fixation, target location, cell)
+        posterior_at_target_locations  = posterior[target_locations][np.newaxis, :, np.newaxis]
+        visibility_at_target_locations = visibility_maps[:, target_locations][:, :, np.newaxis]
+        visibility_maps = visibility_maps[:, np.newaxis, :]
+
+        b = (-2 * np.log(posterior[np.newaxis, np.newaxis, :] / posterior_at_target_locations) + np.square(visibility_maps) \
+             + np.square(visibility_at_target_locations)) / (2 * visibility_maps)
+        m = visibility_at_target_locations / visibility_maps
+
+        # We ensure the product is only for i != j (normcdf(1000000) = 1)
+        targets_index = np.arange(len(target_locations))
+        m[:, targets_index, target_locations] = 0
+        b[:, targets_index, target_locations] = 1000000
+
+        # Check the limits of the integral (normcdf(-20) = 0 and so will be the product)
+        min_w = np.max(np.where(m > 0, (-20 - b) / m, -np.inf), axis=2)
+        min_w = np.where(min_w < -20, -20, min_w)
+        min_w = np.where(visibility_at_target_locations[:, :, 0] == 0, -20, min_w)
+        max_w = 20
+
+        # Only integrate where the interval is not empty
+        probability_of_being_correct = np.zeros(shape=min_w.shape)
+        to_integrate = np.nonzero(np.logical_not(min_w >= max_w))
+        if integration == 'gauss_hermite':
+            probability_of_being_correct[to_integrate] = self.integrate_gauss_hermite(m[to_integrate], b[to_integrate])
+        else:
+            probability_of_being_correct[to_integrate] = self.integrate(m[to_integrate], b[to_integrate], min_w[to_integrate], max_w)
+
+        return probability_of_being_correct
+
+    def integrate(self, m, b, min_w, max_w):
+        " Integrates phi(w) * prod_i(normcdf(m_i * w + b_i)) from min_w to max_w for each row of m and b "
+        integrals = np.empty(shape=len(min_w))
+        rows_per_block = max(MAX_BLOCK_ELEMENTS // (m.shape[1] * INTEGRATION_POINTS), 1)
+        for block_start in range(0, len(min_w), rows_per_block):
+            block = slice(block_start, block_start + rows_per_block)
+            w_range = np.linspace(min_w[block], max_w, INTEGRATION_POINTS, axis=-1)
+
+            # Axes are (row, cell, w)
+            values_for_normcdf = np.multiply(m[block, :, np.newaxis], w_range[:, np.newaxis, :])
+            values_for_normcdf += b[block, :, np.newaxis]
+            # NaNs can only arise from non-finite values of m and b (i.e. cells where the visibility is zero)
+            if not (np.all(np.isfinite(m[block])) and np.all(np.isfinite(b[block]))):
+                values_for_normcdf[np.isnan(values_for_normcdf)] = 1
+
+            # Use the previously computed normcdf table to get the values needed
+            normcdf_at_values = np.interp(values_for_normcdf, self.norm_cdf_table['x'], self.norm_cdf_table['y'])
+
+            phi_w  = np.exp(-0.5 * np.square(w_range)) / np.sqrt(2 * np.pi)
+            points = phi_w * np.prod(normcdf_at_values, axis=1)
+
+            integrals[block] = np.trapz(points, w_range, axis=-1)
 
-                probability_at_each_fixation[possible_nextfix_row, possible_nextfix_column] = np.nansum(posterior * probability_of_being_correct)
+        return integrals
 
+    def integrate_gauss_hermite(self, m, b):
+        " Integrates phi(w) * prod_i(normcdf(m_i * w + b_i)) over the real line for each row of m and b, with a Gauss-Hermite quadrature rule "
+        " Since phi(w) is the weight function of the rule, the integrand is evaluated at the same len(self.gauss_hermite_nodes) points for every row "
+        " (instead of INTEGRATION_POINTS). Outside of [min_w, 20], either the product or phi(w) is zero, so the result approximates the one of integrate "
+        " normcdf is either evaluated directly (ndtr) or interpolated on a table with evenly spaced columns (see create_uniform_norm_cdf_table). "
+        " Either way, it's clipped to [norm_cdf_tolerance, 1 - norm_cdf_tolerance], as in integrate: the clipped values raised to the number of cells "
+        " weigh on the result regardless of the number of nodes, so the difference between both methods is only due to the quadrature "
+        integrals = np.empty(shape=len(m))
+        rows_per_block = max(MAX_BLOCK_ELEMENTS // (m.shape[1] * len(self.gauss_hermite_nodes)), 1)
+        for block_start in range(0, len(m), rows_per_block):
+            block = slice(block_start, block_start + rows_per_block)
 
-    def compute_conditional_probability(self, target_location_row, target_location_column, posterior, visibility_map_at_fixation, alpha=1):
+            # Axes are (row, cell, w)
+            values_for_normcdf = np.multiply(m[block, :, np.newaxis], self.gauss_hermite_nodes)
+            values_for_normcdf += b[block, :, np.newaxis]
+            if not (np.all(np.isfinite(m[block])) and np.all(np.isfinite(b[block]))):
+                values_for_normcdf[np.isnan(values_for_normcdf)] = 1
+
+            if self.gauss_hermite_norm_cdf == 'ndtr':
+                # Clipped as the normcdf table is, so that both rules integrate the same function
+                normcdf_at_values = np.clip(ndtr(values_for_normcdf), self.norm_cdf_table['y'][0], self.norm_cdf_table['y'][-1])
+            else:
+                normcdf_at_values = self.norm_cdf_from_uniform_table(values_for_normcdf)
+
+            integrals[block] = np.matmul(np.prod(normcdf_at_values, axis=1), self.gauss_hermite_weights)
+
+        return integrals
+
+    def compute_conditional_probability(self, target_location_row, target_location_column, posterior, visibility_map_at_fixation, alpha=1, integration='trapezoid'):
         " Computes the probability of being correct given the visibility map of the next fixation and that the true target location is (target_location_row, target_location_column) "
         posterior_at_target_location  = posterior[target_location_row, target_location_column]
         visibility_at_target_location = visibility_map_at_fixation[target_location_row, target_location_column]
@@ -146,7 +462,10 @@ class BayesianModel:
 
         if min_w >= max_w: return 0
 
-        w_range = np.linspace(min_w, max_w, 50)
+        if integration == 'gauss_hermite':
+            return self.integrate_gauss_hermite(m.flatten()[np.newaxis, :], b.flatten()[np.newaxis, :])[0]
+
+        w_range = np.linspace(min_w, max_w, INTEGRATION_POINTS)
 
         values_for_normcdf = np.matmul(m.flatten()[:, np.newaxis], w_range[np.newaxis, :]) + np.tile(b.flatten()[:, np.newaxis], (1, len(w_range)))
         values_for_normcdf[np.isnan(values_for_normcdf)] = 1
@@ -158,4 +477,23 @@ class BayesianModel:
         phi_w  = np.exp(-0.5 * np.square(w_range)) / np.sqrt(2 * np.pi)
         points = phi_w[np.newaxis, :] * (np.prod(alpha * normcdf_at_values, axis=0) / alpha)
 
-        return np.trapz(points, w_range)
\ No newline at end of file
+        return np.trapz(points, w_range)
+
+""" Each worker of the pool holds its own BayesianModel, which reads the visibility map from shared memory """
+worker_model = None
+
+def init_worker(shared_visibility_map_info, grid_size, norm_cdf_tolerance, engine, gauss_hermite_nodes, gauss_hermite_norm_cdf, mode, pruning_mass):
+    global worker_model
+    # Interruptions are handled by the main process, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    visibility_map = VisibilityMap.from_shared_memory(shared_visibility_map_info)
+    worker_model   = BayesianModel(grid_size, visibility_map, norm_cdf_tolerance, number_of_processes=1, save_probability_maps=False, engine=engine, \
+        gauss_hermite_nodes=gauss_hermite_nodes, gauss_hermite_norm_cdf=gauss_hermite_norm_cdf, mode=mode, pruning_mass=pruning_mass)
+
+def compute_probability_in_worker(task):
+    index, posterior, candidates, integration = task
+    probability_at_each_fixation = np.empty(shape=worker_model.grid_size)
+    worker_model.compute_probability_at_candidates(probability_at_each_fixation, posterior, candidates, integration)
+
+    return index, candidates, probability_at_each_fixation[tuple(np.transpose(candidates))]
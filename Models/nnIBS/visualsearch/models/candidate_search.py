@@ -0,0 +1,62 @@
+import numpy as np
+
+" Coarse-to-fine search of the next fixation, used by the ibs and elm search models instead of scoring every cell of the grid "
+" Candidates on a coarse sub-grid (one every stride cells along each axis) are scored first; then, only the cells around the top_k of them "
+" are scored at full resolution. The next fixation is the best one among all scored cells "
+
+class CandidateSearch:
+    def __init__(self, grid_size, stride, top_k, verify):
+        """ Input:
+                grid_size (int, int) : size of the grid
+                stride (int)         : spacing (in cells) between coarse candidates
+                top_k (int)          : number of coarse candidates around which cells are scored at full resolution
+                verify (bool)        : if True, every cell is scored as well, and the exhaustive choice is kept (and compared against the refined one)
+        """
+        if stride < 1 or top_k < 1:
+            raise ValueError('The stride and the number of coarse candidates to refine must be positive')
+        self.grid_size = grid_size
+        self.stride    = stride
+        self.top_k     = top_k
+        self.verify    = verify
+        # Coarse candidates are the centers of blocks of stride x stride cells
+        self.coarse_candidates = [(row, column) for row in range(stride // 2, grid_size[0], stride) for column in range(stride // 2, grid_size[1], stride)]
+        self.telemetry = {'searches': 0, 'scored_cells': 0, 'verified': 0, 'matches': 0}
+
+    def refined_candidates(self, scores):
+        " Returns the cells (not scored yet) within stride - 1 cells of the top_k coarse candidates "
+        """ Input:
+                scores (2D array) : matrix of the size of the grid with the score of the coarse candidates (NaN on the rest of the cells)
+            Output:
+                candidates (list of (int, int)) : cells to score at full resolution
+        """
+        coarse_scores = np.array([scores[candidate] for candidate in self.coarse_candidates])
+        # Best coarse candidates first (ties are broken in row-major order)
+        best_coarse_candidates = np.argsort(-coarse_scores, kind='stable')[:self.top_k]
+
+        to_score = np.zeros(shape=self.grid_size, dtype=bool)
+        for index in best_coarse_candidates:
+            row, column = self.coarse_candidates[index]
+            to_score[max(row - self.stride + 1, 0):row + self.stride, max(column - self.stride + 1, 0):column + self.stride] = True
+        to_score[np.logical_not(np.isnan(scores))] = False
+
+        return list(zip(*np.nonzero(to_score)))
+
+    def record(self, scores, chosen_fixation=None, exhaustive_fixation=None):
+        " Adds a search, where the cells with a score (i.e. not NaN) in scores were scored, to the telemetry "
+        " If the search was verified, the fixation chosen by the coarse-to-fine search is compared against the exhaustive one "
+        self.telemetry['searches']     += 1
+        self.telemetry['scored_cells'] += np.count_nonzero(np.logical_not(np.isnan(scores)))
+        if exhaustive_fixation is not None:
+            self.telemetry['verified'] += 1
+            self.telemetry['matches']  += tuple(chosen_fixation) == tuple(exhaustive_fixation)
+
+    def print_telemetry(self):
+        telemetry = self.telemetry
+        if not telemetry['searches']:
+            return
+        total_cells = telemetry['searches'] * self.grid_size[0] * self.grid_size[1]
+        print('Coarse-to-fine candidate search (stride ' + str(self.stride) + ', top ' + str(self.top_k) + '): ' + str(telemetry['searches']) + ' fixations, ' \
+            + str(telemetry['scored_cells']) + '/' + str(total_cells) + ' cells scored')
+        if telemetry['verified']:
+            print('Refined choice matches the exhaustive one: ' + str(telemetry['matches']) + '/' + str(telemetry['verified']))
+        self.telemetry = {'searches': 0, 'scored_cells': 0, 'verified': 0, 'matches': 0}
@@ -1,7 +1,9 @@
 import numpy as np
-from os import path
+from os import path, makedirs, replace, getpid
+from concurrent.futures import ProcessPoolExecutor
 from .utils import utils
-from .utils.deepgaze.create_saliencymap import create_saliencymap_for_image
+
+""" Priors are stored as float32 .npy files (named after the image) inside prior_dir/prior_name. Previously saved images (such as .jpg) are still read """
 
 def load(image, image_name, image_size, prior_name, prior_dir):
     " Returns initial probability of the target being there for each position in the image "
@@ -18,16 +20,70 @@ def load(image, image_name, image_size, prior_name, prior_dir):
     prior_path = path.join(prior_dir, prior_name)
     if prior_name == 'noisy':
         prior = utils.add_white_gaussian_noise(np.ones(shape=image_size), snr_db=25)
-    else:
-        if not path.exists(path.join(prior_path, image_name)):
-            create_saliencymap_for_image(image, path.join(prior_path, image_name))
+    elif path.exists(prior_file(prior_path, image_name)):
+        prior = np.load(prior_file(prior_path, image_name))
+    elif path.exists(path.join(prior_path, image_name)):
         prior = utils.load_image(prior_path, image_name)
+    else:
+        # Priors are usually precomputed for the whole dataset (see precompute); compute it on the spot otherwise
+        from .utils.deepgaze.create_saliencymap import get_model
+        prior = get_model().predict([image])[0]
+        save(prior, prior_path, image_name)
 
     # Normalize values
     prior = prior / np.max(prior)
 
     return prior
 
+def precompute(image_names, images_dir, image_size, prior_name, prior_dir, batch_size=4, number_of_processes=1):
+    " Computes the DeepGaze II prior of every image which doesn't have one yet, in batches of batch_size images "
+    " Each process loads DeepGaze II once and reuses it for all of its batches "
+    """ Input:
+            image_names (list of strings) : names of the images on which the prior will be used
+            images_dir  (string)   : folder path where search images are stored
+            image_size  (int, int) : size of the images on which the model operates
+            prior_name  (string)   : only deepgaze priors are computed; other priors are just read
+            prior_dir   (string)   : where to store the priors. It uses the prior_name as subdirectory
+            batch_size  (int)      : number of images fed to DeepGaze II at once
+            number_of_processes (int) : number of processes among which the batches are split
+        Output:
+            prior_dir/prior_name/<image>.npy : prior of each image, stored losslessly
+    """
+    if prior_name != 'deepgaze':
+        return
+    prior_path = path.join(prior_dir, prior_name)
+    missing_priors = sorted(set(image_name for image_name in image_names \
+        if not path.exists(prior_file(prior_path, image_name)) and not path.exists(path.join(prior_path, image_name))))
+    if not missing_priors:
+        return
+
+    print('Computing the prior of ' + str(len(missing_priors)) + ' images...')
+    batches = [missing_priors[index:index + batch_size] for index in range(0, len(missing_priors), batch_size)]
+    if number_of_processes > 1:
+        # DeepGaze II is never loaded in the parent process, so each worker opens its own session
+        with ProcessPoolExecutor(max_workers=min(number_of_processes, len(batches))) as executor:
+            list(executor.map(compute_batch, batches, [images_dir] * len(batches), [tuple(image_size)] * len(batches), [prior_path] * len(batches)))
+    else:
+        for batch in batches:
+            compute_batch(batch, images_dir, tuple(image_size), prior_path)
+
+def compute_batch(image_names, images_dir, image_size, prior_path):
+    from .utils.deepgaze.create_saliencymap import get_model
+    images = [utils.load_image(images_dir, image_name, image_size) for image_name in image_names]
+    priors = get_model().predict(images)
+    for image_name, image_prior in zip(image_names, priors):
+        save(image_prior, prior_path, image_name)
+
+def prior_file(prior_path, image_name):
+    return path.join(prior_path, path.splitext(image_name)[0] + '.npy')
+
+def save(image_prior, prior_path, image_name):
+    makedirs(prior_path, exist_ok=True)
+    # Write to a temporary file first, so that concurrent trials never read a partially written prior
+    temporary_file = prior_file(prior_path, image_name)[:-len('.npy')] + '.' + str(getpid()) + '.tmp.npy'
+    np.save(temporary_file, np.asarray(image_prior, dtype=np.float32))
+    replace(temporary_file, prior_file(prior_path, image_name))
+
 # TODO: Definir para qué sirve la función y asignarle mejores nombres
 def sum(prior, max_saccades):
     """ Input:
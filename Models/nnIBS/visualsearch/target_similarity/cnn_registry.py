@@ -0,0 +1,58 @@
+import torch
+import torch.nn as nn
+from torchvision.models import vgg16, VGG16_Weights, efficientnet_b1, EfficientNet_B1_Weights, resnext101_32x8d, ResNeXt101_32X8D_Weights
+
+""" Process-wide registry of the CNNs used by the IVSN-based target similarity methods.
+    Each backbone is loaded (and set in evaluation mode) the first time it is requested, and then it is reused by every trial run by the process.
+"""
+
+loaded_backbones = {}
+
+def get_backbone(name):
+    " Returns the models which compute the feature maps of the image and of the target, respectively, for the given backbone "
+    """ Input:
+            name (string) : vgg16, efficientnet_b1 or resnext101
+        Output:
+            model_image, model_target (nn.Module) : models in evaluation mode
+    """
+    if name not in loaded_backbones:
+        if name not in BACKBONES:
+            raise ValueError('Invalid backbone, valid options are: ' + ', '.join(BACKBONES.keys()))
+        model_image, model_target = BACKBONES[name]()
+        model_image.eval()
+        model_target.eval()
+        loaded_backbones[name] = (model_image, model_target)
+
+    return loaded_backbones[name]
+
+def set_number_of_threads(number_of_threads):
+    " Sets the number of threads used by torch for intra-op parallelism "
+    if torch.get_num_threads() != number_of_threads:
+        torch.set_num_threads(number_of_threads)
+
+def load_vgg16():
+    model = vgg16(weights=VGG16_Weights.IMAGENET1K_V1)
+    num_layers = 31
+
+    model_target = nn.Sequential(*list(model.features.children())[:num_layers])
+    model_image  = nn.Sequential(*list(model.features.children())[:(num_layers - 1)])
+
+    return model_image, model_target
+
+def load_efficientnet_b1():
+    model = efficientnet_b1(weights=EfficientNet_B1_Weights.IMAGENET1K_V1)
+
+    model_image  = model.features
+    model_target = nn.Sequential(model_image, nn.AdaptiveMaxPool2d(output_size=1))
+
+    return model_image, model_target
+
+def load_resnext101():
+    model = resnext101_32x8d(weights=ResNeXt101_32X8D_Weights.IMAGENET1K_V2)
+
+    model_image  = nn.Sequential(*list(model.children())[:-2])
+    model_target = nn.Sequential(model_image, nn.AdaptiveMaxPool2d(output_size=1))
+
+    return model_image, model_target
+
+BACKBONES = {'vgg16': load_vgg16, 'efficientnet_b1': load_efficientnet_b1, 'resnext101': load_resnext101}
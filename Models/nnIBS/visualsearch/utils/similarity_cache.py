@@ -0,0 +1,94 @@
+import hashlib
+import json
+import numpy as np
+from os import makedirs, path, remove, replace, listdir, stat, utime, getpid
+
+""" Content-addressed cache of target similarity maps.
+    Each map is stored as a float32 .npy file (which can be memory-mapped), named after a hash of everything it depends on:
+    the search image, the target, its bounding box, the method (and its version) and the image size on which the model operates.
+    What each entry corresponds to is saved alongside it, in a .json file of the same name (one per entry, so that processes storing maps at the same time
+    never overwrite each other's descriptions). When the cache exceeds its maximum size, the least recently used entries are evicted.
+"""
+
+class SimilarityCache:
+    def __init__(self, cache_dir, max_size_mb):
+        " Creates a cache of target similarity maps in cache_dir, which is shared by every process (and model) using the same folder "
+        """ Input:
+                cache_dir (string)  : folder path where the target similarity maps are stored
+                max_size_mb (float) : maximum size of the cache, in megabytes
+        """
+        self.cache_dir = cache_dir
+        self.max_size  = max_size_mb * 2 ** 20
+        self.hits      = 0
+        self.misses    = 0
+
+    def key(self, method, version, image, target, target_bbox):
+        " Returns the key of the target similarity map computed by method on the given image and target "
+        hash_function = hashlib.sha256()
+        for array in [image, target]:
+            array = np.ascontiguousarray(array)
+            hash_function.update(str((array.shape, array.dtype.str)).encode())
+            hash_function.update(array.tobytes())
+        hash_function.update(str((list(map(int, target_bbox)), method, version)).encode())
+
+        return hash_function.hexdigest()
+
+    def load(self, key):
+        " Returns the (memory-mapped) target similarity map stored under key, or None if there isn't one "
+        file_path = path.join(self.cache_dir, key + '.npy')
+        try:
+            target_similarity_map = np.load(file_path, mmap_mode='r')
+            # Mark it as recently used
+            utime(file_path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+
+        return target_similarity_map
+
+    def store(self, key, target_similarity_map, description):
+        " Stores the target similarity map under key, evicting the least recently used entries if the cache exceeds its maximum size "
+        """ Input:
+                key (string) : key returned by self.key
+                target_similarity_map (2D array) : map to store, as float32
+                description (dict) : what the map corresponds to (such as the names of the image and the target), saved in key.json
+        """
+        makedirs(self.cache_dir, exist_ok=True)
+        # Write to a temporary file first, so that other processes never read a partially written map
+        temporary_file = path.join(self.cache_dir, key + '.' + str(getpid()) + '.tmp.npy')
+        np.save(temporary_file, np.asarray(target_similarity_map, dtype=np.float32))
+        replace(temporary_file, path.join(self.cache_dir, key + '.npy'))
+        self.save_description(key, description)
+
+        self.evict()
+
+    def evict(self):
+        " Removes the least recently used maps until the size of the cache is below its maximum "
+        entries = []
+        for filename in listdir(self.cache_dir):
+            if filename.endswith('.npy') and not filename.endswith('.tmp.npy'):
+                try:
+                    file_stats = stat(path.join(self.cache_dir, filename))
+                except FileNotFoundError:
+                    continue
+                entries.append((file_stats.st_mtime, file_stats.st_size, filename))
+
+        cache_size = sum(entry[1] for entry in entries)
+        for _, file_size, filename in sorted(entries):
+            if cache_size <= self.max_size:
+                break
+            for entry_file in [filename, filename[:-len('.npy')] + '.json']:
+                try:
+                    remove(path.join(self.cache_dir, entry_file))
+                except FileNotFoundError:
+                    # Already evicted by another process
+                    pass
+            cache_size -= file_size
+
+    def save_description(self, key, description):
+        temporary_file = path.join(self.cache_dir, key + '.' + str(getpid()) + '.tmp.json')
+        with open(temporary_file, 'w') as json_file:
+            json.dump(description, json_file, indent=4)
+        replace(temporary_file, path.join(self.cache_dir, key + '.json'))
+
@@ -3,8 +3,9 @@ import argparse
 import utils
 import importlib
 import Metrics.main as metrics_module
+from Metrics.scripts import trials_journal
 
-def main(datasets, models, metrics, force_execution):
+def main(datasets, models, metrics, force_execution, resume='auto'):
     for dataset_name in datasets:
         for model_name in models:
             if force_execution: utils.delete_precomputed_results(dataset_name, model_name)
@@ -15,7 +16,7 @@ def main(datasets, models, metrics, force_execution):
                 
             print('Running ' + model_name + ' on ' + dataset_name + ' dataset')
             model = importlib.import_module(constants.MODELS_PATH + '.' + model_name + '.main')
-            model.main(dataset_name)
+            model.main(dataset_name, resume=resume)
     
     if metrics:
         cum_perf   = 'perf' in metrics
@@ -36,6 +37,8 @@ if __name__ == "__main__":
     parser.add_argument('--mts', '--metrics', type=str, nargs='*', default=available_metrics, help='Names of the metrics to compute. \
         Values must be in list: ' + str(available_metrics) + '. Leave blank to not run any. WARNING: If not precomputed, human scanpath prediction (hsp) will take a LONG time!')
     parser.add_argument('--f', '--force', action='store_true', help='Deletes all precomputed results and forces models\' execution.')
+    parser.add_argument('--r', '--resume', type=str, choices=trials_journal.RESUME_OPTIONS, default='auto', help='What to do if a previous execution of a model was interrupted: \
+        resume it (auto), start over (never) or ask. Default is auto.')
 
     args = parser.parse_args()
     invalid_models   = not all(model in available_models for model in args.m)
@@ -44,4 +47,4 @@ if __name__ == "__main__":
     if (not args.m or invalid_models) or (not args.d or invalid_datasets) or invalid_metrics:
         raise ValueError('Invalid set of models, datasets or metrics')
 
-    main(args.d, args.m, args.mts, args.f)
\ No newline at end of file
+    main(args.d, args.m, args.mts, args.f, args.r)
\ No newline at end of file
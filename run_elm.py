@@ -7,10 +7,11 @@ import argparse
 import utils
 import constants as global_constants
 import Metrics.main as metrics_module
+from Metrics.scripts import trials_journal
 
 " Runs visualsearch/main.py according to the supplied parameters "
 
-def setup_and_run(dataset_name, config_name, image_name, image_range, human_subject, number_of_processes, save_probability_maps):
+def setup_and_run(dataset_name, config_name, image_name, image_range, human_subject, number_of_processes, save_probability_maps, resume='auto'):
     dataset_path = path.join(constants.DATASETS_PATH, dataset_name)
     output_path  = path.join(constants.RESULTS_PATH, path.join(dataset_name + '_dataset', 'nnIBS'))
 
@@ -18,7 +19,7 @@ def setup_and_run(dataset_name, config_name, image_name, image_range, human_subj
 
     dataset_info      = loader.load_dataset_info(dataset_path)
     output_path       = loader.create_output_folders(output_path, config_name, image_name, image_range, human_subject)
-    checkpoint        = loader.load_checkpoint(output_path)
+    checkpoint        = loader.load_checkpoint(output_path, resume)
     human_scanpaths   = loader.load_human_scanpaths(dataset_info['scanpaths_dir'], human_subject)
     config            = loader.load_config(constants.CONFIG_DIR, config_name, constants.IMAGE_SIZE, dataset_info['max_scanpath_length'], number_of_processes, save_probability_maps, human_scanpaths, checkpoint)
     trials_properties = loader.load_trials_properties(trials_properties_file, image_name, image_range, human_scanpaths, checkpoint)
@@ -29,8 +30,8 @@ def setup_and_run(dataset_name, config_name, image_name, image_range, human_subj
     return config['search_model']
     
 """ Main method, added to be polymorphic with respect to the other models """
-def main(dataset_name, config_name=constants.CONFIG_NAME, human_subject=None, metrics=None, models=None):
-    models = setup_and_run(dataset_name, config_name=config_name, image_name=None, image_range=None, human_subject=human_subject, number_of_processes=constants.NUMBER_OF_PROCESSES, save_probability_maps=False)
+def main(dataset_name, config_name=constants.CONFIG_NAME, human_subject=None, metrics=None, models=None, resume='auto'):
+    models = setup_and_run(dataset_name, config_name=config_name, image_name=None, image_range=None, human_subject=human_subject, number_of_processes=constants.NUMBER_OF_PROCESSES, save_probability_maps=False, resume=resume)
     # breakpoint()
     if metrics:
         cum_perf   = 'perf' in metrics
@@ -55,6 +56,8 @@ if __name__ == "__main__":
         Values must be in list: ' + str(available_models))
     parser.add_argument('--m', '--metrics', type=str, nargs='*', default='perf mm', help='Names of the metrics to calculate. \
         Values must be in list: ' + str(available_metrics))
+    parser.add_argument('--r', '--resume', type=str, choices=trials_journal.RESUME_OPTIONS, default='auto', help='What to do if a previous execution was interrupted: \
+        resume it (auto), start over (never) or ask. Default is auto.')
     args = parser.parse_args()
     
-    main(args.d, config_name=args.c, metrics=args.m)
\ No newline at end of file
+    main(args.d, config_name=args.c, metrics=args.m, resume=args.r)
\ No newline at end of file